@@ -5,8 +5,15 @@ import yaml
 from tqdm import tqdm
 from dotenv import load_dotenv
 from pathlib import Path
+from llm_client.cache import ResponseCache
+from llm_client.client import ChatClient
+from llm_client.pool import ClientPool
+from llm_client.ledger import CallLedger
+from llm_client.batch import BatchRunner
 from data_generation.cap.constraint_extractor import ConstraintExtractor
 from data_generation.cap.utterance_generator import UtteranceGenerator
+from data_generation.cap.pipeline import CAPPipeline
+from data_generation.journal import GenerationJournal
 
 env_path = Path(__file__).resolve().parent.parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
@@ -26,6 +33,56 @@ def load_config(path: Path) -> dict:
     return cfg
 
 
+def run_batch_generation(batch_runner: BatchRunner, extractor: ConstraintExtractor, utterance_generator: UtteranceGenerator,
+                         oas_path: str, output_folder: Path, utterances: int, llm_temp: float) -> None:
+    """Generates the dataset through the batch API: one batch job for the constraint extraction
+    of all pending APIs, then one batch job for the utterance generation."""
+    api_paths = {}
+    for category in sorted(os.listdir(oas_path)):
+        for root, _, files in os.walk(os.path.join(oas_path, category)):
+            for filename in files:
+                api_paths[filename] = os.path.join(root, filename)
+
+    # 1 - extracting the constraints of all APIs without a constraints file
+    pending = [filename for filename in api_paths if not os.path.exists(os.path.join(output_folder, "constraints", filename))]
+    requests = []
+    for filename in pending:
+        requests.extend(extractor.batch_requests(api_paths[filename], llm_temp, custom_id_prefix=filename))
+    responses = batch_runner.run(requests, job_name="constraints")
+
+    os.makedirs(os.path.join(output_folder, "constraints"), exist_ok=True)  # create output directory if not exists
+    for filename in pending:
+        constraints = extractor.apply_batch_responses(api_paths[filename], responses, custom_id_prefix=filename)
+        if constraints is None:
+            print(f"Missing batch responses for the constraints of {filename}, it will be retried in the next run")
+            continue
+        with open(os.path.join(output_folder, "constraints", filename), "w") as f:
+            json.dump(constraints, f, indent=4)
+        print(f"✅ Saved extracted constraints of {filename}")
+
+    # 2 - generating the utterances of all APIs with constraints but without an utterances file
+    pending = [filename for filename in api_paths
+               if os.path.exists(os.path.join(output_folder, "constraints", filename))
+               and not os.path.exists(os.path.join(output_folder, "utterances", filename))]
+    documentations = {}
+    requests = []
+    for filename in pending:
+        with open(os.path.join(output_folder, "constraints", filename), "r") as f:
+            documentations[filename] = json.load(f)
+        requests.extend(utterance_generator.batch_requests(documentations[filename], utterances, llm_temp, custom_id_prefix=filename))
+    responses = batch_runner.run(requests, job_name="utterances")
+
+    os.makedirs(os.path.join(output_folder, "utterances"), exist_ok=True)  # create output directory if not exists
+    for filename in pending:
+        oas_with_utterances = utterance_generator.apply_batch_responses(documentations[filename], responses, custom_id_prefix=filename)
+        if oas_with_utterances is None:
+            print(f"Missing batch responses for the utterances of {filename}, it will be retried in the next run")
+            continue
+        with open(os.path.join(output_folder, "utterances", filename), "w") as f:
+            json.dump(oas_with_utterances, f, indent=4)
+        print(f"✅ Saved OAS with utterances of {filename}")
+
+
 def main():
     # 1 - loading config information
     cfg = load_config(Path(__file__).parent.parent.parent / "config" / "config_gen_data.yaml")
@@ -33,20 +90,81 @@ def main():
     llm_url = cfg["llm_url"]
     llm_temp = cfg.get("llm_temp", 1.0)
     utterances = cfg.get("utterances", 10)
+    max_concurrency = cfg.get("max_concurrency", 1)
     oas_path = cfg["oas_path"]
     output_folder = Path(cfg["output_folder"], (llm_name.split('/')[-1]).lower(), "constraint-aware")
+    cache = ResponseCache.from_config(cfg.get("llm_cache"))
+    journal = GenerationJournal(os.path.join(output_folder, "journal.jsonl")) if cfg.get("journal", False) else None
+    ledger = CallLedger.from_config(cfg.get("llm_ledger", False), os.path.join(output_folder, "llm_ledger.jsonl"))
+    structured_output = cfg.get("structured_output") or {}
+    repair_existing = structured_output.get("repair_existing", False)
     api_key = os.getenv("DEEPINFRA_API_KEY")
 
-    # 2 - initializing extractor and utterance generator
-    extractor = ConstraintExtractor(api_key=api_key, base_url=llm_url,model_name=llm_name)
-    utterance_generator = UtteranceGenerator(api_key=api_key, base_url=llm_url, model_name=llm_name)
+    # 2 - initializing extractor and utterance generator (through a client pool when several endpoints are given)
+    if cfg.get("llm_endpoints"):
+        llm_client = ClientPool.from_config(cfg["llm_endpoints"], model_name=llm_name, cache=cache, ledger=ledger)
+    else:
+        llm_client = ChatClient(api_key=api_key, base_url=llm_url, model_name=llm_name, cache=cache, ledger=ledger)
+    extractor = ConstraintExtractor(api_key=api_key, base_url=llm_url, model_name=llm_name, max_concurrency=max_concurrency, cache=cache, journal=journal, llm_client=llm_client,
+                                    structured_output=structured_output.get("enabled", False),
+                                    max_parse_retries=structured_output.get("max_retries", 2))
+    utterance_generator = UtteranceGenerator(api_key=api_key, base_url=llm_url, model_name=llm_name, cache=cache, journal=journal, llm_client=llm_client,
+                                             structured_output=structured_output.get("enabled", False),
+                                             max_parse_retries=structured_output.get("max_retries", 2),
+                                             streaming=cfg.get("streaming", False))
 
-    # 3 - iterating through all OAS files
+    # 3 - batch mode: all requests are submitted to the batch API instead of being sent one by one
+    batch_runner = BatchRunner.from_config(cfg.get("batch"), api_key=api_key, base_url=llm_url, model_name=llm_name, cache=cache,
+                                          llm_client=llm_client)
+    if batch_runner is not None:
+        run_batch_generation(batch_runner, extractor, utterance_generator, oas_path, output_folder, utterances, llm_temp)
+        return
+
+    # 4 - pipeline mode: constraint extraction and utterance generation run concurrently in separate stages
+    pipeline_cfg = cfg.get("pipeline", {})
+    if pipeline_cfg.get("enabled", False):
+        api_files = []
+        for category in sorted(os.listdir(oas_path)):
+            for root, _, files in os.walk(os.path.join(oas_path, category)):
+                api_files.extend((filename, os.path.join(root, filename)) for filename in files)
+        pipeline = CAPPipeline(extractor, utterance_generator, output_folder,
+                               num_utterances=utterances,
+                               temperature=llm_temp,
+                               max_concurrency=max_concurrency,
+                               extraction_workers=pipeline_cfg.get("extraction_workers", 2),
+                               generation_workers=pipeline_cfg.get("generation_workers", 2),
+                               queue_size=pipeline_cfg.get("queue_size", 4))
+        failed = pipeline.run(api_files)
+        if failed:
+            print(f"{len(failed)} APIs failed and will be retried in the next run: {failed}")
+        if cache is not None:
+            print(f"LLM cache stats: {cache.stats()}")
+        if isinstance(llm_client, ClientPool):
+            print(f"LLM endpoint stats: {llm_client.stats()}")
+        return
+
+    # 5 - iterating through all OAS files
     categories = sorted(os.listdir(oas_path))
     for category_index, category in enumerate(tqdm(categories, desc="Categories")):
         category_path = os.path.join(oas_path, category)
 
         for root, _, files in os.walk(category_path):
+            # 0 - extracting constraints of all pending APIs of the category concurrently
+            if max_concurrency > 1:
+                pending = [filename for filename in files if not os.path.exists(os.path.join(output_folder, "constraints", filename))]
+                if pending:
+                    api_paths = [os.path.join(category_path, filename) for filename in pending]
+                    documentations = extractor.extract_constraints_concurrently(api_paths, llm_temp, max_concurrency)
+                    os.makedirs(os.path.join(output_folder, "constraints"), exist_ok=True)  # create output directory if not exists
+                    for filename, constraints in zip(pending, documentations):
+                        if constraints is None:
+                            continue  # failed: extracted again (sequentially) below
+                        with open(os.path.join(output_folder, "constraints", filename), "w") as f:
+                            json.dump(constraints, f, indent=4)
+                        if journal is not None:
+                            journal.compact(constraints["name"], "constraints")
+                        print(f"✅ Saved extracted constraints of {filename}")
+
             for filename in files:
                 if not os.path.exists(os.path.join(output_folder, filename)):
                     file_path = os.path.join(category_path, filename)  # path to the API spec file 
@@ -60,6 +178,8 @@ def main():
                         print(f"Output file: {output_file}")
                         with open(output_file, "w") as f:
                             json.dump(constraints, f, indent=4)
+                        if journal is not None:
+                            journal.compact(constraints["name"], "constraints")
                         print(f"✅ Saved extracted constraints of {filename}")
                     else:
                         with open(os.path.join(output_folder, "constraints", filename), "r") as f:
@@ -69,14 +189,31 @@ def main():
                     # 2 - check whether the constraints file already exists
                     if not os.path.exists(os.path.join(output_folder, "utterances", filename)):
                         # generating constraint-aware utterances                    
-                        oas_with_utterances = utterance_generator.generate_utterances(constraints, num_utterances=utterances, temperature=llm_temp)
+                        oas_with_utterances = utterance_generator.generate_utterances(constraints, num_utterances=utterances, temperature=llm_temp, max_concurrency=max_concurrency)
                         os.makedirs(os.path.join(output_folder, "utterances"), exist_ok=True)  # create output directory if not exists 
                         output_file = os.path.join(output_folder, "utterances" , filename)
                         with open(output_file, "w") as f:
                             json.dump(oas_with_utterances, f, indent=4)
+                        if journal is not None:
+                            journal.compact(oas_with_utterances["name"], "utterances")
                         print(f"✅ Saved OAS with utterances of {filename}")
+                    elif repair_existing:
+                        # regenerating only the methods whose output could not be parsed
+                        with open(os.path.join(output_folder, "utterances", filename), "r") as f:
+                            oas_with_utterances = json.load(f)
+                        if any(isinstance(api_method.get('utterances'), str) for api_method in oas_with_utterances['api_methods']):
+                            oas_with_utterances = utterance_generator.generate_utterances(oas_with_utterances, num_utterances=utterances, temperature=llm_temp,
+                                                                                          max_concurrency=max_concurrency, only_failed=True)
+                            with open(os.path.join(output_folder, "utterances", filename), "w") as f:
+                                json.dump(oas_with_utterances, f, indent=4)
+                            print(f"✅ Repaired the failed methods of {filename}")
                     else:
                         print(f"The file {filename} already has utterances")
 
+    if cache is not None:
+        print(f"LLM cache stats: {cache.stats()}")
+    if isinstance(llm_client, ClientPool):
+        print(f"LLM endpoint stats: {llm_client.stats()}")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
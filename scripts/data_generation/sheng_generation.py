@@ -5,6 +5,12 @@ import yaml
 from tqdm import tqdm
 from dotenv import load_dotenv
 from pathlib import Path
+from llm_client.cache import ResponseCache
+from llm_client.client import ChatClient
+from llm_client.pool import ClientPool
+from llm_client.ledger import CallLedger
+from data_generation.journal import GenerationJournal
+from llm_client.batch import BatchRunner
 from data_generation.sheng.utterance_generator import UtteranceGenerator
 
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -24,6 +30,32 @@ def load_config(path: Path) -> dict:
             sys.exit(1)
     return cfg
 
+def run_batch_generation(batch_runner: BatchRunner, utterance_generator: UtteranceGenerator,
+                         oas_path: str, output_folder: Path, utterances: int, llm_temp: float) -> None:
+    """Generates the utterances of all pending APIs in a single batch job."""
+    pending = {}
+    for category in sorted(os.listdir(oas_path)):
+        for root, _, files in os.walk(os.path.join(oas_path, category)):
+            for filename in files:
+                if not os.path.exists(os.path.join(output_folder, "utterances", filename)):
+                    with open(os.path.join(root, filename), 'r') as f:
+                        pending[filename] = json.load(f)
+
+    requests = []
+    for filename, data in pending.items():
+        requests.extend(utterance_generator.batch_requests(data, utterances, llm_temp, custom_id_prefix=filename))
+    responses = batch_runner.run(requests, job_name="utterances")
+
+    os.makedirs(os.path.join(output_folder, "utterances"), exist_ok=True)  # create output directory if not exists
+    for filename, data in pending.items():
+        oas_with_utterances = utterance_generator.apply_batch_responses(data, responses, custom_id_prefix=filename)
+        if oas_with_utterances is None:
+            print(f"Missing batch responses for the utterances of {filename}, it will be retried in the next run")
+            continue
+        with open(os.path.join(output_folder, "utterances", filename), "w") as f:
+            json.dump(oas_with_utterances, f, indent=4)
+        print(f"✅ Saved OAS with utterances of {filename}")
+
 def main():
     # 1 - loading config information
     cfg = load_config(Path(__file__).parent.parent / "config" / "config_gen_data.yaml")
@@ -31,14 +63,36 @@ def main():
     llm_url = cfg["llm_url"]
     llm_temp = cfg.get("llm_temp", 1.0)
     utterances = cfg.get("utterances", 10)
+    max_concurrency = cfg.get("max_concurrency", 1)
+    packing = cfg.get("packing") or {}
+    packing_token_budget = packing.get("token_budget", 2000) if packing.get("enabled", False) else 0
     oas_path = cfg["oas_path"]
     output_folder = Path(cfg["output_folder"], (llm_name.split('/')[-1]).lower(), "sheng")
+    cache = ResponseCache.from_config(cfg.get("llm_cache"))
+    journal = GenerationJournal(os.path.join(output_folder, "journal.jsonl")) if cfg.get("journal", False) else None
+    ledger = CallLedger.from_config(cfg.get("llm_ledger", False), os.path.join(output_folder, "llm_ledger.jsonl"))
+    structured_output = cfg.get("structured_output") or {}
+    repair_existing = structured_output.get("repair_existing", False)
     api_key = os.getenv("DEEPINFRA_API_KEY")
 
-    # 2 - initializing extractor and utterance generator
-    utterance_generator = UtteranceGenerator(api_key=api_key, base_url=llm_url, model_name=llm_name)
+    # 2 - initializing extractor and utterance generator (through a client pool when several endpoints are given)
+    if cfg.get("llm_endpoints"):
+        llm_client = ClientPool.from_config(cfg["llm_endpoints"], model_name=llm_name, cache=cache, ledger=ledger)
+    else:
+        llm_client = ChatClient(api_key=api_key, base_url=llm_url, model_name=llm_name, cache=cache, ledger=ledger)
+    utterance_generator = UtteranceGenerator(api_key=api_key, base_url=llm_url, model_name=llm_name, cache=cache, journal=journal, llm_client=llm_client,
+                                             structured_output=structured_output.get("enabled", False),
+                                             max_parse_retries=structured_output.get("max_retries", 2),
+                                             streaming=cfg.get("streaming", False))
 
-    # 3 - iterating through all OAS files
+    # 3 - batch mode: all requests are submitted to the batch API instead of being sent one by one
+    batch_runner = BatchRunner.from_config(cfg.get("batch"), api_key=api_key, base_url=llm_url, model_name=llm_name, cache=cache,
+                                          llm_client=llm_client)
+    if batch_runner is not None:
+        run_batch_generation(batch_runner, utterance_generator, oas_path, output_folder, utterances, llm_temp)
+        return
+
+    # 4 - iterating through all OAS files
     categories = sorted(os.listdir(oas_path))
     for category_index, category in enumerate(tqdm(categories, desc="Categories")):
         category_path = os.path.join(oas_path, category)
@@ -48,21 +102,39 @@ def main():
                 if not os.path.exists(os.path.join(output_folder, filename)):
                     file_path = os.path.join(category_path, filename)  # path to the API spec file 
                     
-                    # 1 - check whether the output file already exists
+                    # 1 - check whether the output file already exists (with `repair_existing`, its failed methods are generated again)
+                    only_failed = False
                     if os.path.exists(os.path.join(output_folder, "utterances", filename)):
-                        continue
-
-                    # 2 - reading OAS file
-                    with open(file_path, 'r') as f:
-                        data = json.load(f)
+                        if not repair_existing:
+                            continue
+                        with open(os.path.join(output_folder, "utterances", filename), 'r') as f:
+                            data = json.load(f)
+                        if all(isinstance(api_method.get('utterances'), list) for api_method in data['api_list']):
+                            continue
+                        only_failed = True
+                    else:
+                        # 2 - reading OAS file
+                        with open(file_path, 'r') as f:
+                            data = json.load(f)
 
                     # 3 - generating constraint-aware utterances
-                    oas_with_utterances = utterance_generator.generate_utterances(data, num_utterances=utterances, temperature=llm_temp)
+                    oas_with_utterances = utterance_generator.generate_utterances(data, num_utterances=utterances, temperature=llm_temp, max_concurrency=max_concurrency,
+                                                                                packing_token_budget=packing_token_budget,
+                                                                                packing_max_parameters=packing.get("max_parameters", 2),
+                                                                                packing_max_output_tokens=packing.get("max_output_tokens", 8192),
+                                                                                only_failed=only_failed)
                     os.makedirs(os.path.join(output_folder, "utterances"), exist_ok=True)  # create output directory if not exists 
                     output_file = os.path.join(output_folder, "utterances" , filename)
                     with open(output_file, "w") as f:
                         json.dump(oas_with_utterances, f, indent=4)
+                    if journal is not None:
+                        journal.compact(oas_with_utterances.get('tool_name', ''), "utterances")
                     print(f"✅ Saved OAS with utterances of {filename}")
 
+    if cache is not None:
+        print(f"LLM cache stats: {cache.stats()}")
+    if isinstance(llm_client, ClientPool):
+        print(f"LLM endpoint stats: {llm_client.stats()}")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
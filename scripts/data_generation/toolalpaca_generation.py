@@ -5,6 +5,11 @@ import yaml
 from tqdm import tqdm
 from dotenv import load_dotenv
 from pathlib import Path
+from llm_client.cache import ResponseCache
+from llm_client.client import ChatClient
+from llm_client.pool import ClientPool
+from llm_client.ledger import CallLedger
+from data_generation.journal import GenerationJournal
 from data_generation.toolalpaca.utterance_generator import UtteranceGenerator
 
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -31,12 +36,25 @@ def main():
     llm_url = cfg["llm_url"]
     llm_temp = cfg.get("llm_temp", 1.0)
     utterances = cfg.get("utterances", 10)
+    max_concurrency = cfg.get("max_concurrency", 1)
     oas_path = cfg["oas_path"]
     output_folder = Path(cfg["output_folder"], llm_name, "toolalpaca")
+    cache = ResponseCache.from_config(cfg.get("llm_cache"))
+    journal = GenerationJournal(os.path.join(output_folder, "journal.jsonl")) if cfg.get("journal", False) else None
+    ledger = CallLedger.from_config(cfg.get("llm_ledger", False), os.path.join(output_folder, "llm_ledger.jsonl"))
+    structured_output = cfg.get("structured_output") or {}
+    repair_existing = structured_output.get("repair_existing", False)
     api_key = os.getenv("OPENAI_API_KEY")
 
-    # 2 - initializing extractor and utterance generator
-    utterance_generator = UtteranceGenerator(api_key=api_key, base_url=llm_url, model_name=llm_name)
+    # 2 - initializing extractor and utterance generator (through a client pool when several endpoints are given)
+    if cfg.get("llm_endpoints"):
+        llm_client = ClientPool.from_config(cfg["llm_endpoints"], model_name=llm_name, cache=cache, ledger=ledger)
+    else:
+        llm_client = ChatClient(api_key=api_key, base_url=llm_url, model_name=llm_name, cache=cache, ledger=ledger)
+    utterance_generator = UtteranceGenerator(api_key=api_key, base_url=llm_url, model_name=llm_name, cache=cache, journal=journal, llm_client=llm_client,
+                                             structured_output=structured_output.get("enabled", False),
+                                             max_parse_retries=structured_output.get("max_retries", 2),
+                                             streaming=cfg.get("streaming", False))
 
     # 3 - iterating through all OAS files
     categories = sorted(os.listdir(oas_path))
@@ -48,24 +66,38 @@ def main():
                 if not os.path.exists(os.path.join(output_folder, filename)):
                     file_path = os.path.join(category_path, filename)  # path to the API spec file 
                     
-                    # 1 - check whether the output file already exists
+                    # 1 - check whether the output file already exists (with `repair_existing`, its failed methods are generated again)
+                    only_failed = False
                     if os.path.exists(os.path.join(output_folder, "utterances", filename)):
-                        continue
-
-                    # 2 - reading OAS file
-                    with open(file_path, 'r') as f:
-                        data = json.load(f)
+                        if not repair_existing:
+                            continue
+                        with open(os.path.join(output_folder, "utterances", filename), 'r') as f:
+                            data = json.load(f)
+                        if all(isinstance(api_method.get('utterances'), list) for api_method in data['api_list']):
+                            continue
+                        only_failed = True
+                    else:
+                        # 2 - reading OAS file
+                        with open(file_path, 'r') as f:
+                            data = json.load(f)
 
                     # 3 - generating constraint-aware utterances
-                    oas_with_utterances = utterance_generator.generate_utterances(data, num_utterances=utterances, temperature=llm_temp)
+                    oas_with_utterances = utterance_generator.generate_utterances(data, num_utterances=utterances, temperature=llm_temp, max_concurrency=max_concurrency, only_failed=only_failed)
                     os.makedirs(os.path.join(output_folder, "utterances"), exist_ok=True)  # create output directory if not exists 
                     output_file = os.path.join(output_folder, "utterances" , filename)
                     with open(output_file, "w") as f:
                         json.dump(oas_with_utterances, f, indent=4)
+                    if journal is not None:
+                        journal.compact(oas_with_utterances.get('tool_name', ''), "utterances")
                     print(f"✅ Saved OAS with utterances of {filename}")
                 break
             break
         break
 
+    if cache is not None:
+        print(f"LLM cache stats: {cache.stats()}")
+    if isinstance(llm_client, ClientPool):
+        print(f"LLM endpoint stats: {llm_client.stats()}")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
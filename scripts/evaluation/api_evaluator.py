@@ -5,15 +5,16 @@ API Evaluator developed by ToolLLM.
 from sklearn.metrics import ndcg_score
 import numpy as np
 import logging
+import multiprocessing
 import os
 from typing import List, Dict, Set
-from tqdm import trange
-from tqdm import tqdm
 import torch
-from multiprocessing import Pool
-import heapq
 from sentence_transformers.evaluation import SentenceEvaluator
 from sentence_transformers.util import cos_sim
+from retrieval.encoding import TokenizationCache, default_prompt, encode_tokenized
+from retrieval.encoding_pool import EncodingPool
+from retrieval.autotune import DEFAULT_CACHE_PATH, autotune, model_key
+from retrieval.index import create_index
 import os
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -22,38 +23,85 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# filehandler
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# filehandler: only in the main process (spawned workers, e.g. of the encoding pool, import this module
+# again and would otherwise replace the log of the main process)
 log_file = "log_file.txt"
-if os.path.exists(log_file):
-    os.remove(log_file)
-file_handler = logging.FileHandler(log_file)
-file_handler.setLevel(logging.INFO)
+if multiprocessing.current_process().name == "MainProcess":
+    if os.path.exists(log_file):
+        os.remove(log_file)
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
 
 # StreamHandler
 stream_handler = logging.StreamHandler()
 stream_handler.setLevel(logging.INFO)
-
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-file_handler.setFormatter(formatter)
 stream_handler.setFormatter(formatter)
-
-logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
-def compute_ndcg_for_query(query_tuple):
-    _, query_id, top_hits, relevant_docs, corpus_ids, k = query_tuple
-    query_relevant_docs = relevant_docs[query_id]
-
-    # Build the ground truth relevance scores and the model's predicted scores
-    true_relevance = np.zeros(len(corpus_ids))
-    predicted_scores = np.zeros(len(corpus_ids))
-
-    for hit in top_hits:
-        predicted_scores[corpus_ids.index(hit["corpus_id"])] = hit["score"]
-        if hit["corpus_id"] in query_relevant_docs:
-            true_relevance[corpus_ids.index(hit["corpus_id"])] = 1
-
-    return ndcg_score([true_relevance], [predicted_scores], k=k)
+def tied_queries(top_scores: np.ndarray, max_k: int) -> np.ndarray:
+    """Queries with equal scores among their top max_k + 1 documents (their NDCG depends on tie-averaging).
+    The -inf scores of the slots an approximate index could not fill are not ties."""
+    top_scores = top_scores[:, :max_k + 1]
+    return np.flatnonzero(((top_scores[:, 1:] == top_scores[:, :-1]) & np.isfinite(top_scores[:, 1:])).any(axis=1))
+
+
+def ranking_metrics(top_scores: np.ndarray, top_idx: np.ndarray, relevant: List[np.ndarray], num_docs: int,
+                    k_list: List[int] = [1, 3, 5, 10], full_scores: Dict[int, np.ndarray] = None) -> Dict[str, float]:
+    """NDCG@k, Recall@k and MRR@max(k) averaged over all queries, from the top max(k) + 1 scores and corpus
+    indexes of every query (sorted by decreasing score) and the corpus indexes of its relevant documents.
+    Negative indexes (slots an approximate index could not fill) are non-relevant.
+
+    NDCG@k equals sklearn's `ndcg_score` on the full score row: the rows of the tied queries (`tied_queries`)
+    given in `full_scores` are computed with `ndcg_score` (tie-averaged gains); the NDCG of a tied query without
+    its row is taken from its top-k as ranked (as for the approximate index backends)."""
+    num_queries = len(top_scores)
+    max_k = min(max(k_list), num_docs)
+    full_scores = full_scores or {}
+
+    # 1 - relevance of the ranked documents (query-document pairs as flat keys) and number of relevant documents
+    relevant_keys = np.concatenate([query_itr * num_docs + docs for query_itr, docs in enumerate(relevant)] + [np.empty(0, dtype=np.int64)])
+    top_keys = np.arange(num_queries)[:, None] * num_docs + top_idx[:, :max_k]
+    gains = (np.isin(top_keys, relevant_keys) & (top_idx[:, :max_k] >= 0)).astype(np.float64)
+    num_relevant = np.array([len(docs) for docs in relevant])
+
+    cumulative_relevant = np.cumsum(gains, axis=1)
+    ties = tied_queries(top_scores, max_k)
+
+    # 2 - NDCG with the same floating point operations as `ndcg_score`, so the values are identical: the DCG
+    # is a (pairwise) sum of the gains times the differences of the cumulative discounts, whose terms beyond
+    # the first 128 positions are zero; the ideal DCG is a dot product over the whole corpus
+    metrics = {}
+    width = min(num_docs, 128)
+    for k in k_list:
+        kk = min(k, max_k)
+        discount = 1 / (np.log(np.arange(num_docs) + 2) / np.log(2))
+        discount[k:] = 0
+        padded_gains = np.zeros((num_queries, width))
+        padded_gains[:, :max_k] = gains
+        dcg = (padded_gains * np.diff(np.cumsum(discount[:width]), prepend=0)).sum(axis=1)
+        idcg = {}
+        for n in np.unique(num_relevant):
+            ideal = np.zeros((1, num_docs))
+            ideal[0, :n] = 1
+            idcg[n] = discount.dot(ideal.T)[0]
+
+        ndcg = np.array([dcg[query_itr] / idcg[n] if n > 0 else 0.0 for query_itr, n in enumerate(num_relevant)])
+        for query_itr in ties:
+            if query_itr not in full_scores:
+                continue
+            true_relevance = np.zeros(num_docs)
+            true_relevance[relevant[query_itr]] = 1
+            ndcg[query_itr] = ndcg_score([true_relevance], [full_scores[query_itr].astype(np.float64)], k=k)
+        metrics[f"ndcg@{k}"] = float(np.mean(ndcg))
+        metrics[f"recall@{k}"] = float(np.mean(np.where(num_relevant > 0, cumulative_relevant[:, kk - 1] / np.maximum(num_relevant, 1), 0.0)))
+
+    first_hit = np.where(gains.any(axis=1), gains.argmax(axis=1) + 1, 0)
+    metrics[f"mrr@{max(k_list)}"] = float(np.mean(np.where(first_hit > 0, 1 / np.maximum(first_hit, 1), 0.0)))
+    return metrics
 
 
 import torch
@@ -71,22 +119,54 @@ class APIEvaluator(SentenceEvaluator):
         queries: Dict[str, str],  # qid => query
         corpus: Dict[str, str],  # cid => doc
         relevant_docs: Dict[str, Set[str]],  # qid => Set[cid]
-        corpus_chunk_size: int = 5,
+        corpus_chunk_size: int = 50000,  # documents scored at once (the corpus is encoded in one pass)
+        query_chunk_size: int = None,  # None: all the queries at once (other sizes may change scores in the last float bits)
         show_progress_bar: bool = True,
-        batch_size: int = 1,
+        batch_size: int = 32,  # texts per batch when max_tokens_per_batch is None
         write_csv: bool = True,
         score_function=cos_sim,  # Score function, higher=more similar
+        tokenization_cache: TokenizationCache = None,  # reuses the tokenized texts across models of the same tokenizer
+        max_tokens_per_batch: int = 16384,  # padded tokens per batch: texts are bucketed by length
+        model=None,  # tokenizes the queries and the corpus at construction (otherwise at the first call)
+        memory_budget_mb: float = None,  # tunes batch_size, max_tokens_per_batch and corpus_chunk_size to this budget
+        autotune_cache: str = DEFAULT_CACHE_PATH,  # calibrations per (model, max_seq_length, host, budget)
+        encoding_pool: EncodingPool = None,  # encodes in worker processes (with the current weights of the model)
+        index_backend: str = None,  # None: brute-force scoring, otherwise a retrieval.index backend ("flat", "ivf")
+        index_params: Dict = None,  # the index backends rank by cosine similarity (score_function must be cos_sim)
     ):
+        if index_backend is not None and score_function is not cos_sim:
+            raise ValueError(f"The index backend '{index_backend}' ranks by cosine similarity: "
+                             f"score_function must be cos_sim (got {getattr(score_function, '__name__', score_function)}).")
         self.queries_id = list(queries.keys())
         self.queries = [queries[qid] for qid in self.queries_id]
         self.corpus_ids = list(corpus.keys())
         self.corpus = [corpus[cid] for cid in self.corpus_ids]
         self.relevant_docs = relevant_docs
         self.corpus_chunk_size = corpus_chunk_size
+        self.query_chunk_size = query_chunk_size
         self.show_progress_bar = show_progress_bar
         self.batch_size = batch_size
         self.write_csv = write_csv
         self.score_function = score_function
+        self.tokenization_cache = tokenization_cache if tokenization_cache is not None else TokenizationCache()
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.memory_budget_mb = memory_budget_mb
+        self.autotune_cache = autotune_cache
+        self._autotuned = set()
+        self.encoding_pool = encoding_pool
+        self.index_backend = index_backend
+        self.index_params = index_params or {}
+        self.k_list = [1, 3, 5, 10]
+        self.metrics = {}
+
+        # corpus indexes of the relevant documents of each query (documents outside the corpus cannot be retrieved)
+        corpus_index = {cid: idx for idx, cid in enumerate(self.corpus_ids)}
+        self.relevant_indexes = [np.array([corpus_index[cid] for cid in relevant_docs[qid] if cid in corpus_index], dtype=np.int64)
+                                 for qid in self.queries_id]
+
+        # the texts are tokenized once per tokenizer and reused by every call (e.g., each evaluation of model.fit)
+        if model is not None:
+            self._tokenize(model)
 
         self.csv_file: str = "Information-Retrieval_evaluation_results.csv"
         self.csv_headers = [
@@ -144,113 +224,115 @@ class APIEvaluator(SentenceEvaluator):
         return min(avg_ndcg)
 
     def compute_metrices(self, model) -> Dict[int, float]:
-        # Compute embedding for the queries
-        query_embeddings = model.encode(
-            self.queries,
-            show_progress_bar=self.show_progress_bar,
-            batch_size=self.batch_size,
-            convert_to_tensor=True,
-        )
-
-        queries_result_list = [[] for _ in range(len(query_embeddings))]
-
-        # Iterate over chunks of the corpus
-        for corpus_start_idx in trange(
-            0,
-            len(self.corpus),
-            self.corpus_chunk_size,
-            desc="Corpus Chunks",
-            disable=not self.show_progress_bar,
-        ):
-            corpus_end_idx = min(
-                corpus_start_idx + self.corpus_chunk_size, len(self.corpus)
-            )
-
-            # Encode chunk of corpus
-            sub_corpus_embeddings = model.encode(
-                self.corpus[corpus_start_idx:corpus_end_idx],
-                show_progress_bar=False,
-                batch_size=self.batch_size,
-                convert_to_tensor=True,
-            )
-
-            # Compute cosine similarites
-            pair_scores = self.score_function(query_embeddings, sub_corpus_embeddings)
-
-            # Convert scores to list
-            pair_scores_list = pair_scores.cpu().tolist()
-
-            for query_itr in range(len(query_embeddings)):
-                for sub_corpus_id, score in enumerate(pair_scores_list[query_itr]):
-                    corpus_id = self.corpus_ids[corpus_start_idx + sub_corpus_id]
-                    queries_result_list[query_itr].append(
-                        {"corpus_id": corpus_id, "score": score}
-                    )
-
-        for query_itr in range(len(queries_result_list)):
-            for doc_itr in range(len(queries_result_list[query_itr])):
-                score, corpus_id = (
-                    queries_result_list[query_itr][doc_itr]["score"],
-                    queries_result_list[query_itr][doc_itr]["corpus_id"],
-                )
-                queries_result_list[query_itr][doc_itr] = {
-                    "corpus_id": corpus_id,
-                    "score": score,
-                }
+        num_docs = len(self.corpus)
+        max_k = min(max(self.k_list), num_docs)
+        top_k = min(max_k + 1, num_docs)  # one more than needed to detect ties at the cut
+        tokenized_corpus, tokenized_queries = self._tokenize(model)
+        if self.memory_budget_mb is not None and tokenized_corpus is not None:
+            self._autotune(model, tokenized_corpus)
+
+        # Encode the whole corpus and all the queries in length-bucketed batches, then score them chunk by chunk
+        corpus_embeddings = list(torch.split(self._encode(model, self.corpus, tokenized_corpus, self.show_progress_bar), self.corpus_chunk_size))
+        all_query_embeddings = self._encode(model, self.queries, tokenized_queries, self.show_progress_bar)
+
+        # Approximate (or exact) nearest-neighbor index over the corpus embeddings
+        index = None
+        if self.index_backend is not None:
+            index = create_index(self.index_backend, **self.index_params)
+            index.add(torch.cat(corpus_embeddings).cpu().numpy())
+
+        # Running top-k of every query, merged across the corpus chunks: memory O(queries x k)
+        top_scores = np.empty((len(self.queries), top_k), dtype=np.float32)
+        top_idx = np.empty((len(self.queries), top_k), dtype=np.int64)
+        full_scores = {}
+        query_chunk_size = self.query_chunk_size or len(self.queries)
+        for query_start_idx in range(0, len(self.queries), query_chunk_size):
+            query_end_idx = min(query_start_idx + query_chunk_size, len(self.queries))
+            query_embeddings = all_query_embeddings[query_start_idx:query_end_idx]
+
+            if index is not None:
+                top_scores[query_start_idx:query_end_idx], top_idx[query_start_idx:query_end_idx] = index.search(query_embeddings.cpu().numpy(), top_k)
+                # approximate backends never score the whole corpus: their tied queries keep the top-k NDCG
+                if index.exact:
+                    self._keep_tied_rows(query_embeddings, corpus_embeddings, top_scores, query_start_idx, query_end_idx, max_k, full_scores)
+                continue
+
+            chunk_scores, chunk_idx = None, None
+            corpus_start_idx = 0
+            for sub_corpus_embeddings in corpus_embeddings:
+                pair_scores = self.score_function(query_embeddings, sub_corpus_embeddings)
+                pair_idx = torch.arange(corpus_start_idx, corpus_start_idx + len(sub_corpus_embeddings), device=pair_scores.device).expand_as(pair_scores)
+                if chunk_scores is not None:
+                    pair_scores = torch.cat([chunk_scores, pair_scores], dim=1)
+                    pair_idx = torch.cat([chunk_idx, pair_idx], dim=1)
+                chunk_scores, positions = torch.topk(pair_scores, min(top_k, pair_scores.shape[1]), dim=1)
+                chunk_idx = torch.gather(pair_idx, 1, positions)
+                corpus_start_idx += len(sub_corpus_embeddings)
+
+            top_scores[query_start_idx:query_end_idx] = chunk_scores.cpu().numpy()
+            top_idx[query_start_idx:query_end_idx] = chunk_idx.cpu().numpy()
+
+            self._keep_tied_rows(query_embeddings, corpus_embeddings, top_scores, query_start_idx, query_end_idx, max_k, full_scores)
 
         logger.info("Queries: {}".format(len(self.queries)))
-        logger.info("Corpus: {}\n".format(len(self.corpus)))
+        logger.info("Corpus: {}\n".format(num_docs))
 
         # Compute scores
-        scores = self.compute_metrics(queries_result_list)
+        scores = self.compute_metrics(top_scores, top_idx, full_scores)
 
         # Output
         logger.info("Average NDCG@1: {:.2f}".format(scores[0] * 100))
         logger.info("Average NDCG@3: {:.2f}".format(scores[1] * 100))
         logger.info("Average NDCG@5: {:.2f}".format(scores[2] * 100))
         logger.info("Average NDCG@10: {:.2f}".format(scores[3] * 100))
+        logger.info("Recall@1/3/5/10: {}".format(" / ".join("{:.2f}".format(self.metrics[f"recall@{k}"] * 100) for k in self.k_list)))
+        logger.info("MRR@10: {:.2f}".format(self.metrics["mrr@10"] * 100))
         return scores
 
-    def compute_metrics(self, queries_result_list):
-        # Init score computation values
-        ndcg_scores = []
-
-        # Compute scores on results using a pool of workers
-        k_list = [1, 3, 5, 10]
-        scores = []
-
-        for k in k_list:
-            # Build a list of tuples, each containing the data needed for one query
-            query_tuples = []
-            for query_itr in range(len(queries_result_list)):
-                query_id = self.queries_id[query_itr]
-                top_hits = sorted(
-                    queries_result_list[query_itr],
-                    key=lambda x: x["score"],
-                    reverse=True,
-                )
-                query_tuples.append(
-                    (
-                        query_itr,
-                        query_id,
-                        top_hits,
-                        self.relevant_docs,
-                        self.corpus_ids,
-                        k,
-                    )
-                )  # add 'k' to each tuple
-
-            ndcg_scores.clear()  # clear the list for each 'k'
-
-            with Pool() as p:
-                max_ = len(query_tuples)
-                with tqdm(total=max_) as pbar:
-                    for i, _ in tqdm(
-                        enumerate(p.imap(compute_ndcg_for_query, query_tuples))
-                    ):
-                        pbar.update()
-                        ndcg_scores.append(_)
-            scores.append(np.mean(ndcg_scores))
-
-        # Return the average NDCG@k of all queries for each 'k'
-        return scores
\ No newline at end of file
+    def _keep_tied_rows(self, query_embeddings, corpus_embeddings, top_scores, query_start_idx, query_end_idx, max_k, full_scores) -> None:
+        """The full score rows are only kept for the queries with tied top scores, and only their rows are
+        scored again (memory O(tied queries x corpus), whatever the chunk size)."""
+        tied = tied_queries(top_scores[query_start_idx:query_end_idx], max_k)
+        if len(tied):
+            tied_embeddings = query_embeddings[torch.as_tensor(tied, device=query_embeddings.device)]
+            rows = torch.cat([self.score_function(tied_embeddings, sub_corpus_embeddings) for sub_corpus_embeddings in corpus_embeddings], dim=1)
+            for query_itr, row in zip(tied, rows.cpu().numpy()):
+                full_scores[query_start_idx + query_itr] = row
+
+    def _autotune(self, model, tokenized_corpus) -> None:
+        """Batch and chunk sizes for the memory budget (calibrated once per model and max_seq_length)."""
+        key = (model_key(model), model.max_seq_length)
+        if key in self._autotuned:
+            return
+        settings = autotune(model, tokenized_corpus, len(self.queries), len(self.corpus), self.memory_budget_mb, self.autotune_cache)
+        self.batch_size = settings["batch_size"]
+        self.max_tokens_per_batch = settings["max_tokens_per_batch"]
+        self.corpus_chunk_size = settings["corpus_chunk_size"]
+        self._autotuned.add(key)
+        logger.info("Auto-tuned for {} MB: batch_size={}, max_tokens_per_batch={}, corpus_chunk_size={}".format(
+            self.memory_budget_mb, self.batch_size, self.max_tokens_per_batch, self.corpus_chunk_size))
+
+    def _tokenize(self, model):
+        """Tokenized corpus and queries (None for models that cannot be tokenized separately from `encode`,
+        or whose default prompt is added by `encode`)."""
+        if self.encoding_pool is not None or not hasattr(model, "tokenizer") or default_prompt(model):
+            return None, None
+        return self.tokenization_cache.tokenize(model, self.corpus), self.tokenization_cache.tokenize(model, self.queries)
+
+    def _encode(self, model, texts: List[str], tokenized, show_progress_bar: bool) -> torch.Tensor:
+        """Embeddings of the texts (in order), from the tokenized texts when available."""
+        if self.encoding_pool is not None:
+            return torch.from_numpy(self.encoding_pool.encode(texts, batch_size=self.batch_size, model=model))
+        if tokenized is not None:
+            return encode_tokenized(model, tokenized, batch_size=self.batch_size, max_tokens=self.max_tokens_per_batch)
+        return model.encode(
+            texts,
+            show_progress_bar=show_progress_bar,
+            batch_size=self.batch_size,
+            convert_to_tensor=True,
+        )
+
+    def compute_metrics(self, top_scores: np.ndarray, top_idx: np.ndarray, full_scores: Dict[int, np.ndarray]) -> List[float]:
+        """Average NDCG@k of all queries for each k (all the metrics are kept in `self.metrics`)."""
+        self.metrics = ranking_metrics(top_scores, top_idx, self.relevant_indexes, len(self.corpus), self.k_list, full_scores)
+        return [self.metrics[f"ndcg@{k}"] for k in self.k_list]
@@ -13,9 +13,17 @@ import pandas as pd
 from tqdm import tqdm
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import Dict
 from sentence_transformers import SentenceTransformer, util
-from evaluation.metrics import naturalness_evaluation, bertscore, cosine_similarity, parameter_coverage, parameter_combination_coverage, constraint_adherance
+from evaluation.embedding_cache import EmbeddingCache
+from retrieval.encoding_pool import EncodingPool
+from evaluation.metrics import naturalness_evaluation, naturalness_batch_requests, naturalness_from_batch, bertscore, cosine_similarity, parameter_coverage, parameter_combination_coverage, constraint_adherance
 from sklearn.metrics import cohen_kappa_score
+from llm_client.cache import ResponseCache
+from llm_client.pool import ClientPool
+from preprocessing.utterance_store import fresh_files, load_documents, store_path
+from llm_client.ledger import CallLedger
+from llm_client.batch import BatchRunner
 
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
@@ -56,6 +64,8 @@ def main():
     llm_url = cfg["llm_as_judge"]["url"]
     llm_temp = cfg["llm_as_judge"]["temperature"]
     api_keys = cfg["llm_as_judge"]["api_key"]
+    llm_endpoints = cfg["llm_as_judge"].get("endpoints") or [None] * len(llm_as_judge_name)
+    cache = ResponseCache.from_config(cfg.get("llm_cache"))
 
     # defining the API methods to evaluate
     random.seed(random_seed)
@@ -65,29 +75,59 @@ def main():
     print(f"Evaluating {len(oas_to_evaluate)} APIs located in {utterances_path}.")
     print(f"These are the oas: {oas_to_evaluate}")
 
+    # the selected APIs are read once from the Parquet store when it was exported, from the JSON files otherwise
+    # (and for the files changed since the export)
+    store = store_path(utterances_path)
+    documents = {}
+    if cfg.get("use_utterance_store", True) and os.path.exists(store):
+        fresh = fresh_files(store, utterances_path)
+        documents = load_documents(store, files=[filename for filename in oas_to_evaluate if filename in fresh])
+
+    def load_oas(filename: str) -> Dict:
+        if filename in documents:
+            return documents[filename]
+        with open(os.path.join(utterances_path, filename), "r") as f:
+            return json.load(f)
+
     # 1 - evaluating naturalness
     if evaluate_naturalness:
         print("Evaluating Naturalness...")
         detailed_results = []
         summarised_results = []
 
-        for llm, url, api_key in zip(llm_as_judge_name, llm_url, api_keys):
+        for llm, url, api_key, endpoints in zip(llm_as_judge_name, llm_url, api_keys, llm_endpoints):
+            # several endpoints serving the same judge are used through a client pool
             output_folder = Path(__file__).parent.parent.parent / "results" / "dataset_quality_evaluation" / llm_name / prompt_to_evaluate
             os.makedirs(output_folder, exist_ok=True)            
+            ledger = CallLedger.from_config(cfg.get("llm_ledger", False), output_folder / "llm_ledger.jsonl")
+            judge_client = ClientPool.from_config(endpoints, model_name=llm, cache=cache, ledger=ledger) if endpoints else None
             
             rows = []
             natural_count = 0
             unnatural_count = 0
             wrong_count = 0
 
+            # batch mode: the utterances of all APIs are judged in a single batch job
+            batch_runner = BatchRunner.from_config(cfg.get("batch"), api_key=api_key, base_url=url, model_name=llm, cache=cache,
+                                                   llm_client=judge_client)
+            if batch_runner is not None:
+                requests = []
+                for filename in oas_to_evaluate:
+                    requests.extend(naturalness_batch_requests(load_oas(filename), model_name=llm, custom_id_prefix=filename))
+                batch_responses = batch_runner.run(requests, job_name=f"naturalness_{llm.split('/')[-1]}")
+
             for category_index, filename in enumerate(tqdm(oas_to_evaluate, desc="APIs")):
                 if category_index >= 0:
-                    file_path = os.path.join(utterances_path, filename)
-                    with open(file_path, "r") as f:
-                        oas = json.load(f)
+                    oas = load_oas(filename)
                     print(f"{category_index} - Evaluating filename: {filename}")
                     
-                    results_naturalness = naturalness_evaluation(oas=oas, api_key=api_key, base_url=url, model_name=llm)
+                    if batch_runner is not None:
+                        results_naturalness = naturalness_from_batch(oas, model_name=llm, responses=batch_responses, custom_id_prefix=filename)
+                        if results_naturalness is None:
+                            print(f"Missing batch responses for {filename}, skipping it")
+                            continue
+                    else:
+                        results_naturalness = naturalness_evaluation(oas=oas, api_key=api_key, base_url=url, model_name=llm, cache=cache, llm_client=judge_client, ledger=ledger)
                     natural_count += results_naturalness['natural_count']
                     unnatural_count += results_naturalness['unnatural_count']
                     wrong_count += results_naturalness['wrong_count']
@@ -119,6 +159,8 @@ def main():
         summary_output = output_folder / "naturalness_summary.csv"
         pd.DataFrame(summarised_results).to_csv(summary_output, index=False)
         print(f"✅ Saved summarised naturalness results to {summary_output}")
+        if cache is not None:
+            print(f"LLM cache stats: {cache.stats()}")
 
     if evaluate_cohen_kappa:
         print("Evaluating Cohen's Kappa between LLM Judges...")
@@ -154,9 +196,7 @@ def main():
         total_parameters = 0
         APIs_evaluated = 0
         for category_index, filename in enumerate(tqdm(oas_to_evaluate, desc="APIs")):
-            file_path = os.path.join(utterances_path, filename)  # path to the API spec file
-            with open(file_path, "r") as f:
-                oas = json.load(f)
+            oas = load_oas(filename)
             print(f"Evaluating the following API: {filename}")
 
             # computing parameter coverage
@@ -185,15 +225,16 @@ def main():
         cosine_similarity_scores = []
         bertscore_scores = []
         embedding_model = SentenceTransformer(embedding_model_cs)
+        embedding_cache = EmbeddingCache.from_config(cfg.get("embedding_cache"))
+        encoding_pool = EncodingPool.from_config(cfg.get("encoding_pool"), embedding_model_cs)
 
         for category_index, filename in enumerate(tqdm(oas_to_evaluate, desc="APIs")):
-            file_path = os.path.join(utterances_path, filename)  # path to the API spec file
-            with open(file_path, "r") as f:
-                oas = json.load(f)
+            oas = load_oas(filename)
             print(f"Evaluating the following API: {filename}")
 
             # computing cosine similarity
-            cs = cosine_similarity(oas, embedding_model=embedding_model)
+            cs = cosine_similarity(oas, embedding_model=embedding_model, embedding_cache=embedding_cache, model_name=embedding_model_cs,
+                                   encoding_pool=encoding_pool)
             cosine_similarity_scores.append(cs)
 
             # computing BERTScore
@@ -203,6 +244,11 @@ def main():
         average_cs = round(sum(cosine_similarity_scores) / len(cosine_similarity_scores), 4)
         average_bs = round(sum(bertscore_scores) / len(bertscore_scores), 4)
         print(f"Average Semantic Relevance across evaluated APIs: {average_cs}")
+        if embedding_cache is not None:
+            embedding_cache.flush()
+            print(f"Embedding cache: {embedding_cache.stats()}")
+        if encoding_pool is not None:
+            encoding_pool.close()
         print(f"Average BERTScore across evaluated APIs: {average_bs}")
 
     if evaluate_constraint_adherance:
@@ -211,9 +257,7 @@ def main():
         constraint_violations_list = [0, 0, 0]
 
         for category_index, filename in enumerate(tqdm(oas_to_evaluate, desc="APIs")):
-            file_path = os.path.join(utterances_path, filename)  # path to the API spec file
-            with open(file_path, "r") as f:
-                oas = json.load(f)
+            oas = load_oas(filename)
             print(f"Evaluating the following API: {filename}")
 
             # computing constraint adherance
@@ -0,0 +1,56 @@
+"""
+Throughput of the multi-process CPU encoding pool (retrieval.encoding_pool) against single-process
+`SentenceTransformer.encode`, on the test set texts, and check that both produce the same embeddings.
+"""
+
+import time
+import argparse
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from retrieval.data import load_test_set
+from retrieval.encoding_pool import EncodingPool
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the multi-process encoding pool against single-process encoding.")
+    parser.add_argument("--model", required=True, help="SentenceTransformer checkpoint")
+    parser.add_argument("--testing_path", required=True, help="test set folder (corpus.tsv, test.query.txt, qrels.test.tsv)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8], help="pool sizes to benchmark")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="torch threads per worker (default: CPU cores / workers)")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads of the single-process run (default: all)")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--max_seq_length", type=int, default=None)
+    parser.add_argument("--limit", type=int, default=None, help="encode only the first N texts")
+    args = parser.parse_args()
+
+    # 1 - texts of the test set (documents and queries)
+    queries, corpus, _ = load_test_set(args.testing_path)
+    texts = (list(corpus.values()) + list(queries.values()))[:args.limit]
+    print(f"{len(texts)} texts")
+
+    # 2 - single process
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = SentenceTransformer(args.model, device="cpu", trust_remote_code=True)
+    if args.max_seq_length:
+        model.max_seq_length = args.max_seq_length
+    start = time.perf_counter()
+    reference = model.encode(texts, batch_size=args.batch_size, convert_to_numpy=True, show_progress_bar=False)
+    single = len(texts) / (time.perf_counter() - start)
+    print(f"single process ({torch.get_num_threads()} threads): {single:.1f} texts/s")
+    del model
+
+    # 3 - worker pools
+    for workers in args.workers:
+        with EncodingPool(args.model, workers=workers, threads_per_worker=args.threads_per_worker, max_seq_length=args.max_seq_length) as pool:
+            start = time.perf_counter()
+            embeddings = pool.encode(texts, batch_size=args.batch_size)
+            throughput = len(texts) / (time.perf_counter() - start)
+            print(f"pool {workers} workers x {pool.threads_per_worker} threads: {throughput:.1f} texts/s | "
+                  f"speedup {throughput / single:.2f}x | identical {np.array_equal(embeddings, reference)} | "
+                  f"max abs diff {np.abs(embeddings - reference).max():.2e}")
+
+
+if __name__ == '__main__':
+    main()
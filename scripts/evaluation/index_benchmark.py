@@ -0,0 +1,71 @@
+"""
+Benchmark of the retrieval index backends: recall@k of the IVF index against exact (flat) search and
+queries per second on CPU, for the test set encoded by a SentenceTransformer checkpoint or for synthetic
+embeddings of a large corpus (e.g., the size of the ToolBench API method inventory).
+"""
+
+import time
+import argparse
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from retrieval.data import load_test_set
+from retrieval.index import FlatIndex, IVFIndex, benchmark, save_index
+
+
+def synthetic_embeddings(num_docs: int, num_queries: int, dim: int, num_topics: int = 500, seed: int = 0):
+    """Clustered random embeddings (documents and queries are noisy copies of topic vectors)."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((num_topics, dim)).astype(np.float32)
+    docs = topics[rng.integers(num_topics, size=num_docs)] + 0.6 * rng.standard_normal((num_docs, dim)).astype(np.float32)
+    queries = topics[rng.integers(num_topics, size=num_queries)] + 0.6 * rng.standard_normal((num_queries, dim)).astype(np.float32)
+    return docs, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the retrieval index backends.")
+    parser.add_argument("--model", default=None, help="SentenceTransformer checkpoint encoding the test set")
+    parser.add_argument("--testing_path", default=None, help="test set folder (corpus.tsv, test.query.txt, qrels.test.tsv)")
+    parser.add_argument("--synthetic", type=int, nargs=3, metavar=("DOCS", "QUERIES", "DIM"), default=None,
+                        help="synthetic embeddings instead of a model and a test set")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None, help="IVF clusters (about 4 * sqrt(docs) by default)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--save", default=None, help="save the IVF index (.npz)")
+    args = parser.parse_args()
+
+    # 1 - document and query embeddings
+    if args.synthetic:
+        docs, queries = synthetic_embeddings(*args.synthetic)
+    elif args.model and args.testing_path:
+        model = SentenceTransformer(args.model, trust_remote_code=True)
+        test_queries, corpus, _ = load_test_set(args.testing_path)
+        docs = model.encode(list(corpus.values()), batch_size=32, convert_to_numpy=True, show_progress_bar=True)
+        queries = model.encode(list(test_queries.values()), batch_size=32, convert_to_numpy=True, show_progress_bar=True)
+    else:
+        parser.error("either --synthetic or --model and --testing_path are required")
+    print(f"{len(docs)} documents, {len(queries)} queries, dimension {docs.shape[1]}")
+
+    # 2 - exact search
+    exact = FlatIndex()
+    exact.add(docs)
+    flat = benchmark(exact, exact, queries, k=args.k)
+    print(f"flat: recall@{args.k} {flat['recall@k']:.4f} | {flat['qps']} queries/s")
+
+    # 3 - IVF index for several numbers of probed clusters
+    start = time.perf_counter()
+    ivf = IVFIndex(nlist=args.nlist)
+    ivf.add(docs)
+    print(f"ivf: {len(ivf.centroids)} clusters built in {time.perf_counter() - start:.2f}s")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        result = benchmark(ivf, exact, queries, k=args.k)
+        print(f"ivf nprobe={nprobe}: recall@{args.k} {result['recall@k']:.4f} | {result['qps']} queries/s | "
+              f"speedup {result['qps'] / flat['qps']:.1f}x")
+
+    if args.save:
+        save_index(ivf, args.save)
+        print(f"✅ Saved {args.save}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Report of the LLM call ledger (llm_ledger.jsonl) written by the generation and quality evaluation scripts.
+Aggregates the calls by stage, model, API and category.
+"""
+
+import argparse
+import pandas as pd
+from llm_client.ledger import CallLedger
+
+
+def summarise(df: pd.DataFrame, by: str) -> pd.DataFrame:
+    """Token, latency and retry statistics of the calls grouped by a ledger column."""
+    rows = []
+    for key, group in df.groupby(by, dropna=False):
+        sent = group[~group["cached"] & group["error"].isna()]  # latency percentiles only of calls that reached the LLM
+        tokens = group["prompt_tokens"].sum() + group["completion_tokens"].sum()
+        utterances = group["utterances"].sum()
+        rows.append({
+            by: key,
+            "calls": len(group),
+            "cached": int(group["cached"].sum()),
+            "errors": int(group["error"].notna().sum()),
+            "retries": int(group["retries"].sum()),
+            "prompt_tokens": int(group["prompt_tokens"].sum()),
+            "completion_tokens": int(group["completion_tokens"].sum()),
+            "latency_p50": round(sent["latency"].quantile(0.50), 3) if len(sent) else None,
+            "latency_p95": round(sent["latency"].quantile(0.95), 3) if len(sent) else None,
+            "latency_p99": round(sent["latency"].quantile(0.99), 3) if len(sent) else None,
+            "tokens_per_utterance": round(tokens / utterances, 1) if utterances else None,
+            "first_utterance_p50": round(sent["first_item_latency"].quantile(0.50), 3) if sent["first_item_latency"].notna().any() else None,
+            "stopped_early": int((group["stopped_early"] == True).sum()),
+        })
+    return pd.DataFrame(rows).sort_values("prompt_tokens", ascending=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate LLM call ledgers.")
+    parser.add_argument("ledgers", nargs="+", help="llm_ledger.jsonl files")
+    parser.add_argument("--by", nargs="+", default=["stage", "model", "api", "category"], help="columns to group by")
+    parser.add_argument("--top", type=int, default=20, help="rows shown per grouping")
+    parser.add_argument("--output", default=None, help="prefix of the CSV files to save (one per grouping)")
+    args = parser.parse_args()
+
+    # 1 - loading the ledgers
+    entries = []
+    for path in args.ledgers:
+        entries.extend(CallLedger.load(path))
+    if not entries:
+        print("The ledgers are empty.")
+        return
+    df = pd.DataFrame(entries)
+    for column in ["stage", "api", "method", "category", "error", "first_item_latency", "stopped_early"]:
+        if column not in df:
+            df[column] = None
+    df["utterances"] = df["utterances"].fillna(0) if "utterances" in df else 0
+    df["first_item_latency"] = pd.to_numeric(df["first_item_latency"])
+
+    # 2 - the CAP utterance stage works on documents without category, so it is taken from the other calls of the API
+    categories = df[df["category"].fillna("") != ""].groupby("api")["category"].first()
+    df["category"] = df["category"].where(df["category"].fillna("") != "", df["api"].map(categories)).fillna("")
+
+    print(f"{len(df)} LLM calls | {df['prompt_tokens'].sum()} prompt tokens | {df['completion_tokens'].sum()} completion tokens")
+
+    # 3 - aggregating
+    for by in args.by:
+        summary = summarise(df, by)
+        print(f"\nBy {by}:")
+        print(summary.head(args.top).to_string(index=False))
+        if args.output:
+            output_file = f"{args.output}_by_{by}.csv"
+            summary.to_csv(output_file, index=False)
+            print(f"✅ Saved {output_file}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Leaderboard of retrieval models on the test set: pretrained Hugging Face models and/or the `_run_i` checkpoints
+saved by retrieval_train.py, evaluated with APIEvaluator.
+
+The test set is loaded once and its tokenized texts are reused across models of the same tokenizer family.
+Models can be evaluated in parallel worker processes (each limited to a number of threads). The results are
+saved as one table with a row per model and a summary with the mean and standard deviation across seeds.
+"""
+
+import os
+import re
+import json
+import time
+import yaml
+import argparse
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from sentence_transformers import SentenceTransformer
+from api_evaluator import APIEvaluator
+from retrieval.data import load_test_set
+from retrieval.encoding import TokenizationCache
+
+_RUN_PATTERN = re.compile(r"^(?P<prefix>.+)_run_(?P<run>\d+)$")
+
+# worker state (set by the initializer of each worker process)
+_test_set = None
+_tokenization_cache = None
+
+
+def find_checkpoints(path: str) -> List[Dict]:
+    """Checkpoints of retrieval_train.py: the `<path>_run_i` folders of a training output `<path>`, or every
+    `*_run_i` folder inside `path`. The seed of each run is read from `<prefix>/evaluation_results.json`."""
+    path = os.path.normpath(path)
+    parent, name = os.path.split(path)
+    parent = parent or "."
+    candidates = [os.path.join(parent, folder) for folder in os.listdir(parent) if folder.startswith(f"{name}_run_")]
+    if not candidates and os.path.isdir(path):
+        candidates = [os.path.join(path, folder) for folder in os.listdir(path)]
+
+    checkpoints = []
+    for candidate in sorted(candidates):
+        match = _RUN_PATTERN.match(os.path.basename(candidate))
+        if not match or not os.path.isdir(candidate):
+            continue
+        prefix = os.path.join(os.path.dirname(candidate), match["prefix"])
+        seed = None
+        results_file = Path(prefix, "evaluation_results.json")
+        if results_file.exists():
+            with open(results_file, "r") as f:
+                seed = json.load(f).get(f"run_{match['run']}", {}).get("seed")
+        checkpoints.append({"model": candidate, "group": prefix, "run": int(match["run"]), "seed": seed})
+    return checkpoints
+
+
+def _init_worker(test_set, threads: int) -> None:
+    global _test_set, _tokenization_cache
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    _test_set = test_set
+    _tokenization_cache = TokenizationCache()
+
+
+def evaluate_group(jobs: List[Dict], batch_size: int, max_seq_length: int = None, max_tokens_per_batch: int = None,
+                   memory_budget_mb: float = None) -> List[Dict]:
+    """Evaluate the models of a group in sequence (a group shares its tokenizer, e.g., the runs of a training)."""
+    queries, corpus, relevant_docs = _test_set
+    rows = []
+    for job in jobs:
+        start = time.perf_counter()
+        model = SentenceTransformer(job["model"], trust_remote_code=True)
+        if max_seq_length:
+            model.max_seq_length = max_seq_length
+        evaluator = APIEvaluator(queries, corpus, relevant_docs, corpus_chunk_size=len(corpus), batch_size=batch_size,
+                                 max_tokens_per_batch=max_tokens_per_batch, memory_budget_mb=memory_budget_mb,
+                                 show_progress_bar=False, write_csv=False, tokenization_cache=_tokenization_cache)
+        evaluator.compute_metrices(model)
+        rows.append({**job, **evaluator.metrics, "seconds": round(time.perf_counter() - start, 2)})
+        print(f"✅ {job['model']}: NDCG@10 {evaluator.metrics['ndcg@10'] * 100:.2f} ({rows[-1]['seconds']}s)")
+        del model
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate several retrieval models on the test set.")
+    parser.add_argument("--models", nargs="*", default=[], help="Hugging Face model names or local model folders")
+    parser.add_argument("--checkpoints", nargs="*", default=[], help="training outputs of retrieval_train.py (or folders with *_run_i checkpoints)")
+    parser.add_argument("--testing_path", default=None, help="test set folder (testing_path of config_retriever_training.yaml by default)")
+    parser.add_argument("--workers", type=int, default=1, help="parallel worker processes")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads per worker")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--max_seq_length", type=int, default=None)
+    parser.add_argument("--max_tokens_per_batch", type=int, default=16384, help="padded tokens per batch (0: --batch_size texts per batch)")
+    parser.add_argument("--memory_budget_mb", type=float, default=None, help="calibrate the batch and chunk sizes of each model for this memory budget")
+    parser.add_argument("--output", default="retrieval_leaderboard", help="prefix of the CSV files to save")
+    args = parser.parse_args()
+
+    # 1 - test set (loaded once and sent to the workers)
+    testing_path = args.testing_path
+    if testing_path is None:
+        with open(Path(__file__).parent.parent.parent / "config" / "config_retriever_training.yaml", "r") as f:
+            testing_path = yaml.safe_load(f)["testing_path"]
+    test_set = load_test_set(testing_path)
+    print(f"Loaded {len(test_set[0])} queries and {len(test_set[1])} documents.")
+
+    # 2 - models to evaluate, grouped so the models sharing a tokenizer are evaluated by the same worker
+    groups = [[{"model": model, "group": model, "run": None, "seed": None}] for model in args.models]
+    for path in args.checkpoints:
+        checkpoints = find_checkpoints(path)
+        if not checkpoints:
+            print(f"No checkpoints found in {path}")
+        for group in sorted({checkpoint["group"] for checkpoint in checkpoints}):
+            groups.append([checkpoint for checkpoint in checkpoints if checkpoint["group"] == group])
+    if not groups:
+        parser.error("no models to evaluate")
+
+    # 3 - evaluation
+    rows = []
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(test_set, args.threads)) as executor:
+            for group_rows in executor.map(evaluate_group, groups, [args.batch_size] * len(groups), [args.max_seq_length] * len(groups),
+                                          [args.max_tokens_per_batch] * len(groups), [args.memory_budget_mb] * len(groups)):
+                rows.extend(group_rows)
+    else:
+        _init_worker(test_set, args.threads)
+        for group in groups:
+            rows.extend(evaluate_group(group, args.batch_size, args.max_seq_length, args.max_tokens_per_batch, args.memory_budget_mb))
+        print(f"Tokenization cache: {_tokenization_cache.stats()}")
+
+    # 4 - results table and summary across seeds
+    df = pd.DataFrame(rows)
+    metrics = [column for column in df.columns if "@" in column]
+    summary = df.groupby("group")[metrics].agg(["mean", "std"])
+    summary.columns = [f"{metric}_{statistic}" for metric, statistic in summary.columns]
+    summary.insert(0, "runs", df.groupby("group").size())
+    summary = summary.sort_values("ndcg@10_mean", ascending=False).reset_index()
+
+    print(summary[["group", "runs"] + [f"ndcg@{k}_mean" for k in (1, 3, 5, 10)] + ["ndcg@10_std"]].to_string(index=False))
+    df.to_csv(f"{args.output}_runs.csv", index=False)
+    summary.to_csv(f"{args.output}_summary.csv", index=False)
+    print(f"✅ Saved {args.output}_runs.csv and {args.output}_summary.csv")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,8 @@ import pandas as pd
 from datetime import datetime
 from pathlib import Path
 from api_evaluator import APIEvaluator
+from retrieval.data import load_test_set
+from retrieval.encoding import TokenizationCache, use_pretokenized
 import yaml
 import torch
 import torch.nn as nn
@@ -20,6 +22,7 @@ import sys
 import random
 import numpy as np
 import gc
+import copy
 
 def load_config(path: Path) -> dict:
     """Loads configuration to be used in the generation method."""
@@ -35,6 +38,29 @@ def load_config(path: Path) -> dict:
     return cfg
 
 
+def _rng_states() -> list:
+    # full numpy state: key array, position and cached Gaussian (a draw may only change the position)
+    numpy_state = np.random.get_state()
+    states = [random.getstate(), (numpy_state[0], numpy_state[1].tobytes(), *numpy_state[2:]), torch.get_rng_state()]
+    if torch.cuda.is_available():
+        states += torch.cuda.get_rng_state_all()
+    return states
+
+
+def load_base_model(embedding_model: str, max_seq_length: int):
+    """Load the base model once, on CPU, as the pristine snapshot of every run.
+
+    The snapshot can only replace loading the model in each run if loading does not use the random number
+    generators (no randomly initialized weights): otherwise None is returned and the runs load the model."""
+    states = _rng_states()
+    model = SentenceTransformer(embedding_model, device="cpu", trust_remote_code=True)
+    model.max_seq_length = max_seq_length
+    after = _rng_states()
+    if not all(torch.equal(a, b) if isinstance(a, torch.Tensor) else a == b for a, b in zip(states, after)):
+        return None
+    return model
+
+
 def main():
     # 1 - loading config information
     cfg = load_config(Path(__file__).parent.parent.parent / "config" / "config_retriever_training.yaml")
@@ -85,24 +111,12 @@ def main():
     logger.info(f"Loaded {len(train_samples)} training samples.")
 
     # 5 - testing dataset loading
-    test_corpus_df = pd.read_csv(Path(testing_path, 'corpus.tsv'), sep='\t')
-    test_queries_df = pd.read_csv(Path(testing_path, 'test.query.txt'), sep='\t', names=['qid', 'query'])
-    test_labels_df = pd.read_csv(Path(testing_path, 'qrels.test.tsv'), sep='\t', names=['qid', 'useless', 'docid', 'label'])
-
-    test_corpus = {}
-    for row in test_corpus_df.itertuples():
-        doc_text = json.dumps(row.document_context, ensure_ascii=False) if isinstance(row.document_context, dict) else str(row.document_context)
-        test_corpus[str(row.docid)] = doc_text
-
-    test_queries = {str(row.qid): row.query for row in test_queries_df.itertuples()}
+    test_queries, test_corpus, test_relevant_docs = load_test_set(testing_path)
 
-    test_relevant_docs = {}
-    for row in test_labels_df.itertuples():
-        qid, docid = str(row.qid), str(row.docid)
-        test_relevant_docs.setdefault(qid, set()).add(docid)
-
-    # 6 - evaluator (shared across runs)
-    ir_evaluator = APIEvaluator(test_queries, test_corpus, test_relevant_docs)
+    # 6 - evaluator (shared across runs) and tokenized texts (reused by all the runs, as they share the tokenizer)
+    tokenization_cache = TokenizationCache()
+    ir_evaluator = APIEvaluator(test_queries, test_corpus, test_relevant_docs, tokenization_cache=tokenization_cache)
+    train_texts = list(dict.fromkeys(text for sample in train_samples for text in sample.texts))
 
     # 7 - training loop with multiple seeds
     model_save_path = os.path.join(output_folder, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
@@ -119,7 +133,13 @@ def main():
     torch.backends.cudnn.benchmark = False
 
     seeds = random.sample(range(0, 101), 5)
-    
+
+    # base model loaded once, copied for every run (the random number generators are left untouched)
+    base_model = load_base_model(embedding_model, max_seq_length)
+    if base_model is None:
+        logger.info("Loading the model uses the random number generators: it is loaded again for every run.")
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
     for i, seed in enumerate(seeds):
         logger.info(f"Starting run {i} with seed {seed}")
         
@@ -135,8 +155,12 @@ def main():
         if torch.cuda.is_available():
             torch.cuda.manual_seed_all(seed)
 
-        model = SentenceTransformer(embedding_model, trust_remote_code=True)
-        model.max_seq_length = max_seq_length
+        if base_model is not None:
+            model = copy.deepcopy(base_model).to(device)
+        else:
+            model = SentenceTransformer(embedding_model, trust_remote_code=True)
+            model.max_seq_length = max_seq_length
+        pretokenized = use_pretokenized(model, train_texts, tokenization_cache)
 
         # Create fresh dataloader with new seed for shuffling
         train_dataloader = DataLoader(train_samples, shuffle=True, batch_size=train_batch_size)
@@ -155,7 +179,8 @@ def main():
         )
 
         ndcg_scores = ir_evaluator.compute_metrices(model)
-        
+        logger.info(f"Pre-tokenized training batches: {pretokenized.hits}, tokenized on the fly: {pretokenized.misses}")
+
         evaluation_results[f'run_{i+1}'] = {
             'seed': seed,
             'NDCG@1': ndcg_scores[0],
@@ -0,0 +1,33 @@
+"""
+Exports the generated utterances (data/dataset/<llm>/<prompt>/utterances/*.json) to the Parquet store
+read by the retrieval preprocessing and the quality evaluation (data/dataset/<llm>/<prompt>/utterances.parquet).
+"""
+
+import os
+import time
+import argparse
+from preprocessing.utterance_store import export_utterances, store_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the generated utterances to Parquet.")
+    parser.add_argument("dataset_path", help="folder with the <llm>/<prompt>/utterances folders")
+    parser.add_argument("--llms", nargs="+", default=None, help="LLMs to export (all by default)")
+    parser.add_argument("--prompts", nargs="+", default=None, help="prompt designs to export (all by default)")
+    args = parser.parse_args()
+
+    for llm in sorted(os.listdir(args.dataset_path)):
+        if args.llms and llm not in args.llms:
+            continue
+        for prompt in sorted(os.listdir(os.path.join(args.dataset_path, llm))):
+            utterances_folder = os.path.join(args.dataset_path, llm, prompt, "utterances")
+            if (args.prompts and prompt not in args.prompts) or not os.path.isdir(utterances_folder):
+                continue
+            start = time.perf_counter()
+            output_path = store_path(utterances_folder)
+            rows = export_utterances(utterances_folder, output_path, llm=llm, prompt=prompt)
+            print(f"✅ Saved {output_path} ({rows} rows, {time.perf_counter() - start:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
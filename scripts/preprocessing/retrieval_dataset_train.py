@@ -10,6 +10,8 @@ from sklearn.utils import shuffle
 from typing import List, Dict
 from pathlib import Path
 from tqdm import tqdm
+from itertools import groupby
+from preprocessing.utterance_store import fresh_files, read_utterances, store_path
 
 def load_config(path: Path) -> dict:
     """Loads configuration to be used in the generation method."""
@@ -23,6 +25,38 @@ def load_config(path: Path) -> dict:
             sys.exit(1)
     return cfg
 
+def store_methods(path: Path, files: List[str]):
+    """Reads the API methods and utterances from the Parquet store (only the columns needed for training),
+    yielding the same (api_name, api_description, api_method, utterances) as the JSON files, in the order of `files`."""
+    columns = ["file", "api", "api_description", "method_index", "method", "method_description", "method_parameters",
+               "utterance", "utterances_error"]
+    table = read_utterances(str(path), columns=columns, filters=[("file", "in", files)]).to_pydict()
+    rows_by_file = {}
+    for row in zip(*(table[column] for column in columns)):
+        rows_by_file.setdefault(row[0], []).append(row)
+    for filename in files:
+        for _, method_rows in groupby(rows_by_file.get(filename, []), key=lambda row: row[3]):
+            method_rows = list(method_rows)
+            _, api_name, api_description, _, method, method_description, method_parameters, _, error = method_rows[0]
+            api_method = {"name": method, "description": method_description, "parameters": json.loads(method_parameters)}
+            utterances = error if error is not None else [{"utterance": row[7]} for row in method_rows if row[7] is not None]
+            yield api_name, api_description, api_method, utterances
+
+def json_methods(dataset_path: Path):
+    """Reads the API methods and utterances from the JSON files of the dataset."""
+    for root, _, files in os.walk(dataset_path):
+        for filename in files:
+            file_path = os.path.join(root, filename)  # path to the API spec file 
+            with open(file_path, 'r') as f:
+                data = json.load(f)
+            api_name = data.get('name') if data.get('name') else data.get('tool_name', '')
+            api_description = data.get('description') if data.get('description') else data.get('tool_description', '')
+            print(f"Processing API: {api_name}")
+
+            api_methods = data.get('api_methods') if data.get('api_methods') else data.get('api_list', [])
+            for api_method in api_methods:
+                yield api_name, api_description, api_method, api_method['utterances']
+
 def main():
     # 1 - loading config information
     cfg = load_config(Path(__file__).parent.parent / "config" / "config_retriever_dataset_preprocess.yaml")
@@ -39,41 +73,40 @@ def main():
     train_pairs = []
     number_of_apis = 0
 
-    # 2 - iterating through all OAS files
-    for root, _, files in os.walk(dataset_path):
-        for filename in files:
-            file_path = os.path.join(root, filename)  # path to the API spec file 
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-            api_name = data.get('name') if data.get('name') else data.get('tool_name', '')
-            api_description = data.get('description') if data.get('description') else data.get('tool_description', '')
-            print(f"Processing API: {api_name}")
-
-            # organizing apis IDs
-            api_methods = data.get('api_methods') if data.get('api_methods') else data.get('api_list', [])
-            for api_method in api_methods:
-                api_method_name = api_method.get('name', '')
-                api_method_description = api_method.get('description', '')
-                api_method_parameters = api_method.get('parameters', [])
+    # 2 - iterating through all API methods (Parquet store when exported from the current files, JSON files otherwise),
+    # in the order of the files in the dataset folder, so both give the same ids
+    files = [filename for _, _, filenames in os.walk(dataset_path) for filename in filenames]
+    store = Path(store_path(str(dataset_path)))
+    if cfg.get("use_utterance_store", True) and store.exists() and set(files) <= fresh_files(str(store), str(dataset_path)):
+        print(f"Reading the utterance store {store}")
+        api_methods = store_methods(store, files)
+    else:
+        if cfg.get("use_utterance_store", True) and store.exists():
+            print(f"The utterance store {store} is older than the JSON files: reading the JSON files (export it again to use it)")
+        api_methods = json_methods(dataset_path)
 
-                document_content = {"api_name": api_name,
-                                    "api_description": api_description,
-                                    "api_method_name": api_method_name,
-                                    "api_method_description": api_method_description,
-                                    "api_method_parameters": api_method_parameters}
+    for api_name, api_description, api_method, utterances in api_methods:
+        api_method_name = api_method.get('name', '')
+        api_method_description = api_method.get('description', '')
+        api_method_parameters = api_method.get('parameters', [])
 
-                doc_id = doc_id_map.setdefault(json.dumps(document_content), len(doc_id_map) + 1)
-                if doc_id == len(doc_id_map):
-                    documents.append([doc_id, document_content])
+        document_content = {"api_name": api_name,
+                            "api_description": api_description,
+                            "api_method_name": api_method_name,
+                            "api_method_description": api_method_description,
+                            "api_method_parameters": api_method_parameters}
 
-                # organizing queries and training pairs
-                if isinstance(api_method['utterances'], list):
-                    for utterance in api_method.get('utterances', []):
-                        utterance_content = utterance.get('utterance', '')
-                        utterance_id = query_id_map.setdefault(utterance_content, len(query_id_map) + 1)
-                        train_pairs.append(([utterance_id, utterance_content], [utterance_id, 0, doc_id, 1]))
+        doc_id = doc_id_map.setdefault(json.dumps(document_content), len(doc_id_map) + 1)
+        if doc_id == len(doc_id_map):
+            documents.append([doc_id, document_content])
 
-            number_of_apis += 1
+        # organizing queries and training pairs
+        if isinstance(utterances, list):
+            for utterance in utterances:
+                utterance_content = utterance.get('utterance', '')
+                utterance_id = query_id_map.setdefault(utterance_content, len(query_id_map) + 1)
+                train_pairs.append(([utterance_id, utterance_content], [utterance_id, 0, doc_id, 1]))
+    number_of_apis = len(files)
 
     print(f"Total APIs processed: {number_of_apis}")
     train_pairs = shuffle(train_pairs, random_state=42)
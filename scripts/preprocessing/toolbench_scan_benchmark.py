@@ -0,0 +1,46 @@
+"""
+Benchmark of the ToolBench tools scan: sequential `get_top_popularity_scores` against the process-pool
+`scan_top_popularity_scores`. Both must select the same tools in the same order.
+"""
+
+import time
+import argparse
+from preprocessing.toolbench import ToolBenchPreProcessing
+
+
+def timed(function, repeats: int) -> float:
+    """Best wall-clock time of `repeats` runs (the first run also warms up the file system cache)."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ToolBench tools scan.")
+    parser.add_argument("base_folder", help="toolenv/tools folder of ToolBench")
+    parser.add_argument("--apis_per_category", type=int, default=5)
+    parser.add_argument("--max_api_methods", type=int, default=30)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    # 1 - sequential scan (reference)
+    sequential = ToolBenchPreProcessing(args.base_folder, new_folder="")
+    sequential_time = timed(lambda: sequential.get_top_popularity_scores(args.apis_per_category, args.max_api_methods), args.repeats)
+    print(f"Sequential scan: {sequential_time:.2f}s ({len(sequential.apis)} categories)")
+
+    # 2 - process-pool scan with a bounded heap per category
+    for num_workers in args.workers:
+        parallel = ToolBenchPreProcessing(args.base_folder, new_folder="")
+        parallel_time = timed(lambda: parallel.scan_top_popularity_scores(args.apis_per_category, args.max_api_methods,
+                                                                          num_workers=num_workers), args.repeats)
+        same = parallel.apis == sequential.apis
+        print(f"Parallel scan ({num_workers} workers): {parallel_time:.2f}s | speedup {sequential_time / parallel_time:.2f}x | "
+              f"same selection: {'✅' if same else '❌'}")
+
+
+if __name__ == '__main__':
+    main()
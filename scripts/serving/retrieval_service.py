@@ -0,0 +1,33 @@
+"""
+Serves a trained retriever (SentenceTransformer checkpoint) over HTTP: top-k API methods of a corpus.tsv for
+the queries of the agents. See src/retrieval/service.py for the endpoints.
+"""
+
+import argparse
+from aiohttp import web
+from retrieval.service import RetrievalService, create_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local retrieval service with micro-batching.")
+    parser.add_argument("checkpoint", help="SentenceTransformer checkpoint (e.g., models/<llm>/<prompt>/<date>_run_1)")
+    parser.add_argument("corpus", help="corpus.tsv file with the API methods")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--batch_window_ms", type=float, default=5, help="maximum wait of a request for its micro-batch")
+    parser.add_argument("--max_batch_size", type=int, default=64)
+    parser.add_argument("--cache_size", type=int, default=10000, help="query embeddings kept in the LRU cache")
+    parser.add_argument("--index", default="flat", help="index backend: flat (exact) or ivf")
+    parser.add_argument("--nprobe", type=int, default=8, help="clusters probed by the ivf index")
+    args = parser.parse_args()
+
+    index_params = {"nprobe": args.nprobe} if args.index == "ivf" else {}
+    service = RetrievalService.from_checkpoint(args.checkpoint, args.corpus, batch_window_ms=args.batch_window_ms,
+                                               max_batch_size=args.max_batch_size, cache_size=args.cache_size,
+                                               index_backend=args.index, index_params=index_params)
+    print(f"✅ Indexed {len(service.doc_ids)} documents in {service.index_seconds:.2f}s")
+    web.run_app(create_app(service), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
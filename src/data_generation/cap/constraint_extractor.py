@@ -3,18 +3,29 @@ Constraint extractor using LLMs to identify parameter constraints from API speci
 """
 
 import json
-import re
 import copy
 import os
-from typing import Dict, List
+import asyncio
+from typing import Dict, List, Optional
 from tqdm import tqdm
-from openai import OpenAI
+from llm_client.cache import ResponseCache
+from llm_client.client import ChatClient
+from llm_client.batch import make_request
+from llm_client.parsing import CONSTRAINTS_SCHEMA, ParseError, parse_json, validate, response_format
+from data_generation.journal import GenerationJournal
 from .prompts import CONSTRAINT_EXTRACTION, EXAMPLE_INPUT_CONSTRAINT, EXAMPLE_OUTPUT_CONSTRAINT
 
 class ConstraintExtractor:
-    def __init__(self, api_key: str, base_url: str = None, model_name: str = "gpt-4o"):
+    def __init__(self, api_key: str, base_url: str = None, model_name: str = "gpt-4o", max_concurrency: int = 8,
+                 cache: ResponseCache = None, journal: GenerationJournal = None, llm_client: ChatClient = None,
+                 structured_output: bool = False, max_parse_retries: int = 2):
         self.model_name = model_name
-        self.openai_client = OpenAI(api_key=api_key, base_url=base_url)
+        self.max_concurrency = max_concurrency
+        self.journal = journal
+        self.structured_output = structured_output  # schema-constrained output, for providers supporting it
+        self.max_parse_retries = max_parse_retries  # retries of a method whose output is invalid
+        # a shared client (e.g., a ClientPool) can be given instead of a single endpoint
+        self.llm_client = llm_client or ChatClient(api_key=api_key, base_url=base_url, model_name=model_name, cache=cache)
 
         # Base LLM prompt
         self.constraint_extraction_prompt = [
@@ -28,72 +39,184 @@ class ConstraintExtractor:
         with open(api_path, 'r') as f:
             data = json.load(f)
 
-        api_name = data.get('tool_name', '')
-        api_description = data.get('tool_description', '')
-        api_url = data.get('home_url', '')
-
-        print(f"Processing API: {api_name}")
+        print(f"Processing API: {data.get('tool_name', '')}")
 
         api_methods_to_save = []
-        for api_method in data.get('api_list', []):
-            api_method_name = api_method.get('name', '')
-            api_method_description = api_method.get('description', '')
+        for api_method_index, api_method in enumerate(data.get('api_list', [])):
             api_method_parameters = api_method.get('parameters', [])
-            api_method_url = api_method.get('url', '')
 
-            # print(f"   └── Method: {api_method_name}")
+            # Only call LLM if there are parameters (and the method was not completed in a previous run)
+            journaled = self._from_journal(data, api_method_index, api_method)
+            if journaled is not None:
+                api_method_parameters = journaled
+            elif len(api_method_parameters) > 0:
+                constraints = self.llm_client.create_json(
+                    messages=self._build_messages(data, api_method),
+                    max_tokens=1000,
+                    temperature=temperature,
+                    schema=CONSTRAINTS_SCHEMA,
+                    tags=self._ledger_tags(data, api_method),
+                    structured=self.structured_output,
+                    max_retries=self.max_parse_retries
+                )
 
-            # Only call LLM if there are parameters
-            if len(api_method_parameters) > 0:
-                input_data = {
-                    "API Name": api_name,
-                    "API Description": api_description,
-                    "API Method Name": api_method_name,
-                    "API Method Description": api_method_description[:4000],
-                    "Parameters": api_method_parameters,
-                }
-
-                messages = copy.deepcopy(self.constraint_extraction_prompt) + [{"role": "user", "content": str(input_data)}]
-                response = self.openai_client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
+                # Attach parsed constraints to parameters (failed methods are not journaled, so they are retried)
+                api_method_parameters = self._attach_constraints(constraints, api_method_parameters)
+                if constraints is not None:
+                    self._to_journal(data, api_method_index, api_method, api_method_parameters)
+
+            api_methods_to_save.append(self._method_documentation(api_method, api_method_parameters))
+
+        return self._api_documentation(data, api_methods_to_save)
+
+    def extract_constraints_concurrently(self, api_paths: List[str], temperature: float = 0.0, max_concurrency: int = None) -> List[Optional[Dict]]:
+        """Extract constraints for several API specification files at once.
+        All methods of all APIs are sent concurrently, limited to `max_concurrency` in-flight requests.
+        The documentations are returned in the same order as `api_paths`; an API whose extraction failed gets None
+        (the others are kept), so the caller can save the successful ones and retry the failed ones."""
+        max_concurrency = max_concurrency or self.max_concurrency
+        return asyncio.run(self._extract_many(api_paths, temperature, max_concurrency))
+
+    async def extract_constraints_async(self, api_path: str, temperature: float = 0.0, semaphore: asyncio.Semaphore = None) -> Dict:
+        """Asynchronous version of `extract_constraints` that fans out all API methods concurrently."""
+        with open(api_path, 'r') as f:
+            data = json.load(f)
+
+        print(f"Processing API: {data.get('tool_name', '')}")
+
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+
+        # gather keeps the results in the same order as the API methods
+        api_methods_to_save = await asyncio.gather(*[
+            self._extract_method_constraints_async(data, api_method_index, temperature, semaphore)
+            for api_method_index in range(len(data.get('api_list', [])))])
+
+        return self._api_documentation(data, list(api_methods_to_save))
+
+    async def _extract_many(self, api_paths: List[str], temperature: float, max_concurrency: int) -> List[Dict]:
+        """Share a single concurrency limit across all APIs."""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        documentations = await asyncio.gather(*[
+            self.extract_constraints_async(api_path, temperature, semaphore)
+            for api_path in api_paths], return_exceptions=True)
+        for api_path, documentation in zip(api_paths, documentations):
+            if isinstance(documentation, BaseException):
+                print(f"❌ Constraint extraction failed for {api_path}: {documentation!r}")
+        return [None if isinstance(documentation, BaseException) else documentation for documentation in documentations]
+
+    async def _extract_method_constraints_async(self, data: Dict, api_method_index: int, temperature: float,
+                                                semaphore: asyncio.Semaphore) -> Dict:
+        """Extract the constraints of a single API method."""
+        api_method = data['api_list'][api_method_index]
+        api_method_parameters = api_method.get('parameters', [])
+
+        # Only call LLM if there are parameters (and the method was not completed in a previous run)
+        journaled = self._from_journal(data, api_method_index, api_method)
+        if journaled is not None:
+            api_method_parameters = journaled
+        elif len(api_method_parameters) > 0:
+            async with semaphore:
+                constraints = await self.llm_client.acreate_json(
+                    messages=self._build_messages(data, api_method),
                     max_tokens=1000,
-                    temperature=temperature
+                    temperature=temperature,
+                    schema=CONSTRAINTS_SCHEMA,
+                    tags=self._ledger_tags(data, api_method),
+                    structured=self.structured_output,
+                    max_retries=self.max_parse_retries
                 )
+            api_method_parameters = self._attach_constraints(constraints, api_method_parameters)
+            if constraints is not None:
+                self._to_journal(data, api_method_index, api_method, api_method_parameters)
 
-                # Attach parsed constraints to parameters
+        return self._method_documentation(api_method, api_method_parameters)
+
+    def batch_requests(self, api_path: str, temperature: float, custom_id_prefix: str) -> List[Dict]:
+        """Batch requests to extract the constraints of all API methods that have parameters."""
+        with open(api_path, 'r') as f:
+            data = json.load(f)
+
+        return [make_request(f"{custom_id_prefix}::{api_method_index}", self.model_name,
+                             self._build_messages(data, api_method), 1000, temperature,
+                             response_format("output", CONSTRAINTS_SCHEMA) if self.structured_output else None)
+                for api_method_index, api_method in enumerate(data.get('api_list', []))
+                if len(api_method.get('parameters', [])) > 0]
+
+    def apply_batch_responses(self, api_path: str, responses: Dict, custom_id_prefix: str) -> Optional[Dict]:
+        """Build the documentation from batch responses. Returns None if any response is missing."""
+        with open(api_path, 'r') as f:
+            data = json.load(f)
+
+        api_methods_to_save = []
+        for api_method_index, api_method in enumerate(data.get('api_list', [])):
+            api_method_parameters = api_method.get('parameters', [])
+            if len(api_method_parameters) > 0:
+                response = responses.get(f"{custom_id_prefix}::{api_method_index}")
+                if response is None:
+                    return None
                 api_method_parameters = self._process_llm_output(response, api_method_parameters)
+            api_methods_to_save.append(self._method_documentation(api_method, api_method_parameters))
+
+        return self._api_documentation(data, api_methods_to_save)
+
+    def _build_messages(self, data: Dict, api_method: Dict) -> List[Dict]:
+        """Build the prompt used to extract the constraints of an API method."""
+        input_data = {
+            "API Name": data.get('tool_name', ''),
+            "API Description": data.get('tool_description', ''),
+            "API Method Name": api_method.get('name', ''),
+            "API Method Description": api_method.get('description', '')[:4000],
+            "Parameters": api_method.get('parameters', []),
+        }
+        return copy.deepcopy(self.constraint_extraction_prompt) + [{"role": "user", "content": str(input_data)}]
+
+    def _from_journal(self, data: Dict, api_method_index: int, api_method: Dict) -> Optional[List[Dict]]:
+        if self.journal is None:
+            return None
+        return self.journal.get(data.get('tool_name', ''), api_method_index, api_method.get('name', ''), "constraints")
+
+    def _to_journal(self, data: Dict, api_method_index: int, api_method: Dict, api_method_parameters: List[Dict]) -> None:
+        if self.journal is not None:
+            self.journal.record(data.get('tool_name', ''), api_method_index, api_method.get('name', ''), "constraints", api_method_parameters)
+
+    def _ledger_tags(self, data: Dict, api_method: Dict) -> Dict:
+        return {"stage": "constraints", "api": data.get('tool_name', ''), "method": api_method.get('name', ''),
+                "category": data.get('category', '')}
+
+    def _method_documentation(self, api_method: Dict, api_method_parameters: List[Dict]) -> Dict:
+        return {
+            "name": api_method.get('name', ''),
+            "description": api_method.get('description', ''),
+            "url": api_method.get('url', ''),
+            "parameters": api_method_parameters
+        }
 
-            api_methods_to_save.append({
-                "name": api_method_name,
-                "description": api_method_description,
-                "url": api_method_url,
-                "parameters": api_method_parameters
-            })
-
-        documentation = {
-            "name": api_name,
-            "description": api_description,
-            "url": api_url,
+    def _api_documentation(self, data: Dict, api_methods_to_save: List[Dict]) -> Dict:
+        return {
+            "name": data.get('tool_name', ''),
+            "description": data.get('tool_description', ''),
+            "url": data.get('home_url', ''),
             "api_methods": api_methods_to_save
         }
 
-        return documentation
-
     def _process_llm_output(self, llm_response, api_method_parameters: List[Dict]) -> List[Dict]:
         """Parse and attach constraints from the LLM output to the parameter list."""
         try:
-            content = llm_response.choices[0].message.content
-            content = re.sub(r"```(json)?", "", content).strip()
-            content = re.sub(r"//.*", "", content)
-            constraints = json.loads(content)
-
-            for parameter in api_method_parameters:
-                name = parameter.get("name")
-                if name in constraints:
-                    parameter['constraints'] = constraints[name]
-
-        except Exception as e:
+            constraints = parse_json(llm_response.choices[0].message.content)
+        except ParseError:
+            constraints = None
+        if constraints is not None and validate(constraints, CONSTRAINTS_SCHEMA):
+            constraints = None
+        return self._attach_constraints(constraints, api_method_parameters)
+
+    def _attach_constraints(self, constraints: Optional[Dict], api_method_parameters: List[Dict]) -> List[Dict]:
+        """Attach the parsed constraints to the parameters (kept without constraints if the output was invalid)."""
+        if constraints is None:
             print("Error parsing LLM output when extracting constraints.")
+            return api_method_parameters
 
+        for parameter in api_method_parameters:
+            name = parameter.get("name")
+            if name in constraints:
+                parameter['constraints'] = constraints[name]
         return api_method_parameters
@@ -0,0 +1,191 @@
+"""
+Staged producer/consumer pipeline for the constraint-aware generation.
+
+Extraction workers feed a bounded queue drained by utterance generation workers, and a single writer
+persists both artifacts, so both LLM stages are kept busy at the same time instead of alternating per API.
+"""
+
+import os
+import json
+import copy
+import queue
+import threading
+from typing import List, Tuple
+from .constraint_extractor import ConstraintExtractor
+from .utterance_generator import UtteranceGenerator
+
+_STOP = object()  # sentinel that shuts down a stage
+
+
+class CAPPipeline:
+    def __init__(self,
+                 extractor: ConstraintExtractor,
+                 utterance_generator: UtteranceGenerator,
+                 output_folder: str,
+                 num_utterances: int = 10,
+                 temperature: float = 0.0,
+                 max_concurrency: int = 1,
+                 extraction_workers: int = 2,
+                 generation_workers: int = 2,
+                 queue_size: int = 4):
+        self.extractor = extractor
+        self.utterance_generator = utterance_generator
+        self.constraints_folder = os.path.join(output_folder, "constraints")
+        self.utterances_folder = os.path.join(output_folder, "utterances")
+        self.num_utterances = num_utterances
+        self.temperature = temperature
+        self.max_concurrency = max_concurrency
+        self.extraction_workers = extraction_workers
+        self.generation_workers = generation_workers
+        self.queue_size = queue_size
+
+        self._stop_event = threading.Event()  # set on interruption: no new API is started
+        self._writer_error = None
+        self._failed = []
+
+    def run(self, api_files: List[Tuple[str, str]]) -> List[str]:
+        """Process (filename, OAS path) pairs. APIs that already have utterances are skipped and
+        existing constraint files are reused. Returns the filenames that failed."""
+        os.makedirs(self.constraints_folder, exist_ok=True)
+        os.makedirs(self.utterances_folder, exist_ok=True)
+        self._stop_event.clear()
+        self._writer_error = None
+        self._failed = []
+
+        pending = [(filename, path) for filename, path in api_files
+                   if not os.path.exists(os.path.join(self.utterances_folder, filename))]
+        print(f"Pipeline: {len(pending)} APIs to process ({len(api_files) - len(pending)} already have utterances)")
+
+        # queues between stages (bounded to apply backpressure on the faster stage)
+        input_queue = queue.Queue()
+        constraints_queue = queue.Queue(maxsize=self.queue_size)
+        writer_queue = queue.Queue(maxsize=self.queue_size)
+        for item in pending:
+            input_queue.put(item)
+        for _ in range(self.extraction_workers):
+            input_queue.put(_STOP)
+
+        extraction_threads = [threading.Thread(target=self._extraction_worker, args=(input_queue, constraints_queue, writer_queue))
+                              for _ in range(self.extraction_workers)]
+        generation_threads = [threading.Thread(target=self._generation_worker, args=(constraints_queue, writer_queue))
+                              for _ in range(self.generation_workers)]
+        writer_thread = threading.Thread(target=self._writer, args=(writer_queue,))
+        for thread in extraction_threads + generation_threads + [writer_thread]:
+            thread.start()
+
+        try:
+            # each stage is shut down once the stage feeding it has finished
+            self._join(extraction_threads)
+            for _ in range(self.generation_workers):
+                self._put(constraints_queue, _STOP, until_stopped=True)
+            self._join(generation_threads)
+            self._put(writer_queue, _STOP)
+            self._join([writer_thread])
+        except KeyboardInterrupt:
+            print("Pipeline interrupted, waiting for the workers to finish their current API...")
+            self._stop_event.set()
+            for thread in extraction_threads + generation_threads:
+                thread.join()
+            # the writer saves everything the workers finished before it stops
+            self._put(writer_queue, _STOP)
+            writer_thread.join()
+            raise
+
+        if self._writer_error is not None:
+            raise RuntimeError(f"The pipeline writer failed: {self._writer_error}") from self._writer_error
+        return self._failed
+
+    def _extraction_worker(self, input_queue: queue.Queue, constraints_queue: queue.Queue, writer_queue: queue.Queue) -> None:
+        while not self._stop_event.is_set():
+            item = input_queue.get()
+            if item is _STOP:
+                return
+            filename, path = item
+            constraints_path = os.path.join(self.constraints_folder, filename)
+            try:
+                if os.path.exists(constraints_path):
+                    with open(constraints_path, "r") as f:
+                        constraints = json.load(f)
+                    print(f"The file {filename} already has extracted constraints")
+                else:
+                    if self.max_concurrency > 1:
+                        constraints = self.extractor.extract_constraints_concurrently([path], self.temperature, self.max_concurrency)[0]
+                        if constraints is None:
+                            raise RuntimeError("the extraction of at least one method failed")
+                    else:
+                        constraints = self.extractor.extract_constraints(path, self.temperature)
+                    # the writer gets its own copy since the generation stage adds the utterances in place
+                    self._put(writer_queue, (constraints_path, copy.deepcopy(constraints), "constraints", f"✅ Saved extracted constraints of {filename}"))
+            except Exception as e:
+                self._fail(filename, "constraint extraction", e)
+                continue
+            # once stopped, the saved constraints are picked up by the next run
+            self._put(constraints_queue, (filename, constraints), until_stopped=True)
+
+    def _generation_worker(self, constraints_queue: queue.Queue, writer_queue: queue.Queue) -> None:
+        while not self._stop_event.is_set():
+            item = self._get(constraints_queue)
+            if item is _STOP or item is None:
+                return
+            filename, constraints = item
+            try:
+                oas_with_utterances = self.utterance_generator.generate_utterances(
+                    constraints, num_utterances=self.num_utterances, temperature=self.temperature, max_concurrency=self.max_concurrency)
+            except Exception as e:
+                self._fail(filename, "utterance generation", e)
+                continue
+            self._put(writer_queue, (os.path.join(self.utterances_folder, filename), oas_with_utterances, "utterances", f"✅ Saved OAS with utterances of {filename}"))
+
+    def _writer(self, writer_queue: queue.Queue) -> None:
+        """Save the results until the _STOP sentinel (also after an interruption, so no finished API is lost).
+        A failure stops the pipeline and is raised by `run`."""
+        try:
+            while True:
+                item = writer_queue.get()
+                if item is _STOP:
+                    return
+                output_file, data, stage, message = item
+                # atomic write so an interrupted run never leaves a partial file that would be skipped on resume
+                tmp_file = output_file + ".tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(data, f, indent=4)
+                os.replace(tmp_file, output_file)
+
+                # the journaled methods of this API are no longer needed once the file is saved
+                journal = self.extractor.journal if stage == "constraints" else self.utterance_generator.journal
+                if journal is not None:
+                    journal.compact(data["name"], stage)
+                print(message)
+        except Exception as e:
+            print(f"Error while saving the pipeline results: {e}. Stopping the pipeline.")
+            self._writer_error = e
+            self._stop_event.set()
+
+    def _fail(self, filename: str, stage: str, error: Exception) -> None:
+        print(f"Error in {stage} of {filename}: {error}. It will be retried in the next run.")
+        self._failed.append(filename)
+
+    def _put(self, q: queue.Queue, item, until_stopped: bool = False) -> None:
+        """Blocking put that gives up when the writer failed (or, with `until_stopped`, when the pipeline is
+        stopped, for the queues whose consumers exit on interruption)."""
+        while self._writer_error is None and not (until_stopped and self._stop_event.is_set()):
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue):
+        """Blocking get that returns None when the pipeline is stopped."""
+        while True:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    return None
+
+    def _join(self, threads: List[threading.Thread]) -> None:
+        # join with a timeout so KeyboardInterrupt is delivered to the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=0.5)
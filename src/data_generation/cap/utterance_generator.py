@@ -1,4 +1,3 @@
-import json
 import ast
 import copy
 import os
@@ -6,76 +5,154 @@ import numpy as np
 import random
 import itertools
 import re
-from typing import Dict, List
-from openai import OpenAI
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from llm_client.cache import ResponseCache
+from llm_client.client import ChatClient
+from llm_client.batch import make_request
+from llm_client.parsing import UTTERANCE_ITEM_SCHEMA, UTTERANCES_SCHEMA, ParseError, parse_json, validate, unwrap, response_format
+from data_generation.journal import GenerationJournal
 from .prompts import PROMPT_UTTERANCE_GENERATION
 
 
 class UtteranceGenerator:
-    def __init__(self, api_key: str, base_url: str = None, model_name: str = "gpt-4o"):
+    def __init__(self, api_key: str, base_url: str = None, model_name: str = "gpt-4o", cache: ResponseCache = None,
+                 journal: GenerationJournal = None, llm_client: ChatClient = None, structured_output: bool = False,
+                 max_parse_retries: int = 2, streaming: bool = False):
         self.model_name = model_name
-        self.openai_client = OpenAI(api_key=api_key, base_url=base_url)
+        self.journal = journal
+        self.structured_output = structured_output  # schema-constrained output, for providers supporting it
+        self.max_parse_retries = max_parse_retries  # retries of a method whose output is invalid
+        self.streaming = streaming  # stream the completion and stop once `num_utterances` utterances are parsed
+        # a shared client (e.g., a ClientPool) can be given instead of a single endpoint
+        self.llm_client = llm_client or ChatClient(api_key=api_key, base_url=base_url, model_name=model_name, cache=cache)
 
-    def generate_utterances(self, oas: Dict, num_utterances: int = 10, temperature: float = 0.3) -> List[str]:
-        """Generate constraint-aware utterances for a given API method."""            
-        api_name = oas['name']
-        api_description = oas['description']
+    def generate_utterances(self, oas: Dict, num_utterances: int = 10, temperature: float = 0.3, max_concurrency: int = 1,
+                            only_failed: bool = False) -> List[str]:
+        """Generate constraint-aware utterances for a given API method.
+        With `max_concurrency` > 1, the API methods are dispatched in parallel using a thread pool.
+        With `only_failed`, the methods that already have utterances (e.g., from a previous run) are kept."""
+        def generate(api_method_index):
+            return self._generate_method_utterances(oas, api_method_index, num_utterances, temperature)
+
+        api_method_indexes = [api_method_index for api_method_index, api_method in enumerate(oas['api_methods'])
+                              if not (only_failed and isinstance(api_method.get('utterances'), list))]
+
+        # iterating through all API methods (map keeps the results in the original order)
+        if max_concurrency > 1:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                results = list(executor.map(generate, api_method_indexes))
+        else:
+            results = map(generate, api_method_indexes)
+
+        for api_method_index, utterances in zip(api_method_indexes, results):
+            api_method = oas['api_methods'][api_method_index]
+            api_method['utterances'] = utterances
+            print(f"   └── Generated {len(api_method['utterances'])} utterances for method: {api_method['name']}")
+        return oas
+
+    def _generate_method_utterances(self, oas: Dict, api_method_index: int, num_utterances: int, temperature: float):
+        """Call the LLM to generate the utterances of a single API method (unless completed in a previous run)."""
+        api_method = oas['api_methods'][api_method_index]
+        if self.journal is not None:
+            journaled = self.journal.get(oas['name'], api_method_index, api_method['name'], "utterances")
+            if journaled is not None:
+                return journaled
 
-        # iterating through all API methods
-        for api_method_index, api_method in enumerate(oas['api_methods']):
-            api_method_name = api_method['name']
-            api_method_description = api_method['description'] 
-            api_method_parameters = [param for param in api_method['parameters'] if not ('constraints' in param and param['constraints'].get('technical') is True)]
-
-            # defining required and optional parameters
-            required_parameters = [param["name"] for param in api_method_parameters if param.get('required', False)]
-            optional_parameters = [param["name"] for param in api_method_parameters if 'required' in param and param['required'] is False]
-
-            # preparing input for LLM
-            api_specification = {"API Name": api_name,
-                                "API Description": api_description if len(api_description) < 4000 else '',
-                                "API Method Name": api_method_name,
-                                "API Method Description": api_method_description if len(api_method_description) < 4000 else '',
-                                "Parameters": api_method_parameters}
-
-            if len(required_parameters) + len(optional_parameters) == 0:
-                input = (f"API Specification: \n{api_specification}\n"
-                         f"Write {num_utterances} utterances that use the given API.\n")
-            elif len(optional_parameters) == 0:
-                input = (f"API Specification: \n{api_specification}\n"
-                            f"Write {num_utterances} utterances that use the given API.\n"
-                            f"Required parameters: {str(required_parameters).strip('[]')}.\n")
-            elif len(required_parameters) == 0:
-                input = (f"API Specification: \n{api_specification}\n"
-                            f"Write {num_utterances} utterances that use the given API.\n"
-                            f"Optional parameters: {str(optional_parameters).strip('[]')}.\n")
-            else:
-                input = (f"API Specification: \n{api_specification}\n"
-                            f"Write {num_utterances} utterances that use the given API.\n"
-                            f"Required parameters: {str(required_parameters).strip('[]')}.\n"
-                            f"Optional parameters: {str(optional_parameters).strip('[]')}.\n")
-            
-            # prompt definition and calling LLM
-            messages = [{"role": "system", "content": PROMPT_UTTERANCE_GENERATION},
-                        {"role": "user", "content": str(input)}]
-            response = self.openai_client.chat.completions.create(
-                        model=self.model_name,
-                        messages=messages,
+        if self.streaming:
+            utterances = self.llm_client.create_json_stream(
+                        messages=self._build_messages(oas, api_method, num_utterances),
+                        max_tokens=3000,
+                        temperature=temperature,
+                        item_schema=UTTERANCE_ITEM_SCHEMA,
+                        max_items=num_utterances,
+                        tags=self._ledger_tags(oas, [api_method], num_utterances),
+                        structured=self.structured_output,
+                        max_retries=self.max_parse_retries)
+        else:
+            utterances = self.llm_client.create_json(
+                        messages=self._build_messages(oas, api_method, num_utterances),
                         max_tokens=3000,
-                        temperature=temperature)
-            api_method['utterances'] = self._process_llm_output(response)
-            print(f"   └── Generated {len(api_method['utterances'])} utterances for method: {api_method_name}")
+                        temperature=temperature,
+                        schema=UTTERANCES_SCHEMA,
+                        tags=self._ledger_tags(oas, [api_method], num_utterances),
+                        structured=self.structured_output,
+                        max_retries=self.max_parse_retries)
+        if utterances is None:
+            # not journaled, so the method is generated again in the next run
+            print("Error parsing LLM output when generating utterances.")
+            return 'error parsing the information'
+        if self.journal is not None:
+            self.journal.record(oas['name'], api_method_index, api_method['name'], "utterances", utterances)
+        return utterances
+
+    def batch_requests(self, oas: Dict, num_utterances: int, temperature: float, custom_id_prefix: str) -> List[Dict]:
+        """Batch requests to generate the utterances of all API methods."""
+        return [make_request(f"{custom_id_prefix}::{api_method_index}", self.model_name,
+                             self._build_messages(oas, api_method, num_utterances), 3000, temperature,
+                             response_format("output", UTTERANCES_SCHEMA) if self.structured_output else None)
+                for api_method_index, api_method in enumerate(oas['api_methods'])]
+
+    def apply_batch_responses(self, oas: Dict, responses: Dict, custom_id_prefix: str) -> Optional[Dict]:
+        """Attach the utterances from batch responses. Returns None if any response is missing."""
+        custom_ids = [f"{custom_id_prefix}::{api_method_index}" for api_method_index in range(len(oas['api_methods']))]
+        if any(custom_id not in responses for custom_id in custom_ids):
+            return None
+        for api_method, custom_id in zip(oas['api_methods'], custom_ids):
+            api_method['utterances'] = self._process_llm_output(responses[custom_id])
         return oas
 
+    def _build_messages(self, oas: Dict, api_method: Dict, num_utterances: int) -> List[Dict]:
+        """Build the prompt used to generate the utterances of an API method."""
+        api_name = oas['name']
+        api_description = oas['description']
+        api_method_name = api_method['name']
+        api_method_description = api_method['description'] 
+        api_method_parameters = [param for param in api_method['parameters'] if not ('constraints' in param and param['constraints'].get('technical') is True)]
+
+        # defining required and optional parameters
+        required_parameters = [param["name"] for param in api_method_parameters if param.get('required', False)]
+        optional_parameters = [param["name"] for param in api_method_parameters if 'required' in param and param['required'] is False]
+
+        # preparing input for LLM
+        api_specification = {"API Name": api_name,
+                            "API Description": api_description if len(api_description) < 4000 else '',
+                            "API Method Name": api_method_name,
+                            "API Method Description": api_method_description if len(api_method_description) < 4000 else '',
+                            "Parameters": api_method_parameters}
+
+        if len(required_parameters) + len(optional_parameters) == 0:
+            input = (f"API Specification: \n{api_specification}\n"
+                     f"Write {num_utterances} utterances that use the given API.\n")
+        elif len(optional_parameters) == 0:
+            input = (f"API Specification: \n{api_specification}\n"
+                        f"Write {num_utterances} utterances that use the given API.\n"
+                        f"Required parameters: {str(required_parameters).strip('[]')}.\n")
+        elif len(required_parameters) == 0:
+            input = (f"API Specification: \n{api_specification}\n"
+                        f"Write {num_utterances} utterances that use the given API.\n"
+                        f"Optional parameters: {str(optional_parameters).strip('[]')}.\n")
+        else:
+            input = (f"API Specification: \n{api_specification}\n"
+                        f"Write {num_utterances} utterances that use the given API.\n"
+                        f"Required parameters: {str(required_parameters).strip('[]')}.\n"
+                        f"Optional parameters: {str(optional_parameters).strip('[]')}.\n")
+
+        # prompt definition
+        return [{"role": "system", "content": PROMPT_UTTERANCE_GENERATION},
+                {"role": "user", "content": str(input)}]
+
+    def _ledger_tags(self, oas: Dict, api_methods: List[Dict], num_utterances: int) -> Dict:
+        return {"stage": "utterances", "api": oas['name'], "method": ",".join(api_method['name'] for api_method in api_methods),
+                "category": oas.get('category', ''), "utterances": num_utterances * len(api_methods)}
+
     def _process_llm_output(self, llm_response) -> List[Dict]:
-        """Process LLM output to extract and attach constraints to parameters."""
-        try: 
-            content = llm_response.choices[0].message.content
-            content = content.replace("```python","").replace("```","")
-            content = content.replace("True", "true").replace("False", "false").replace("None", "null")
-            content = json.loads(content)
-            return content
-
-        except Exception as e:
+        """Parse and validate the utterances of an LLM output (e.g., a batch response)."""
+        try:
+            content = unwrap(parse_json(llm_response.choices[0].message.content), UTTERANCES_SCHEMA)
+        except ParseError:
+            content = None
+        if content is None or validate(content, UTTERANCES_SCHEMA):
             print("Error parsing LLM output when generating utterances.")
             return 'error parsing the information'
+        return content
@@ -0,0 +1,70 @@
+"""
+Write-ahead journal of the per-method generation results.
+
+Every completed LLM call is appended to a JSONL file as an (api, method, stage) entry, so a run that
+crashes in the middle of an API resumes from the last completed method instead of paying for the whole
+API again. Entries of an API are compacted away once its final JSON file has been saved.
+"""
+
+import os
+import json
+import threading
+from typing import Any, Optional
+
+
+class GenerationJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._load()
+
+    def get(self, api: str, method_index: int, method_name: str, stage: str) -> Optional[Any]:
+        """Journaled result of an API method, None if the method was not completed yet."""
+        with self._lock:
+            return self._entries.get(self._key(api, method_index, method_name, stage))
+
+    def record(self, api: str, method_index: int, method_name: str, stage: str, result: Any) -> None:
+        """Append the result of a completed API method to the journal."""
+        entry = {"api": api, "method_index": method_index, "method": method_name, "stage": stage, "result": result}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries[self._key(api, method_index, method_name, stage)] = result
+
+    def compact(self, api: str, stage: str) -> None:
+        """Drop the entries of an API stage once its results were saved in the final JSON file."""
+        with self._lock:
+            self._entries = {key: result for key, result in self._entries.items() if key[0] != api or key[3] != stage}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for (entry_api, method_index, method_name, entry_stage), result in self._entries.items():
+                    f.write(json.dumps({"api": entry_api, "method_index": method_index, "method": method_name,
+                                        "stage": entry_stage, "result": result}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, api: str, method_index: int, method_name: str, stage: str):
+        return (api, method_index, method_name, stage)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line of a run that crashed while writing
+                    continue
+                key = self._key(entry["api"], entry["method_index"], entry["method"], entry["stage"])
+                self._entries[key] = entry["result"]
+        print(f"Loaded {len(self._entries)} journaled API methods from {self.path}")
@@ -210,4 +210,11 @@ EXAMPLE_OUTPUT = """
         "currency": "USD"}
     }
 ]
-"""
\ No newline at end of file
+"""
+
+# used when several small API methods of the same API are packed into a single request
+PACKED_INSTRUCTION = """
+The tool specification above lists several API methods. Write {num_utterances} utterances for each of them, following the same rules.
+{required_parameters}
+The output must be a single JSON dictionary where each key is an "API Method Name" and each value is the Python list of dictionaries (as described before) for that method. Do not output anything else.
+"""
@@ -1,4 +1,3 @@
-import json
 import ast
 import copy
 import os
@@ -6,68 +5,247 @@ import numpy as np
 import random
 import itertools
 import re
-from typing import Dict, List
-from openai import OpenAI
-from .prompts import PROMPT_UTTERANCE_GENERATION, EXAMPLE_INPUT, EXAMPLE_OUTPUT
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAIError
+from llm_client.cache import ResponseCache
+from llm_client.client import ChatClient
+from llm_client.batch import make_request
+from llm_client.parsing import UTTERANCE_ITEM_SCHEMA, UTTERANCES_SCHEMA, ParseError, parse_json, validate, unwrap, response_format
+from data_generation.journal import GenerationJournal
+from .prompts import PROMPT_UTTERANCE_GENERATION, EXAMPLE_INPUT, EXAMPLE_OUTPUT, PACKED_INSTRUCTION
+
+METHOD_MAX_TOKENS = 3000  # output tokens of the utterances of one API method
+# expected (generous) output tokens of one generated utterance: its text and JSON structure, plus each parameter value
+UTTERANCE_OUTPUT_TOKENS = 60
+PARAMETER_OUTPUT_TOKENS = 15
 
 class UtteranceGenerator:
-    def __init__(self, api_key: str, base_url: str = None, model_name: str = "gpt-4o"):
+    def __init__(self, api_key: str, base_url: str = None, model_name: str = "gpt-4o", cache: ResponseCache = None,
+                 journal: GenerationJournal = None, llm_client: ChatClient = None, structured_output: bool = False,
+                 max_parse_retries: int = 2, streaming: bool = False):
         self.model_name = model_name
-        self.openai_client = OpenAI(api_key=api_key, base_url=base_url)
+        self.journal = journal
+        self.structured_output = structured_output  # schema-constrained output, for providers supporting it
+        self.max_parse_retries = max_parse_retries  # retries of a method whose output is invalid
+        self.streaming = streaming  # stream the completion and stop once `num_utterances` utterances are parsed
+        # a shared client (e.g., a ClientPool) can be given instead of a single endpoint
+        self.llm_client = llm_client or ChatClient(api_key=api_key, base_url=base_url, model_name=model_name, cache=cache)
         self.base_messages = [{"role": "system", "content": PROMPT_UTTERANCE_GENERATION},
                               {"role": "user", "content": EXAMPLE_INPUT},
                               {"role": "assistant", "content": EXAMPLE_OUTPUT}]
 
-    def generate_utterances(self, oas: Dict, num_utterances: int = 10, temperature: float = 0.3) -> List[str]:
-        """Generate constraint-aware utterances for a given API method."""            
+    def generate_utterances(self, oas: Dict, num_utterances: int = 10, temperature: float = 0.3, max_concurrency: int = 1,
+                            packing_token_budget: int = 0, packing_max_parameters: int = 2, packing_max_output_tokens: int = 8192,
+                            only_failed: bool = False) -> List[str]:
+        """Generate constraint-aware utterances for a given API method.
+        With `max_concurrency` > 1, the API methods are dispatched in parallel using a thread pool.
+        With `packing_token_budget` > 0, methods with at most `packing_max_parameters` parameters are packed
+        into shared requests whose method specifications fit in the budget (approximate tokens) and whose expected
+        outputs fit in `packing_max_output_tokens` output tokens per request (the output limit of the provider).
+        With `only_failed`, the methods that already have utterances (e.g., from a previous run) are kept."""
+        api_method_indexes = [api_method_index for api_method_index, api_method in enumerate(oas['api_list'])
+                              if not (only_failed and isinstance(api_method.get('utterances'), list))]
+        if packing_token_budget > 0:
+            groups = self._pack_methods(oas, api_method_indexes, packing_token_budget, packing_max_parameters,
+                                        packing_max_output_tokens, num_utterances)
+        else:
+            groups = [[api_method_index] for api_method_index in api_method_indexes]
+
+        def generate(group):
+            if len(group) == 1:
+                return {group[0]: self._generate_method_utterances(oas, group[0], num_utterances, temperature)}
+            return self._generate_packed_utterances(oas, group, num_utterances, temperature, packing_max_output_tokens)
+
+        # iterating through all groups of API methods (map keeps the results in the original order)
+        if max_concurrency > 1:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                results = list(executor.map(generate, groups))
+        else:
+            results = map(generate, groups)
+
+        utterances_by_index = {}
+        for result in results:
+            utterances_by_index.update(result)
+        for api_method_index, utterances in utterances_by_index.items():
+            oas['api_list'][api_method_index]['utterances'] = utterances
+        return oas
+
+    def _pack_methods(self, oas: Dict, api_method_indexes: List[int], token_budget: int, max_parameters: int,
+                      max_output_tokens: int, num_utterances: int) -> List[List[int]]:
+        """Group the small API methods (few parameters, not completed in a previous run) under the token budget,
+        with expected outputs (`_expected_output_tokens`) within `max_output_tokens` per group.
+        Other methods get a group of their own."""
+        groups, pack, pack_names, pack_tokens, pack_output_tokens = [], [], set(), 0, 0
+        for api_method_index in api_method_indexes:
+            api_method = oas['api_list'][api_method_index]
+            journaled = self.journal is not None and self.journal.get(
+                oas.get('tool_name', ''), api_method_index, api_method['name'], "utterances") is not None
+            tokens = len(str(self._method_specification(api_method))) // 4  # rough estimate (~4 characters per token)
+            output_tokens = self._expected_output_tokens(api_method, num_utterances)
+            if journaled or len(api_method['parameters']) > max_parameters or tokens > token_budget or output_tokens > max_output_tokens:
+                groups.append([api_method_index])
+                continue
+            if pack and (pack_tokens + tokens > token_budget or pack_output_tokens + output_tokens > max_output_tokens
+                         or api_method['name'] in pack_names):
+                groups.append(pack)
+                pack, pack_names, pack_tokens, pack_output_tokens = [], set(), 0, 0
+            pack.append(api_method_index)
+            pack_names.add(api_method['name'])
+            pack_tokens += tokens
+            pack_output_tokens += output_tokens
+        if pack:
+            groups.append(pack)
+        return groups
+
+    @staticmethod
+    def _expected_output_tokens(api_method: Dict, num_utterances: int) -> int:
+        return num_utterances * (UTTERANCE_OUTPUT_TOKENS + PARAMETER_OUTPUT_TOKENS * len(api_method['parameters']))
+
+    def _generate_packed_utterances(self, oas: Dict, api_method_indexes: List[int], num_utterances: int, temperature: float,
+                                    max_output_tokens: int) -> Dict:
+        """Generate the utterances of several API methods in one request.
+        Methods missing from (or malformed in) the response, or all of them if the request fails, fall back to
+        single-method requests."""
+        api_methods = [oas['api_list'][api_method_index] for api_method_index in api_method_indexes]
+        # only API and parsing errors fall back: a cache miss in replay-only mode (CacheMissError) is raised
+        try:
+            content = self.llm_client.create_json(
+                        messages=self._build_packed_messages(oas, api_methods, num_utterances),
+                        max_tokens=max_output_tokens,
+                        temperature=temperature,
+                        schema={"type": "object"},
+                        tags=self._ledger_tags(oas, api_methods, num_utterances))
+        except (ParseError, OpenAIError) as e:
+            print(f"Error in the packed request of {len(api_methods)} methods ({e}). Generating them one by one.")
+            content = None
+        if not isinstance(content, dict):
+            content = None
+
+        results = {}
+        for api_method_index, api_method in zip(api_method_indexes, api_methods):
+            utterances = content.get(api_method['name']) if content is not None else None
+            if validate(utterances, UTTERANCES_SCHEMA):
+                results[api_method_index] = self._generate_method_utterances(oas, api_method_index, num_utterances, temperature)
+                continue
+            if self.journal is not None:
+                self.journal.record(oas.get('tool_name', ''), api_method_index, api_method['name'], "utterances", utterances)
+            results[api_method_index] = utterances
+        return results
+
+    def _generate_method_utterances(self, oas: Dict, api_method_index: int, num_utterances: int, temperature: float):
+        """Call the LLM to generate the utterances of a single API method (unless completed in a previous run)."""
+        api_method = oas['api_list'][api_method_index]
+        if self.journal is not None:
+            journaled = self.journal.get(oas.get('tool_name', ''), api_method_index, api_method['name'], "utterances")
+            if journaled is not None:
+                return journaled
+
+        if self.streaming:
+            utterances = self.llm_client.create_json_stream(
+                        messages=self._build_messages(oas, api_method, num_utterances),
+                        max_tokens=METHOD_MAX_TOKENS,
+                        temperature=temperature,
+                        item_schema=UTTERANCE_ITEM_SCHEMA,
+                        max_items=num_utterances,
+                        tags=self._ledger_tags(oas, [api_method], num_utterances),
+                        structured=self.structured_output,
+                        max_retries=self.max_parse_retries)
+        else:
+            utterances = self.llm_client.create_json(
+                        messages=self._build_messages(oas, api_method, num_utterances),
+                        max_tokens=METHOD_MAX_TOKENS,
+                        temperature=temperature,
+                        schema=UTTERANCES_SCHEMA,
+                        tags=self._ledger_tags(oas, [api_method], num_utterances),
+                        structured=self.structured_output,
+                        max_retries=self.max_parse_retries)
+        if utterances is None:
+            # not journaled, so the method is generated again in the next run
+            print("Error parsing LLM output when generating utterances.")
+            return 'error parsing the information'
+        if self.journal is not None:
+            self.journal.record(oas.get('tool_name', ''), api_method_index, api_method['name'], "utterances", utterances)
+        return utterances
+
+    def batch_requests(self, oas: Dict, num_utterances: int, temperature: float, custom_id_prefix: str) -> List[Dict]:
+        """Batch requests to generate the utterances of all API methods."""
+        return [make_request(f"{custom_id_prefix}::{api_method_index}", self.model_name,
+                             self._build_messages(oas, api_method, num_utterances), METHOD_MAX_TOKENS, temperature,
+                             response_format("output", UTTERANCES_SCHEMA) if self.structured_output else None)
+                for api_method_index, api_method in enumerate(oas['api_list'])]
+
+    def apply_batch_responses(self, oas: Dict, responses: Dict, custom_id_prefix: str) -> Optional[Dict]:
+        """Attach the utterances from batch responses. Returns None if any response is missing."""
+        custom_ids = [f"{custom_id_prefix}::{api_method_index}" for api_method_index in range(len(oas['api_list']))]
+        if any(custom_id not in responses for custom_id in custom_ids):
+            return None
+        for api_method, custom_id in zip(oas['api_list'], custom_ids):
+            api_method['utterances'] = self._process_llm_output(responses[custom_id])
+        return oas
+
+    def _build_messages(self, oas: Dict, api_method: Dict, num_utterances: int) -> List[Dict]:
+        """Build the prompt used to generate the utterances of an API method."""
         api_name = oas.get('tool_name', '')
         api_description = oas.get('tool_description', '')
-        home_url = oas.get('home_url', '')
-
-        API_methods_to_save = []
-        for api_method_index, api_method in enumerate(oas['api_list']):
-            # getting API method information
-            api_method_name = api_method['name']
-            api_method_description = api_method['description']
-            api_method_url = api_method['url']
-            api_method_parameters = api_method['parameters']
-            required_parameters = [param["name"] for param in api_method_parameters if param.get('required', False)]
-
-            api_specification = {"API Name": api_name,
-                                 "API Description": api_description if len(api_description) < 4000 else '',
-                                 "API Method Name": api_method_name,
-                                 "API Method Description": api_method_description if len(api_method_description) < 4000 else '',
-                                 "Parameters": api_method_parameters}
-
-            # preparing input for LLM
-            if required_parameters:
-                input = (f"Tool Specification: \n{api_specification}\n"
-                         f"Write {num_utterances} utterances that use the specified tool.\n"
-                         f"# Required parameters: {str(required_parameters).strip('[]')}."
-                         f" So, {str(required_parameters).strip('[]')} must be present in every utterance.")
-            else:
-                input = (f"Tool Specification: \n{api_specification}\n"
-                         f"Write {num_utterances} utterances that use the specified tool.")
-
-            messages = self.base_messages + [{"role": "user", "content": str(input)}]
-            response = self.openai_client.chat.completions.create(
-                        model=self.model_name,
-                        messages=messages,
-                        max_tokens=3000,
-                        temperature=temperature)  
-            api_method['utterances'] = self._process_llm_output(response)
-        return oas
+        required_parameters = self._required_parameters(api_method)
+
+        api_specification = {"API Name": api_name,
+                             "API Description": api_description if len(api_description) < 4000 else '',
+                             **self._method_specification(api_method)}
+
+        # preparing input for LLM
+        if required_parameters:
+            input = (f"Tool Specification: \n{api_specification}\n"
+                     f"Write {num_utterances} utterances that use the specified tool.\n"
+                     f"# Required parameters: {str(required_parameters).strip('[]')}."
+                     f" So, {str(required_parameters).strip('[]')} must be present in every utterance.")
+        else:
+            input = (f"Tool Specification: \n{api_specification}\n"
+                     f"Write {num_utterances} utterances that use the specified tool.")
+
+        return self.base_messages + [{"role": "user", "content": str(input)}]
+
+    def _build_packed_messages(self, oas: Dict, api_methods: List[Dict], num_utterances: int) -> List[Dict]:
+        """Build the prompt used to generate the utterances of several API methods at once (keyed by method name)."""
+        api_name = oas.get('tool_name', '')
+        api_description = oas.get('tool_description', '')
+
+        api_specification = {"API Name": api_name,
+                             "API Description": api_description if len(api_description) < 4000 else '',
+                             "API Methods": [self._method_specification(api_method) for api_method in api_methods]}
+
+        required_parameters = ""
+        for api_method in api_methods:
+            if self._required_parameters(api_method):
+                required_parameters += (f"# Required parameters of {api_method['name']}: {str(self._required_parameters(api_method)).strip('[]')}."
+                                        f" So, they must be present in every utterance of {api_method['name']}.\n")
+
+        input = (f"Tool Specification: \n{api_specification}\n"
+                 + PACKED_INSTRUCTION.format(num_utterances=num_utterances, required_parameters=required_parameters))
+        return self.base_messages + [{"role": "user", "content": str(input)}]
+
+    def _method_specification(self, api_method: Dict) -> Dict:
+        """Specification of an API method, as shown to the LLM."""
+        api_method_description = api_method['description']
+        return {"API Method Name": api_method['name'],
+                "API Method Description": api_method_description if len(api_method_description) < 4000 else '',
+                "Parameters": api_method['parameters']}
+
+    def _required_parameters(self, api_method: Dict) -> List[str]:
+        return [param["name"] for param in api_method['parameters'] if param.get('required', False)]
                                    
+    def _ledger_tags(self, oas: Dict, api_methods: List[Dict], num_utterances: int) -> Dict:
+        return {"stage": "utterances", "api": oas.get('tool_name', ''), "method": ",".join(api_method['name'] for api_method in api_methods),
+                "category": oas.get('category', ''), "utterances": num_utterances * len(api_methods)}
 
     def _process_llm_output(self, llm_response) -> List[Dict]:
-        """Process LLM output to extract and attach constraints to parameters."""
-        try: 
-            content = llm_response.choices[0].message.content
-            content = content.replace("```python","").replace("```","")
-            content = content.replace("True", "true").replace("False", "false").replace("None", "null")
-            content = json.loads(content)
-            return content
-
-        except Exception as e:
+        """Parse and validate the utterances of an LLM output (e.g., a batch response)."""
+        try:
+            content = unwrap(parse_json(llm_response.choices[0].message.content), UTTERANCES_SCHEMA)
+        except ParseError:
+            content = None
+        if content is None or validate(content, UTTERANCES_SCHEMA):
             print("Error parsing LLM output when generating utterances.")
-            return 'error parsing the information'
\ No newline at end of file
+            return 'error parsing the information'
+        return content
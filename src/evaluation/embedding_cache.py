@@ -0,0 +1,206 @@
+"""
+Persistent, content-addressed cache of sentence embeddings.
+
+Embeddings are keyed by (model name, model revision, hash of the text) and stored as memory-mapped float32
+segments (one .npy file per batch of newly encoded texts) with a JSON index, so repeated evaluations and
+overlapping datasets only encode the texts that were never seen. Eviction drops the least recently used
+segments above the size limit. The index is written when `flush` is called (and at most every `flush_interval`
+seconds while encoding), so callers flush once they are done.
+"""
+
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from typing import Dict, List, Optional
+
+
+class EmbeddingCache:
+    def __init__(self, cache_folder: str, max_size_mb: float = 1024, flush_interval: float = 60.0):
+        self.cache_folder = cache_folder
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.flush_interval = flush_interval
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_folder, exist_ok=True)
+        self._index_path = os.path.join(cache_folder, "index.json")
+        self._load_index()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict]) -> Optional["EmbeddingCache"]:
+        """Build the cache from the `embedding_cache` section of a configuration file (None if disabled)."""
+        if not cfg or not cfg.get("enabled", False):
+            return None
+        return cls(cache_folder=cfg["folder"], max_size_mb=cfg.get("max_size_mb", 1024),
+                   flush_interval=cfg.get("flush_interval", 60.0))
+
+    @staticmethod
+    def make_key(model_name: str, revision: str, text: str) -> str:
+        serialized = json.dumps([model_name, revision or "", text], ensure_ascii=False)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def encode(self, embedding_model, texts: List[str], model_name: str, revision: str = None,
+               batch_size: int = 32) -> np.ndarray:
+        """Embeddings of `texts` (one row per text), encoding with the model only the texts not cached."""
+        if revision is None:
+            revision = model_revision(embedding_model)
+        keys = [self.make_key(model_name, revision, text) for text in texts]
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._entries and key not in missing:
+                missing[key] = text
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+
+        if missing:
+            embeddings = embedding_model.encode(list(missing.values()), batch_size=batch_size, convert_to_numpy=True)
+            self._put(list(missing), np.asarray(embeddings, dtype=np.float32))
+
+        # rows are gathered segment by segment from the memory-mapped files
+        now = time.time()
+        result = None
+        used = self._group_by_segment(keys)
+        for segment, rows in used.items():
+            data = self._segment_data(segment)
+            if result is None:
+                result = np.empty((len(keys), data.shape[1]), dtype=np.float32)
+            positions, segment_rows = zip(*rows)
+            result[list(positions)] = data[list(segment_rows)]
+            self._segments[segment]["last_used"] = now
+        self._evict(keep=set(used))
+        self._dirty = True
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return result if result is not None else np.empty((0, 0), dtype=np.float32)
+
+    def flush(self) -> None:
+        """Write the index (atomically) when it changed since the last flush."""
+        if self._dirty:
+            self._save_index()
+            self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def __enter__(self) -> "EmbeddingCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._entries),
+                "segments": len(self._segments),
+                "size_mb": round(sum(s["size"] for s in self._segments.values()) / (1024 * 1024), 2),
+                "evictions": self.evictions}
+
+    def _put(self, keys: List[str], embeddings: np.ndarray) -> None:
+        """Store the embeddings of newly encoded texts as a new segment."""
+        segment = f"{self._next_segment:08d}"
+        self._next_segment += 1
+        path = self._segment_path(segment)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, embeddings)
+        os.replace(tmp_path, path)
+
+        self._segments[segment] = {"size": os.path.getsize(path), "last_used": time.time()}
+        for row, key in enumerate(keys):
+            self._entries[key] = [segment, row]
+
+    def _group_by_segment(self, keys: List[str]) -> Dict[str, List]:
+        segments = {}
+        for position, key in enumerate(keys):
+            segment, row = self._entries[key]
+            segments.setdefault(segment, []).append((position, row))
+        return segments
+
+    def _segment_data(self, segment: str) -> np.ndarray:
+        if segment not in self._mmaps:
+            self._mmaps[segment] = np.load(self._segment_path(segment), mmap_mode="r")
+        return self._mmaps[segment]
+
+    def _segment_path(self, segment: str) -> str:
+        return os.path.join(self.cache_folder, f"segment_{segment}.npy")
+
+    def _evict(self, keep: set) -> None:
+        """Remove the least recently used segments (whole files) until the cache fits its size limit.
+        The segments of the current request are kept."""
+        size = sum(s["size"] for s in self._segments.values())
+        for segment in sorted(self._segments, key=lambda s: self._segments[s]["last_used"]):
+            if size <= self.max_size_bytes:
+                break
+            if segment in keep:
+                continue
+            size -= self._segments.pop(segment)["size"]
+            self._mmaps.pop(segment, None)
+            self._entries = {key: value for key, value in self._entries.items() if value[0] != segment}
+            try:
+                os.remove(self._segment_path(segment))
+            except OSError:
+                pass
+            self.evictions += 1
+
+    def _load_index(self) -> None:
+        self._mmaps = {}
+        try:
+            with open(self._index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            index = {"segments": {}, "entries": {}}
+        # segments whose file is missing (removed by hand or by an interrupted eviction) are dropped
+        self._segments = {segment: info for segment, info in index["segments"].items()
+                          if os.path.exists(self._segment_path(segment))}
+        self._entries = {key: value for key, value in index["entries"].items() if value[0] in self._segments}
+        self._next_segment = max((int(segment) for segment in self._segments), default=-1) + 1
+
+    def _save_index(self) -> None:
+        tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segments": self._segments, "entries": self._entries}, f)
+        os.replace(tmp_path, self._index_path)
+
+
+WEIGHT_EXTENSIONS = (".safetensors", ".bin", ".pt", ".pth", ".onnx")
+
+
+def model_revision(embedding_model, model_name_or_path: str = None) -> str:
+    """Revision of a SentenceTransformer model: commit hash of the Hugging Face snapshot when known, otherwise
+    a fingerprint of the weight files of a local model, so retrained checkpoints saved at the same path get new keys."""
+    card = getattr(embedding_model, "model_card_data", None)
+    revision = getattr(card, "base_model_revision", None)
+    if revision:
+        return revision
+    config = None
+    try:
+        config = getattr(getattr(embedding_model[0], "auto_model", None), "config", None)
+    except (TypeError, IndexError, KeyError):
+        pass
+    for path in (model_name_or_path, getattr(config, "_name_or_path", None)):
+        if path and os.path.isdir(path):
+            return weights_fingerprint(path)
+    return ""
+
+
+def weights_fingerprint(model_folder: str) -> str:
+    """Hash of the relative path, size and modification time of the weight files of a model folder."""
+    files = []
+    for root, _, filenames in os.walk(model_folder):
+        for filename in filenames:
+            if filename.endswith(WEIGHT_EXTENSIONS):
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                files.append([os.path.relpath(path, model_folder), stat.st_size, stat.st_mtime_ns])
+    if not files:
+        return ""
+    return "local-" + hashlib.sha256(json.dumps(sorted(files)).encode("utf-8")).hexdigest()[:16]
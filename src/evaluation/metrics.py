@@ -10,16 +10,21 @@ import torch
 import time
 from bert_score import score
 from typing import Dict, List, Tuple
-from openai import OpenAI
+from llm_client.cache import ResponseCache, CacheMissError
+from llm_client.client import ChatClient
+from llm_client.ledger import CallLedger
+from llm_client.batch import make_request
 from sentence_transformers import SentenceTransformer, util
 from .prompts import NATURALNESS_EVALUATION
+from .embedding_cache import EmbeddingCache, model_revision
 
 
-def naturalness_evaluation(oas: Dict, api_key: str, base_url: str, model_name: str) -> Dict:
+def naturalness_evaluation(oas: Dict, api_key: str, base_url: str, model_name: str, cache: ResponseCache = None,
+                           llm_client: ChatClient = None, ledger: CallLedger = None) -> Dict:
     """Evaluate the naturalness of all utterances related to an API.
     Returns the number of natural and unnatural utterances."""
-    # defining LLM client
-    openai_client = OpenAI(api_key=api_key, base_url=base_url)
+    # defining LLM client (a shared client, e.g. a ClientPool, can be given instead)
+    llm_client = llm_client or ChatClient(api_key=api_key, base_url=base_url, model_name=model_name, cache=cache, ledger=ledger)
 
     # defining the amount of natural and unnatural utterances
     natural_count = 0
@@ -40,18 +45,19 @@ def naturalness_evaluation(oas: Dict, api_key: str, base_url: str, model_name: s
             utterance = utterances["utterance"]
 
             # defining the prompt
-            messages = [
-                {"role": "system", "content": NATURALNESS_EVALUATION},
-                {"role": "user", "content": f"Evaluate the following utterance for naturalness: '{utterance}'"}]                    
+            messages = _naturalness_messages(utterance)
 
             # calling the LLM
             while True:
                 try:
-                    response = openai_client.chat.completions.create(
-                        model=model_name,
+                    response = llm_client.create(
                         messages=messages,
                         max_tokens=500,
-                        temperature=0)
+                        temperature=0,
+                        tags={"stage": "naturalness", "api": api_name, "method": api_method_name,
+                              "category": oas.get('category', ''), "utterances": 1})
+                except CacheMissError:
+                    raise
                 except Exception as e:
                     print(f"    - Error occurred: {e}. Retrying in 5 seconds...")
                     time.sleep(5)
@@ -84,6 +90,63 @@ def naturalness_evaluation(oas: Dict, api_key: str, base_url: str, model_name: s
         "wrong_count": wrong_count,
         "detailed_results": results}
 
+def naturalness_batch_requests(oas: Dict, model_name: str, custom_id_prefix: str) -> List[Dict]:
+    """Batch requests to evaluate the naturalness of all utterances related to an API."""
+    return [make_request(f"{custom_id_prefix}::{index}", model_name, _naturalness_messages(utterance), 500, 0)
+            for index, (_, utterance) in enumerate(_utterances_to_judge(oas))]
+
+def naturalness_from_batch(oas: Dict, model_name: str, responses: Dict, custom_id_prefix: str) -> Dict:
+    """Same output as `naturalness_evaluation`, computed from batch responses.
+    Returns None if any response is missing."""
+    natural_count = 0
+    unnatural_count = 0
+    wrong_count = 0
+    results = []
+
+    api_name = oas.get('name') or oas.get('tool_name')
+    for index, (api_method_name, utterance) in enumerate(_utterances_to_judge(oas)):
+        response = responses.get(f"{custom_id_prefix}::{index}")
+        if response is None:
+            return None
+
+        content = response.choices[0].message.content.strip().lower()
+        if content == 'natural':
+            natural_count += 1
+        elif content == 'unnatural':
+            unnatural_count += 1
+        else:
+            wrong_count += 1
+            content = 'invalid response'
+
+        results.append({
+            "llm_as_judge": model_name,
+            "api": api_name,
+            "api_method": api_method_name,
+            "utterance": utterance,
+            "evaluation": content})
+
+    return {
+        "natural_count": natural_count,
+        "unnatural_count": unnatural_count,
+        "wrong_count": wrong_count,
+        "detailed_results": results}
+
+def _naturalness_messages(utterance: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": NATURALNESS_EVALUATION},
+        {"role": "user", "content": f"Evaluate the following utterance for naturalness: '{utterance}'"}]
+
+def _utterances_to_judge(oas: Dict) -> List[Tuple[str, str]]:
+    """(API method name, utterance) pairs evaluated by the LLM judges, in evaluation order."""
+    pairs = []
+    api_methods = oas.get('api_methods') or oas.get('api_list')
+    for api_method in api_methods:
+        if isinstance(api_method['utterances'], str):
+            continue
+        for utterances in api_method.get('utterances', []):
+            pairs.append((api_method['name'], utterances["utterance"]))
+    return pairs
+
 def constraint_adherance(oas: Dict, ground_truth_path: str):
     constraint_violations = [0, 0, 0]  # [value_violations, format_violations, inter_dependency_violations] 
 
@@ -228,8 +291,19 @@ def bertscore(oas: Dict, embedding_model: str) -> None:
     return round(sum(avg_bertscores) / len(avg_bertscores), 4)
 
 
-def cosine_similarity(oas: Dict, embedding_model) -> float:
-    """Cosine Similarity evaluation method."""
+def cosine_similarity(oas: Dict, embedding_model, embedding_cache: EmbeddingCache = None, model_name: str = None,
+                      encoding_pool=None) -> float:
+    """Cosine Similarity evaluation method.
+    With an embedding cache, the texts of the whole API are encoded in one call and only the ones never seen
+    by `model_name` are encoded by the model. With an encoding pool (retrieval.encoding_pool), the texts are
+    encoded by its worker processes instead of `embedding_model`."""
+    encoder = encoding_pool if encoding_pool is not None else embedding_model
+    if embedding_cache is not None:
+        revision = model_revision(embedding_model, model_name) if embedding_model is not None else None
+        return _batched_cosine_similarity(oas, lambda texts: embedding_cache.encode(encoder, texts, model_name=model_name, revision=revision))
+    if encoding_pool is not None:
+        return _batched_cosine_similarity(oas, encoding_pool.encode)
+
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     embedding_model.to(device)
 
@@ -267,6 +341,32 @@ def cosine_similarity(oas: Dict, embedding_model) -> float:
     return round(sum(avg_cosine_scores) / len(avg_cosine_scores), 4)
 
 
+def _batched_cosine_similarity(oas: Dict, encode) -> float:
+    """Same scores as `cosine_similarity`, with the texts of the whole API encoded in one `encode` call."""
+    pairs = []
+    api_methods = oas.get('api_methods') or oas.get('api_list', [])
+    for endpoint in api_methods:
+        if isinstance(endpoint.get('utterances'), str):
+            continue
+        utterances = [utt['utterance'] for utt in endpoint.get('utterances', []) if isinstance(utt, dict)]
+        if utterances:
+            pairs.append((_api_text_representation(oas, endpoint), utterances))
+    if not pairs:
+        return 0.0
+
+    texts = [text for reference, utterances in pairs for text in [reference] + utterances]
+    embeddings = torch.from_numpy(encode(texts))
+
+    avg_cosine_scores = []
+    offset = 0
+    for _, utterances in pairs:
+        cosine_scores = util.cos_sim(embeddings[offset], embeddings[offset + 1:offset + 1 + len(utterances)])[0]
+        avg_cosine_scores.append(round(cosine_scores.mean().item(), 4))
+        offset += 1 + len(utterances)
+
+    return round(sum(avg_cosine_scores) / len(avg_cosine_scores), 4)
+
+
 def parameter_coverage(oas: Dict) -> None:
     """Parameter Coverage evaluation method."""
     # counting total parameters in the API that are not technical
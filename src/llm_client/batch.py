@@ -0,0 +1,204 @@
+"""
+Batch submission of chat completion requests.
+
+Requests are written to JSONL files in the format of the OpenAI Batch API, submitted to a backend,
+polled until they are finished, and the responses are returned by `custom_id`. `LocalBatchBackend`
+is a file-based stand-in for the batch endpoint, so the whole flow can run without network.
+"""
+
+import os
+import json
+import time
+import hashlib
+import shutil
+from typing import Callable, Dict, List, Optional
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+from .client import ChatClient
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+FINISHED_STATUSES = ["completed", "failed", "expired", "cancelled"]
+
+
+def make_request(custom_id: str, model: str, messages: List[Dict], max_tokens: int, temperature: float,
+                 response_format: Dict = None) -> Dict:
+    """One line of a batch input file."""
+    body = {"model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature}
+    if response_format is not None:
+        body["response_format"] = response_format
+    return {"custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": body}
+
+
+class OpenAIBatchBackend:
+    """Batch API of OpenAI (or any provider implementing the same endpoints)."""
+
+    def __init__(self, api_key: str, base_url: str = None):
+        self.openai_client = OpenAI(api_key=api_key, base_url=base_url)
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.openai_client.files.create(file=f, purpose="batch")
+        batch = self.openai_client.batches.create(input_file_id=input_file.id,
+                                                  endpoint=BATCH_ENDPOINT,
+                                                  completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.openai_client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id: str, output_path: str) -> None:
+        batch = self.openai_client.batches.retrieve(batch_id)
+        with open(output_path, "w") as f:
+            for file_id in [batch.output_file_id, batch.error_file_id]:
+                if file_id:
+                    f.write(self.openai_client.files.content(file_id).text)
+
+
+class LocalBatchBackend:
+    """File-based stand-in for the batch endpoint.
+    Each request body is answered by `responder` (body => chat completion dict) when the batch is first polled."""
+
+    def __init__(self, folder: str, responder: Callable[[Dict], Dict]):
+        self.folder = folder
+        self.responder = responder
+        os.makedirs(folder, exist_ok=True)
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            batch_id = "local_batch_" + hashlib.sha256(f.read()).hexdigest()[:16]
+        os.makedirs(os.path.join(self.folder, batch_id), exist_ok=True)
+        shutil.copy(input_path, os.path.join(self.folder, batch_id, "input.jsonl"))
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        batch_folder = os.path.join(self.folder, batch_id)
+        if not os.path.exists(os.path.join(batch_folder, "output.jsonl")):
+            self._process(batch_folder)
+        return "completed"
+
+    def download(self, batch_id: str, output_path: str) -> None:
+        shutil.copy(os.path.join(self.folder, batch_id, "output.jsonl"), output_path)
+
+    def _process(self, batch_folder: str) -> None:
+        tmp_path = os.path.join(batch_folder, "output.jsonl.tmp")
+        with open(os.path.join(batch_folder, "input.jsonl"), "r") as f_in, open(tmp_path, "w") as f_out:
+            for line in f_in:
+                request = json.loads(line)
+                try:
+                    output = {"custom_id": request["custom_id"],
+                              "response": {"status_code": 200, "body": self.responder(request["body"])},
+                              "error": None}
+                except Exception as e:
+                    output = {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+                f_out.write(json.dumps(output, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, os.path.join(batch_folder, "output.jsonl"))
+
+
+def client_responder(llm_client: ChatClient) -> Callable[[Dict], Dict]:
+    """Answer batch requests with the regular chat client (and its cache)."""
+    def respond(body: Dict) -> Dict:
+        response = llm_client.create(messages=body["messages"],
+                                     max_tokens=body["max_tokens"],
+                                     temperature=body["temperature"],
+                                     response_format=body.get("response_format"))
+        return response.model_dump(mode="json")
+    return respond
+
+
+class BatchRunner:
+    def __init__(self, backend, folder: str, poll_interval: float = 60, max_requests_per_file: int = 50000):
+        self.backend = backend
+        self.folder = folder
+        self.poll_interval = poll_interval
+        self.max_requests_per_file = max_requests_per_file
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict], api_key: str, base_url: str, model_name: str, cache=None,
+                    llm_client: ChatClient = None) -> Optional["BatchRunner"]:
+        """Build the runner from the `batch` section of a configuration file (None if disabled).
+        The local backend answers the requests with `llm_client` (e.g., a ClientPool) when given. The OpenAI
+        backend uploads the batch files to the single endpoint `base_url`: batch jobs cannot fail over."""
+        if not cfg or not cfg.get("enabled", False):
+            return None
+        if cfg.get("backend", "openai") == "local":
+            if llm_client is None:
+                llm_client = ChatClient(api_key=api_key, base_url=base_url, model_name=model_name, cache=cache)
+            backend = LocalBatchBackend(os.path.join(cfg["folder"], "local_endpoint"), client_responder(llm_client))
+        else:
+            backend = OpenAIBatchBackend(api_key=api_key, base_url=base_url)
+        return cls(backend, cfg["folder"],
+                   poll_interval=cfg.get("poll_interval", 60),
+                   max_requests_per_file=cfg.get("max_requests_per_file", 50000))
+
+    def run(self, requests: List[Dict], job_name: str) -> Dict[str, ChatCompletion]:
+        """Submit all requests, wait for the batches to finish and return the responses by custom_id.
+        Requests that failed are missing from the result. Re-running the same requests resumes the
+        batches already submitted instead of submitting them again."""
+        if not requests:
+            return {}
+
+        # the job folder is identified by the content of the requests
+        digest = hashlib.sha256(json.dumps(requests, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        job_folder = os.path.join(self.folder, f"{job_name}_{digest}")
+        os.makedirs(job_folder, exist_ok=True)
+        state_path = os.path.join(job_folder, "state.json")
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path, "r") as f:
+                state = json.load(f)
+
+        # 1 - writing and submitting the batch files
+        for file_index, start in enumerate(range(0, len(requests), self.max_requests_per_file)):
+            input_name = f"input_{file_index}.jsonl"
+            if input_name in state:
+                continue
+            input_path = os.path.join(job_folder, input_name)
+            with open(input_path, "w") as f:
+                for request in requests[start:start + self.max_requests_per_file]:
+                    f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            state[input_name] = {"batch_id": self.backend.submit(input_path), "status": "submitted"}
+            self._save_state(state_path, state)
+            print(f"Submitted {input_name} of {job_name} as batch {state[input_name]['batch_id']}")
+
+        # 2 - polling until all batches are finished
+        while True:
+            for input_name, batch in state.items():
+                if batch["status"] not in FINISHED_STATUSES:
+                    batch["status"] = self.backend.status(batch["batch_id"])
+            self._save_state(state_path, state)
+            pending = [name for name, batch in state.items() if batch["status"] not in FINISHED_STATUSES]
+            if not pending:
+                break
+            print(f"Waiting for {len(pending)} batch(es) of {job_name}...")
+            time.sleep(self.poll_interval)
+
+        # 3 - downloading and parsing the results
+        responses = {}
+        for input_name, batch in state.items():
+            if batch["status"] != "completed":
+                print(f"Batch {batch['batch_id']} finished with status {batch['status']}")
+                continue
+            output_path = os.path.join(job_folder, input_name.replace("input", "output"))
+            if not os.path.exists(output_path):
+                self.backend.download(batch["batch_id"], output_path)
+            with open(output_path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    output = json.loads(line)
+                    response = output.get("response") or {}
+                    if response.get("status_code") == 200:
+                        responses[output["custom_id"]] = ChatCompletion.model_validate(response["body"])
+
+        print(f"Received {len(responses)}/{len(requests)} responses for {job_name}")
+        return responses
+
+    def _save_state(self, state_path: str, state: Dict) -> None:
+        with open(state_path, "w") as f:
+            json.dump(state, f, indent=4)
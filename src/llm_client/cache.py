@@ -0,0 +1,142 @@
+"""
+Persistent, content-addressed cache for LLM responses.
+
+Each response is stored as a JSON file named after the hash of the request
+(base_url, model, messages, temperature, max_tokens), so re-running or resuming
+a generation/evaluation with unchanged inputs does not call the LLM again.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class CacheMissError(RuntimeError):
+    """Raised in replay-only mode when a request is not in the cache."""
+
+
+class ResponseCache:
+    def __init__(self, cache_folder: str, max_size_mb: float = 1024, replay_only: bool = False):
+        self.cache_folder = cache_folder
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.replay_only = replay_only
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key => size in bytes, ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_folder, exist_ok=True)
+        self._load_index()
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict]) -> Optional["ResponseCache"]:
+        """Build the cache from the `llm_cache` section of a configuration file (None if disabled)."""
+        if not cfg or not cfg.get("enabled", False):
+            return None
+        return cls(cache_folder=cfg["folder"],
+                   max_size_mb=cfg.get("max_size_mb", 1024),
+                   replay_only=cfg.get("replay_only", False))
+
+    @staticmethod
+    def make_key(base_url: str, model: str, messages: List[Dict], temperature: float, max_tokens: int, **extra) -> str:
+        """Hash of everything that determines the LLM response."""
+        request = {"base_url": base_url,
+                   "model": model,
+                   "messages": messages,
+                   "temperature": temperature,
+                   "max_tokens": max_tokens}
+        request.update(extra)
+        serialized = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached response, None on a miss (or CacheMissError in replay-only mode)."""
+        path = self._path(key)
+        with self._lock:
+            if key in self._entries:
+                try:
+                    with open(path, "r") as f:
+                        response = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    # entry removed by another process or corrupted: treat as a miss
+                    self._forget(key)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    os.utime(path, None)
+                    return response
+
+            self.misses += 1
+        if self.replay_only:
+            raise CacheMissError(f"Request {key} is not cached and the cache is in replay-only mode.")
+        return None
+
+    def put(self, key: str, response: Dict) -> None:
+        """Store a response and evict the least recently used entries above the size limit."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # atomic write so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(response, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = size
+            self._size_bytes += size
+            self._evict()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                    "entries": len(self._entries),
+                    "size_mb": round(self._size_bytes / (1024 * 1024), 2),
+                    "evictions": self.evictions}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_folder, key[:2], f"{key}.json")
+
+    def _forget(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size_bytes -= size
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries until the cache fits its size limit."""
+        while self._size_bytes > self.max_size_bytes and len(self._entries) > 1:
+            old_key = next(iter(self._entries))
+            self._forget(old_key)
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+            self.evictions += 1
+
+    def _load_index(self) -> None:
+        """Rebuild the LRU order from the modification times of the cached files."""
+        entries = []
+        for root, _, files in os.walk(self.cache_folder):
+            for filename in files:
+                if filename.endswith(".json"):
+                    stat = os.stat(os.path.join(root, filename))
+                    entries.append((stat.st_mtime, filename[:-len(".json")], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size_bytes += size
+        self._evict()
@@ -0,0 +1,260 @@
+"""
+OpenAI-compatible chat client shared by all the LLM call sites (generators and judges).
+"""
+
+import time
+import asyncio
+import weakref
+from typing import Dict, List, Tuple
+from openai import OpenAI, AsyncOpenAI, Stream
+from openai.types.chat import ChatCompletion
+from .cache import ResponseCache, CacheMissError
+from .ledger import CallLedger
+from .parsing import ParseError, parse_json, validate, unwrap, response_format as schema_response_format
+from .streaming import IncrementalListParser
+
+
+class ChatClient:
+    def __init__(self, api_key: str, base_url: str = None, model_name: str = "gpt-4o", cache: ResponseCache = None,
+                 ledger: CallLedger = None, max_retries: int = 2):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model_name = model_name
+        self.cache = cache
+        self.ledger = ledger
+        self.max_retries = max_retries  # retries of the OpenAI SDK on the same endpoint
+        self.openai_client = OpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+
+        # one async client per event loop, since connections cannot be shared across loops
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def create(self, messages: List[Dict], max_tokens: int, temperature: float, tags: Dict = None,
+               response_format: Dict = None, attempt: int = 0) -> ChatCompletion:
+        """Chat completion, served from the cache when the same request was already answered.
+        `tags` (stage, api, method, ...) are recorded in the ledger along with the call.
+        `attempt` > 0 marks a retry of an invalid output, cached separately from the first answer."""
+        start = time.monotonic()
+        options = {"response_format": response_format} if response_format is not None else {}
+        tags = {**(tags or {}), "attempt": attempt} if attempt else tags
+        key = self._cache_key(messages, max_tokens, temperature, options, attempt)
+        cached = self._from_cache(key)
+        if cached is not None:
+            self._to_ledger(cached, start, tags, cached=True)
+            return cached
+
+        try:
+            response, retries = self._send(messages, max_tokens, temperature, **options)
+        except Exception as e:
+            self._to_ledger(None, start, tags, error=e)
+            raise
+        self._to_cache(key, response)
+        self._to_ledger(response, start, tags, retries=retries)
+        return response
+
+    async def acreate(self, messages: List[Dict], max_tokens: int, temperature: float, tags: Dict = None,
+                      response_format: Dict = None, attempt: int = 0) -> ChatCompletion:
+        """Asynchronous version of `create`."""
+        start = time.monotonic()
+        options = {"response_format": response_format} if response_format is not None else {}
+        tags = {**(tags or {}), "attempt": attempt} if attempt else tags
+        key = self._cache_key(messages, max_tokens, temperature, options, attempt)
+        cached = self._from_cache(key)
+        if cached is not None:
+            self._to_ledger(cached, start, tags, cached=True)
+            return cached
+
+        try:
+            response, retries = await self._asend(messages, max_tokens, temperature, **options)
+        except Exception as e:
+            self._to_ledger(None, start, tags, error=e)
+            raise
+        self._to_cache(key, response)
+        self._to_ledger(response, start, tags, retries=retries)
+        return response
+
+    def create_json(self, messages: List[Dict], max_tokens: int, temperature: float, schema: Dict, tags: Dict = None,
+                    structured: bool = False, max_retries: int = 0):
+        """Chat completion parsed (and repaired) as JSON and validated against `schema`.
+        With `structured`, the output is constrained with the schema (for providers supporting it).
+        Invalid outputs are requested again up to `max_retries` times. Returns None if every attempt fails."""
+        response_format = schema_response_format("output", schema) if structured else None
+        for attempt in range(max_retries + 1):
+            try:
+                response = self.create(messages, max_tokens, temperature, tags=tags, response_format=response_format, attempt=attempt)
+            except CacheMissError:
+                if attempt == 0:
+                    raise
+                break  # replaying a run in which this retry was not made
+            content, errors = self._validated_json(response, schema)
+            if not errors:
+                return content
+            print(f"    - Invalid LLM output (attempt {attempt + 1}/{max_retries + 1}): {errors[0]}")
+        return None
+
+    async def acreate_json(self, messages: List[Dict], max_tokens: int, temperature: float, schema: Dict, tags: Dict = None,
+                           structured: bool = False, max_retries: int = 0):
+        """Asynchronous version of `create_json`."""
+        response_format = schema_response_format("output", schema) if structured else None
+        for attempt in range(max_retries + 1):
+            try:
+                response = await self.acreate(messages, max_tokens, temperature, tags=tags, response_format=response_format, attempt=attempt)
+            except CacheMissError:
+                if attempt == 0:
+                    raise
+                break
+            content, errors = self._validated_json(response, schema)
+            if not errors:
+                return content
+            print(f"    - Invalid LLM output (attempt {attempt + 1}/{max_retries + 1}): {errors[0]}")
+        return None
+
+    def create_json_stream(self, messages: List[Dict], max_tokens: int, temperature: float, item_schema: Dict, max_items: int,
+                           tags: Dict = None, structured: bool = False, max_retries: int = 0):
+        """Streamed chat completion parsed incrementally as a JSON list of `item_schema` objects.
+        The stream is closed as soon as `max_items` valid items are parsed, instead of waiting for the whole
+        completion. Outputs without any valid item are requested again up to `max_retries` times (None if all fail)."""
+        list_schema = {"type": "array", "items": item_schema, "minItems": 1}
+        response_format = schema_response_format("output", list_schema) if structured else None
+        for attempt in range(max_retries + 1):
+            try:
+                items = self._stream_items(messages, max_tokens, temperature, item_schema, max_items, tags, response_format, attempt)
+            except CacheMissError:
+                if attempt == 0:
+                    raise
+                break
+            if items:
+                return items
+            print(f"    - Invalid LLM output (attempt {attempt + 1}/{max_retries + 1}): no valid item in the streamed output")
+        return None
+
+    def _stream_items(self, messages: List[Dict], max_tokens: int, temperature: float, item_schema: Dict, max_items: int,
+                      tags: Dict, response_format: Dict, attempt: int) -> List[Dict]:
+        start = time.monotonic()
+        options = {"response_format": response_format} if response_format is not None else {}
+        tags = {**(tags or {}), "attempt": attempt} if attempt else dict(tags or {})
+        # the cached (possibly truncated) output depends on when the stream was stopped
+        key = self._cache_key(messages, max_tokens, temperature, {**options, "stream_items": max_items}, attempt)
+        parser = IncrementalListParser(item_schema)
+        cached = self._from_cache(key)
+        if cached is not None:
+            parser.feed(cached.choices[0].message.content or "")
+            self._to_ledger(cached, start, tags, cached=True)
+            return parser.items[:max_items]
+
+        # a stream stopped once max_items were parsed is not a truncation by max_tokens ("length"): the response
+        # keeps "stop" (the OpenAI schema has no other value for it) and the ledger records "max_items"
+        first_item_latency = None
+        stopped_early = False
+        finish_reason = "stop"
+        usage = None
+        chunks = 0
+        try:
+            stream, retries = self._open_stream(messages, max_tokens, temperature, **options)
+            try:
+                for chunk in stream:
+                    if chunk.usage is not None:
+                        usage = chunk.usage.model_dump()
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        finish_reason = chunk.choices[0].finish_reason
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    chunks += 1
+                    if parser.feed(chunk.choices[0].delta.content) and first_item_latency is None:
+                        first_item_latency = time.monotonic() - start
+                    if len(parser.items) >= max_items:
+                        stopped_early = True
+                        break
+            finally:
+                stream.close()  # closing the connection stops the generation on the provider side
+        except Exception as e:
+            self._to_ledger(None, start, tags, error=e)
+            raise
+
+        if usage is None:
+            # the usage chunk is only sent at the end of the stream: estimated (~1 token per chunk, ~4 characters per token)
+            usage = {"prompt_tokens": len(str(messages)) // 4, "completion_tokens": chunks, "total_tokens": len(str(messages)) // 4 + chunks}
+            tags["usage_estimated"] = True
+        response = ChatCompletion.model_validate({
+            "id": f"stream-{key or ''}", "object": "chat.completion", "created": int(time.time()), "model": self.model_name,
+            "choices": [{"index": 0, "finish_reason": finish_reason,
+                         "message": {"role": "assistant", "content": parser.text()}}],
+            "usage": usage})
+        self._to_cache(key, response)
+        self._to_ledger(response, start, {**tags, "first_item_latency": first_item_latency, "stopped_early": stopped_early,
+                                          "finish_reason": "max_items" if stopped_early else finish_reason}, retries=retries)
+        return parser.items[:max_items]
+
+    @staticmethod
+    def _validated_json(response: ChatCompletion, schema: Dict):
+        """Parsed content of a response and its validation errors."""
+        try:
+            content = unwrap(parse_json(response.choices[0].message.content), schema)
+        except ParseError as e:
+            return None, [str(e)]
+        return content, validate(content, schema)
+
+    def _send(self, messages: List[Dict], max_tokens: int, temperature: float, **options) -> Tuple[ChatCompletion, int]:
+        """Send the request to the endpoint (overridden by the client pool).
+        Returns the response and the number of retries it took."""
+        return self.openai_client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **options), 0
+
+    def _open_stream(self, messages: List[Dict], max_tokens: int, temperature: float, **options) -> Tuple[Stream, int]:
+        """Open a streamed completion (overridden by the client pool). Returns the stream and the number of retries."""
+        return self.openai_client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            **options), 0
+
+    async def _asend(self, messages: List[Dict], max_tokens: int, temperature: float, **options) -> Tuple[ChatCompletion, int]:
+        return await self._async_client().chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **options), 0
+
+    def _async_client(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            self._async_clients[loop] = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=self.max_retries)
+        return self._async_clients[loop]
+
+    def _cache_key(self, messages: List[Dict], max_tokens: int, temperature: float, options: Dict, attempt: int) -> str:
+        if self.cache is None:
+            return None
+        # plain first attempts keep the keys of the original requests
+        extra = {**options, "attempt": attempt} if attempt else options
+        return ResponseCache.make_key(str(self.base_url), self.model_name, messages, temperature, max_tokens, **extra)
+
+    def _from_cache(self, key: str) -> ChatCompletion:
+        if key is None:
+            return None
+        cached = self.cache.get(key)
+        return ChatCompletion.model_validate(cached) if cached is not None else None
+
+    def _to_cache(self, key: str, response: ChatCompletion) -> None:
+        if key is not None:
+            self.cache.put(key, response.model_dump(mode="json"))
+
+    def _to_ledger(self, response: ChatCompletion, start: float, tags: Dict, retries: int = 0,
+                   cached: bool = False, error: Exception = None) -> None:
+        if self.ledger is None:
+            return
+        usage = response.usage if response is not None else None
+        self.ledger.record(model=self.model_name,
+                           latency=time.monotonic() - start,
+                           prompt_tokens=usage.prompt_tokens if usage is not None else 0,
+                           completion_tokens=usage.completion_tokens if usage is not None else 0,
+                           retries=retries,
+                           cached=cached,
+                           error=type(error).__name__ if error is not None else None,
+                           tags=tags)
@@ -0,0 +1,51 @@
+"""
+Ledger of LLM calls: one JSON line per call with tokens, latency, retries, model and the stage that made it.
+Aggregated by `scripts/evaluation/ledger_report.py`.
+"""
+
+import os
+import json
+import time
+import threading
+from typing import Dict, List
+
+
+class CallLedger:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @classmethod
+    def from_config(cls, enabled: bool, path: str) -> "CallLedger":
+        """Ledger at `path`, or None when disabled."""
+        return cls(path) if enabled else None
+
+    def record(self, model: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+               retries: int = 0, cached: bool = False, error: str = None, tags: Dict = None) -> None:
+        """Append one call. `tags` identify the caller (stage, api, method, category, utterances)."""
+        entry = {"time": time.time(),
+                 "model": model,
+                 "latency": round(latency, 4),
+                 "prompt_tokens": prompt_tokens,
+                 "completion_tokens": completion_tokens,
+                 "retries": retries,
+                 "cached": cached,
+                 "error": error,
+                 **(tags or {})}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    @staticmethod
+    def load(path: str) -> List[Dict]:
+        """Read all the entries of a ledger file (a partially written last line is skipped)."""
+        entries = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries
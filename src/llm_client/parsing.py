@@ -0,0 +1,145 @@
+"""
+Tolerant parsing of LLM outputs and validation against the expected JSON schemas.
+
+`parse_json` repairs the usual deviations (code fences, `//` comments, trailing commas, Python literals,
+text around the JSON) without touching the content of strings, so utterances containing words such as
+"None" or "True" are kept as written.
+"""
+
+import ast
+import json
+import re
+from typing import Any, Dict, List
+
+# expected outputs of the generators
+UTTERANCE_ITEM_SCHEMA = {"type": "object",
+                         "properties": {"utterance": {"type": "string"},
+                                        "parameters": {"type": "object"}},
+                         "required": ["utterance", "parameters"]}
+
+UTTERANCES_SCHEMA = {"type": "array", "items": UTTERANCE_ITEM_SCHEMA, "minItems": 1}
+
+CONSTRAINTS_SCHEMA = {"type": "object", "additionalProperties": {"type": "object"}}
+
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+_TRAILING_COMMA = re.compile(r",(\s|//[^\n]*)*[\]}]")
+_TYPES = {"object": dict, "array": list, "string": str, "boolean": bool, "null": type(None)}
+
+
+class ParseError(ValueError):
+    pass
+
+
+def parse_json(text: str) -> Any:
+    """Parse the JSON (or Python literal) in an LLM output, repairing it when needed."""
+    if text is None:
+        raise ParseError("Empty LLM output.")
+    text = re.sub(r"```[a-zA-Z]*", "", text).strip()
+
+    # text around the JSON value (e.g., "Here is the list: [...]")
+    starts = [index for index in (text.find("["), text.find("{")) if index != -1]
+    if not starts:
+        raise ParseError("No JSON value found in the LLM output.")
+    text = text[min(starts):max(text.rfind("]"), text.rfind("}")) + 1]
+
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(_repair(text))
+    except json.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(text)  # Python list of dictionaries with single quotes
+    except (ValueError, SyntaxError, MemoryError, RecursionError) as e:
+        raise ParseError(f"Could not parse the LLM output: {e}") from e
+
+
+def _repair(text: str) -> str:
+    """Remove comments and trailing commas and convert Python literals, outside of strings only."""
+    output = []
+    index = 0
+    while index < len(text):
+        char = text[index]
+        if char == '"':
+            # copy the whole string, including escaped quotes
+            end = index + 1
+            while end < len(text) and text[end] != '"':
+                end += 2 if text[end] == "\\" else 1
+            output.append(text[index:end + 1])
+            index = end + 1
+        elif text.startswith("//", index):
+            newline = text.find("\n", index)
+            index = len(text) if newline == -1 else newline
+        elif char == ",":
+            if not _TRAILING_COMMA.match(text, index):
+                output.append(char)
+            index += 1
+        else:
+            match = _IDENTIFIER.match(text, index)
+            if match:
+                output.append(_PYTHON_LITERALS.get(match.group(0), match.group(0)))
+                index += len(match.group(0))
+            else:
+                output.append(char)
+                index += 1
+    return "".join(output)
+
+
+def validate(instance: Any, schema: Dict, path: str = "$") -> List[str]:
+    """Validate an instance against a (subset of) JSON schema. Returns the list of errors."""
+    errors = []
+    expected = schema.get("type")
+    if expected is not None and not _is_type(instance, expected):
+        return [f"{path}: expected {expected}, got {type(instance).__name__}"]
+    if "enum" in schema and instance not in schema["enum"]:
+        errors.append(f"{path}: {instance!r} is not one of {schema['enum']}")
+
+    if isinstance(instance, dict):
+        for name in schema.get("required", []):
+            if name not in instance:
+                errors.append(f"{path}: missing '{name}'")
+        properties = schema.get("properties", {})
+        additional = schema.get("additionalProperties", True)
+        for name, value in instance.items():
+            if name in properties:
+                errors.extend(validate(value, properties[name], f"{path}.{name}"))
+            elif additional is False:
+                errors.append(f"{path}: unexpected '{name}'")
+            elif isinstance(additional, dict):
+                errors.extend(validate(value, additional, f"{path}.{name}"))
+
+    if isinstance(instance, list):
+        if len(instance) < schema.get("minItems", 0):
+            errors.append(f"{path}: expected at least {schema['minItems']} items")
+        if "items" in schema:
+            for index, item in enumerate(instance):
+                errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def _is_type(instance: Any, expected) -> bool:
+    if isinstance(expected, list):
+        return any(_is_type(instance, option) for option in expected)
+    if expected == "integer":
+        return isinstance(instance, int) and not isinstance(instance, bool)
+    if expected == "number":
+        return isinstance(instance, (int, float)) and not isinstance(instance, bool)
+    return isinstance(instance, _TYPES[expected])
+
+
+def response_format(name: str, schema: Dict) -> Dict:
+    """`response_format` requesting schema-constrained output. The schema must describe an object,
+    so arrays are wrapped in {"items": [...]} (unwrapped by `unwrap`)."""
+    if schema.get("type") != "object":
+        schema = {"type": "object", "properties": {"items": schema}, "required": ["items"]}
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": False}}
+
+
+def unwrap(content: Any, schema: Dict) -> Any:
+    """Undo the wrapping of `response_format` for array schemas."""
+    if schema.get("type") != "object" and isinstance(content, dict) and set(content) == {"items"}:
+        return content["items"]
+    return content
@@ -0,0 +1,217 @@
+"""
+Pool of OpenAI-compatible endpoints serving the same model (e.g., OpenAI and DeepInfra for DeepSeek-V3).
+
+Each request is routed to the endpoint with the lowest recent latency and the most rate-limit headroom,
+and fails over to the next endpoint when an endpoint errors. The pool is a drop-in replacement of
+`ChatClient`, so the generators and judges use it without changes.
+"""
+
+import os
+import re
+import time
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
+from openai import BadRequestError, Stream
+from openai.types.chat import ChatCompletion
+from .cache import ResponseCache
+from .client import ChatClient
+from .ledger import CallLedger
+
+
+class EndpointState:
+    """Routing statistics of one endpoint."""
+
+    def __init__(self, client: ChatClient):
+        self.client = client
+        self.latency = None  # exponential moving average, in seconds
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.remaining_requests = None
+        self.limit_requests = None
+
+    def headroom(self) -> float:
+        """Fraction of the rate limit still available (1.0 when the endpoint does not report it)."""
+        if self.remaining_requests is None or not self.limit_requests:
+            return 1.0
+        return max(self.remaining_requests / self.limit_requests, 0.05)
+
+    def score(self) -> float:
+        """Expected wait of a new request, lower is better. Endpoints without samples are tried first."""
+        return (self.latency or 0.0) * (self.in_flight + 1) / self.headroom()
+
+
+class ClientPool(ChatClient):
+    def __init__(self, endpoints: List[ChatClient], cache: ResponseCache = None, max_attempts: int = None,
+                 latency_decay: float = 0.3, max_cooldown: float = 60, ledger: CallLedger = None):
+        # no call to ChatClient.__init__: each endpoint has its own OpenAI clients
+        self.endpoints = [EndpointState(client) for client in endpoints]
+        self.model_name = endpoints[0].model_name
+        self.base_url = ",".join(sorted(str(client.base_url) for client in endpoints))
+        self.cache = cache
+        self.ledger = ledger
+        self.max_attempts = max_attempts or 2 * len(endpoints)
+        self.latency_decay = latency_decay
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, endpoints_cfg: List[Dict], model_name: str, cache: ResponseCache = None,
+                    ledger: CallLedger = None) -> "ClientPool":
+        """Build the pool from a list of {url, api_key_env | api_key, model_name (optional)} entries.
+        The endpoints do not retry on their own: a failed request fails over to the next endpoint."""
+        endpoints = []
+        for endpoint_cfg in endpoints_cfg:
+            api_key = endpoint_cfg.get("api_key") or os.getenv(endpoint_cfg.get("api_key_env", ""))
+            endpoints.append(ChatClient(api_key=api_key,
+                                        base_url=endpoint_cfg["url"],
+                                        model_name=endpoint_cfg.get("model_name", model_name),
+                                        max_retries=0))
+        return cls(endpoints, cache=cache, ledger=ledger)
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            return [{"url": endpoint.client.base_url,
+                     "requests": endpoint.requests,
+                     "failures": endpoint.failures,
+                     "latency": round(endpoint.latency, 3) if endpoint.latency is not None else None,
+                     "headroom": round(endpoint.headroom(), 3)}
+                    for endpoint in self.endpoints]
+
+    def _send(self, messages: List[Dict], max_tokens: int, temperature: float, **options) -> Tuple[ChatCompletion, int]:
+        last_error = None
+        for attempt in range(self.max_attempts):
+            endpoint, wait = self._acquire()
+            while endpoint is None:
+                time.sleep(wait)
+                endpoint, wait = self._acquire()
+
+            start = time.monotonic()
+            try:
+                raw = endpoint.client.openai_client.chat.completions.with_raw_response.create(
+                    model=endpoint.client.model_name,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    **options)
+                response = raw.parse()
+            except BadRequestError:
+                # the request itself is invalid, other endpoints would reject it as well
+                self._release(endpoint)
+                raise
+            except Exception as e:
+                self._release(endpoint, error=e)
+                last_error = e
+                continue
+            self._release(endpoint, latency=time.monotonic() - start, headers=raw.headers)
+            return response, attempt
+        raise last_error
+
+    async def _asend(self, messages: List[Dict], max_tokens: int, temperature: float, **options) -> Tuple[ChatCompletion, int]:
+        last_error = None
+        for attempt in range(self.max_attempts):
+            endpoint, wait = self._acquire()
+            while endpoint is None:
+                await asyncio.sleep(wait)
+                endpoint, wait = self._acquire()
+
+            start = time.monotonic()
+            try:
+                raw = await endpoint.client._async_client().chat.completions.with_raw_response.create(
+                    model=endpoint.client.model_name,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    **options)
+                response = raw.parse()
+            except BadRequestError:
+                self._release(endpoint)
+                raise
+            except Exception as e:
+                self._release(endpoint, error=e)
+                last_error = e
+                continue
+            self._release(endpoint, latency=time.monotonic() - start, headers=raw.headers)
+            return response, attempt
+        raise last_error
+
+    def _open_stream(self, messages: List[Dict], max_tokens: int, temperature: float, **options) -> Tuple[Stream, int]:
+        last_error = None
+        for attempt in range(self.max_attempts):
+            endpoint, wait = self._acquire()
+            while endpoint is None:
+                time.sleep(wait)
+                endpoint, wait = self._acquire()
+
+            try:
+                stream, _ = endpoint.client._open_stream(messages, max_tokens, temperature, **options)
+            except BadRequestError:
+                self._release(endpoint)
+                raise
+            except Exception as e:
+                self._release(endpoint, error=e)
+                last_error = e
+                continue
+            # released once the stream is open: the latency of a stream is not comparable to a full completion
+            self._release(endpoint, headers=stream.response.headers)
+            return stream, attempt
+        raise last_error
+
+    def _acquire(self):
+        """Pick the best available endpoint. Returns (None, seconds to wait) if all are cooling down."""
+        with self._lock:
+            now = time.monotonic()
+            available = [endpoint for endpoint in self.endpoints if endpoint.cooldown_until <= now]
+            if not available:
+                return None, min(endpoint.cooldown_until for endpoint in self.endpoints) - now
+            endpoint = min(available, key=lambda endpoint: (endpoint.score(), endpoint.in_flight))
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            return endpoint, 0.0
+
+    def _release(self, endpoint: EndpointState, latency: float = None, headers=None, error: Exception = None) -> None:
+        with self._lock:
+            endpoint.in_flight -= 1
+            now = time.monotonic()
+
+            if error is not None:
+                # exponential backoff of the failing endpoint, the request goes to the next one
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                cooldown = min(2 ** (endpoint.consecutive_failures - 1), self.max_cooldown)
+                endpoint.cooldown_until = now + cooldown
+                print(f"    - Endpoint {endpoint.client.base_url} failed ({error}). Cooling down for {cooldown}s.")
+                return
+
+            endpoint.consecutive_failures = 0
+            if latency is not None:
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency = self.latency_decay * latency + (1 - self.latency_decay) * endpoint.latency
+
+            if headers is not None:
+                remaining = _to_int(headers.get("x-ratelimit-remaining-requests"))
+                limit = _to_int(headers.get("x-ratelimit-limit-requests"))
+                if remaining is not None:
+                    endpoint.remaining_requests = remaining
+                    endpoint.limit_requests = limit
+                    if remaining == 0:
+                        endpoint.cooldown_until = now + _parse_duration(headers.get("x-ratelimit-reset-requests", "1s"))
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_duration(value: str) -> float:
+    """Parse rate-limit reset durations such as '20ms', '1s' or '6m0s' into seconds."""
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    seconds = sum(float(number) * units[unit] for number, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value or ""))
+    return seconds or 1.0
@@ -0,0 +1,75 @@
+"""
+Incremental parsing of a JSON list of objects while the completion is streamed, so generation can stop
+as soon as enough well-formed items are available.
+"""
+
+from typing import Dict, List
+from .parsing import ParseError, parse_json, validate
+
+
+class IncrementalListParser:
+    """Extract the complete objects of the first JSON list in a text fed chunk by chunk.
+    Works both for a bare list and for a list wrapped in an object (e.g., {"items": [...]})."""
+
+    def __init__(self, item_schema: Dict = None):
+        self.item_schema = item_schema
+        self.items = []
+        self.invalid_items = 0
+        self._text = []
+        self._depth = 0
+        self._list_depth = None  # depth inside the list, once its '[' is found
+        self._in_string = False
+        self._escaped = False
+        self._item_parts = []  # text of the current item in the previous chunks
+        self._item_start = None  # start of the current item in the current chunk
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Consume a chunk of the output. Returns the items completed by this chunk.
+        Each character is scanned once, and only the text of the current item is kept aside for parsing."""
+        self._text.append(chunk)
+        new_items = []
+        for position, char in enumerate(chunk):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+                if char == "[" and self._list_depth is None:
+                    self._list_depth = self._depth
+                elif char == "{" and self._list_depth is not None and self._depth == self._list_depth + 1:
+                    self._item_parts = []
+                    self._item_start = position
+            elif char in "]}":
+                if char == "}" and self._item_start is not None and self._depth == self._list_depth + 1:
+                    self._item_parts.append(chunk[self._item_start:position + 1])
+                    item = self._parse_item("".join(self._item_parts))
+                    if item is not None:
+                        new_items.append(item)
+                    self._item_parts = []
+                    self._item_start = None
+                self._depth -= 1
+        if self._item_start is not None:
+            # the item continues in the next chunk
+            self._item_parts.append(chunk[self._item_start:])
+            self._item_start = 0
+        self.items.extend(new_items)
+        return new_items
+
+    def text(self) -> str:
+        return "".join(self._text)
+
+    def _parse_item(self, text: str):
+        try:
+            item = parse_json(text)
+        except ParseError:
+            item = None
+        if item is None or (self.item_schema is not None and validate(item, self.item_schema)):
+            self.invalid_items += 1
+            return None
+        return item
@@ -0,0 +1,100 @@
+"""
+Persistent manifest of the ToolBench tools tree (SQLite).
+
+Stores the path, mtime and size of every tool file together with its selection features, so changing the
+selection criteria is a query over the manifest instead of parsing the whole tree again. Only files whose
+stat changed since the last refresh are parsed.
+"""
+
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+from .toolbench import tool_features
+
+
+class ToolManifest:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS tools (
+                path TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                valid INTEGER NOT NULL,
+                popularity_score,
+                api_list_length INTEGER,
+                has_parameters INTEGER,
+                description_words INTEGER)""")
+        self.connection.commit()
+
+    def refresh(self, base_folder: str, num_workers: int = None, chunksize: int = 64) -> Dict:
+        """Synchronise the manifest with the tools tree: new or modified files are parsed (in a process pool),
+        deleted files are removed. Returns the number of parsed, unchanged and removed files."""
+        stored = {path: (mtime_ns, size) for path, mtime_ns, size in
+                  self.connection.execute("SELECT path, mtime_ns, size FROM tools")}
+
+        # 1 - stat of every tool file (cheap compared to parsing them)
+        current = {}
+        for category in sorted(os.listdir(base_folder)):
+            category_path = os.path.join(base_folder, category)
+            if os.path.isdir(category_path):
+                for root, _, files in os.walk(category_path):
+                    for file in files:
+                        if file.endswith('.json'):
+                            file_path = os.path.join(root, file)
+                            stat = os.stat(file_path)
+                            current[file_path] = (category, stat.st_mtime_ns, stat.st_size)
+        changed = [path for path, (_, mtime_ns, size) in current.items() if stored.get(path) != (mtime_ns, size)]
+        # only the files of this tree are removed, the manifest may hold other trees
+        base_prefix = os.path.join(base_folder, "")
+        removed = [path for path in stored if path not in current and path.startswith(base_prefix)]
+
+        # 2 - parsing the new and modified files
+        if len(changed) > chunksize and num_workers != 1:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                features = list(executor.map(tool_features, changed, chunksize=chunksize))
+        else:
+            features = [tool_features(path) for path in changed]
+
+        rows = []
+        for path, tool in zip(changed, features):
+            category, mtime_ns, size = current[path]
+            if tool is None:
+                rows.append((path, category, mtime_ns, size, 0, None, None, None, None))
+            else:
+                rows.append((path, category, mtime_ns, size, 1, tool["popularity_score"], tool["api_list_length"],
+                             int(tool["has_parameters"]), tool["description_words"]))
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO tools VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.executemany("DELETE FROM tools WHERE path = ?", [(path,) for path in removed])
+
+        return {"parsed": len(changed), "unchanged": len(current) - len(changed), "removed": len(removed)}
+
+    def select(self, base_folder: str, number_of_APIs_per_category: int = 5, max_number_API_methods: int = 30,
+               min_description_words: int = 5) -> Dict[str, List[Tuple[str, float, int]]]:
+        """Top tools per category (same criteria and order as `ToolBenchPreProcessing.get_top_popularity_scores`)."""
+        rows = self.connection.execute("""
+            SELECT category, path, popularity_score, api_list_length FROM (
+                SELECT category, path, popularity_score, api_list_length,
+                       ROW_NUMBER() OVER (PARTITION BY category
+                                          ORDER BY popularity_score DESC, api_list_length, path) AS rank
+                FROM tools
+                WHERE valid = 1 AND has_parameters = 1 AND description_words >= ? AND api_list_length <= ?
+                      AND substr(path, 1, ?) = ?)
+            WHERE rank <= ?
+            ORDER BY category, rank""",
+            (min_description_words, max_number_API_methods, len(os.path.join(base_folder, "")), os.path.join(base_folder, ""),
+             number_of_APIs_per_category))
+
+        apis = {}
+        for category, path, popularity_score, api_list_length in rows:
+            apis.setdefault(category, []).append((path, popularity_score, api_list_length))
+        return apis
+
+    def close(self) -> None:
+        self.connection.close()
+
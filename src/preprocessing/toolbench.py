@@ -10,9 +10,11 @@ Criteria for selecting high-quality OAS:
 
 import os
 import json
-import shutil
+import heapq
 import random
-from typing import List
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 
 class ToolBenchPreProcessing:
@@ -83,67 +85,71 @@ class ToolBenchPreProcessing:
                     top_scores = sorted(scores, key=lambda x: (-x[1], x[2], x[0]))[:number_of_APIs_per_category]
                     self.apis[category] = top_scores
 
+    def scan_top_popularity_scores(self, number_of_APIs_per_category: int = 5, max_number_API_methods: int = 30,
+                                   num_workers: int = None, chunksize: int = 64):
+        """Same selection as `get_top_popularity_scores`, with the tool files parsed by a process pool and
+        a bounded heap per category keeping only the top `number_of_APIs_per_category` tools (no full sort)."""
+        self.apis = {}
+
+        # listing the tool files of each category (cheap compared to parsing them)
+        tool_files = []
+        for category in sorted(os.listdir(self.base_folder)):
+            category_path = os.path.join(self.base_folder, category)
+            if os.path.isdir(category_path):
+                for root, _, files in os.walk(category_path):
+                    tool_files.extend((category, os.path.join(root, file)) for file in files if file.endswith('.json'))
+
+        heaps = {}
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            scores = executor.map(partial(score_tool, max_number_API_methods=max_number_API_methods),
+                                  [file_path for _, file_path in tool_files], chunksize=chunksize)
+            for (category, _), score in zip(tool_files, scores):
+                if score is None:
+                    continue
+                heap = heaps.setdefault(category, [])
+                heapq.heappush(heap, _RankedTool(score))
+                if len(heap) > number_of_APIs_per_category:
+                    heapq.heappop(heap)  # drops the worst ranked tool kept so far
+
+        for category in sorted(heaps):
+            self.apis[category] = [ranked.score for ranked in sorted(heaps[category], reverse=True)]
+
+    def select_from_manifest(self, manifest, number_of_APIs_per_category: int = 5, max_number_API_methods: int = 30,
+                             num_workers: int = None):
+        """Same selection as `get_top_popularity_scores`, queried from a `ToolManifest` (only the tool files
+        modified since the last run are parsed)."""
+        print(f"Manifest refreshed: {manifest.refresh(self.base_folder, num_workers=num_workers)}")
+        self.apis = manifest.select(self.base_folder, number_of_APIs_per_category, max_number_API_methods)
+
         # copy the original files from the dataset to a new folder
-    def save_apis(self, number_of_apis_per_category: str = 5):
+    def save_apis(self, number_of_apis_per_category: int = 5, num_workers: int = None):
+        """Copy the selected files to the new folder, merging their required/optional parameters into `parameters`.
+        Each file is read once, transformed and written atomically (temporary file + rename), in a process pool."""
         # Create new folder if it doesn't exist
         if not os.path.exists(self.new_folder):
             os.makedirs(self.new_folder)
 
-        category_idx = 0
+        jobs = []
         for category, scores in self.apis.items():
             # Create folder with the Category if it does not exist
             if not os.path.exists(self.new_folder+'/'+category):
                 os.makedirs(self.new_folder+'/'+category)
 
-            # Ensure we only copy the first two files per category
-            copied_count = 0
             for file_path, _, _ in scores[:number_of_apis_per_category]:
-                try:
-                    # Modify the copied file to add 'category' field
-                    new_file_name = f"{category}/{os.path.basename(file_path)}"
-                    new_file_path = os.path.join(self.new_folder, new_file_name)
-                    shutil.copy(file_path, new_file_path)
-                    copied_count += 1
-
-                    with open(new_file_path, 'r+') as new_file:
-                        data = json.load(new_file)
-
-                        # Update api_list structure
-                        updated_api_list = []
-                        for api_method in data['api_list']:
-                            required_params = api_method.get('required_parameters', [])
-                            optional_params = api_method.get('optional_parameters', [])
-                            
-                            # Combine required and optional parameters into a single list
-                            parameters = []
-                            for param in required_params:
-                                param['required'] = True
-                                parameters.append(param)
-
-                            for param in optional_params:
-                                param['required'] = False
-                                parameters.append(param)
-                            
-                            # Update api_method with combined parameters
-                            api_method['parameters'] = parameters
-                            # Remove old keys
-                            api_method.pop('required_parameters', None)
-                            api_method.pop('optional_parameters', None)
-                            
-                            updated_api_list.append(api_method)
-
-                        data['api_list'] = updated_api_list
-                        data['category'] = category
-                        new_file.seek(0)
-                        json.dump(data, new_file, indent=4)
-                        new_file.truncate()
+                new_file_path = os.path.join(self.new_folder, f"{category}/{os.path.basename(file_path)}")
+                jobs.append((file_path, new_file_path, category))
 
-                    print(f"Copied and modified: {new_file_path}")
+        if num_workers == 1:
+            errors = [transform_tool(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                errors = executor.map(transform_tool, *zip(*jobs), chunksize=16) if jobs else []
 
-                except (IOError, OSError, json.JSONDecodeError) as e:
-                    print(f"Error processing file {file_path}: {e}")
-
-            category_idx+=1
+        for (file_path, new_file_path, _), error in zip(jobs, errors):
+            if error is None:
+                print(f"Copied and modified: {new_file_path}")
+            else:
+                print(f"Error processing file {file_path}: {error}")
 
     def print_top_scores(self):
         for category, scores in self.apis.items():
@@ -153,12 +159,118 @@ class ToolBenchPreProcessing:
             print()
 
 
+def transform_tool(file_path: str, new_file_path: str, category: str) -> Optional[str]:
+    """Normalise a ToolBench file (required/optional parameters merged into `parameters`, category added) and
+    write it to `new_file_path` atomically. Returns the error message if the file could not be processed."""
+    try:
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+
+        # Update api_list structure
+        updated_api_list = []
+        for api_method in data['api_list']:
+            required_params = api_method.get('required_parameters', [])
+            optional_params = api_method.get('optional_parameters', [])
+
+            # Combine required and optional parameters into a single list
+            parameters = []
+            for param in required_params:
+                param['required'] = True
+                parameters.append(param)
+
+            for param in optional_params:
+                param['required'] = False
+                parameters.append(param)
+
+            # Update api_method with combined parameters
+            api_method['parameters'] = parameters
+            # Remove old keys
+            api_method.pop('required_parameters', None)
+            api_method.pop('optional_parameters', None)
+
+            updated_api_list.append(api_method)
+
+        data['api_list'] = updated_api_list
+        data['category'] = category
+
+        # a crash never leaves a half-written file behind
+        tmp_path = f"{new_file_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=4)
+            os.replace(tmp_path, new_file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return None
+
+    except (IOError, OSError, json.JSONDecodeError) as e:
+        return str(e)
+
+
+def tool_features(file_path: str) -> Optional[Dict]:
+    """Selection features of a tool file (None if it cannot be parsed or has no score/api_list)."""
+    with open(file_path, 'r') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON in file: {file_path}")
+            return None
+
+    if data.get('score') is None or not isinstance(data.get('api_list'), list):
+        return None
+
+    # 1. check if there is any parameter (in general, there were some docs that did not have any parameter)
+    has_parameters = any(
+        'required_parameters' in api_method and api_method['required_parameters'] or
+        'optional_parameters' in api_method and api_method['optional_parameters']
+        for api_method in data['api_list'])
+
+    # 2. check the number of words in the tool description
+    if isinstance(data.get('tool_description'), str):
+        number_of_words_tool_description = len(data['tool_description'].split(" "))
+    else:
+        number_of_words_tool_description = 0
+
+    return {"popularity_score": data['score']['popularityScore'],
+            "api_list_length": len(data['api_list']),
+            "has_parameters": bool(has_parameters),
+            "description_words": number_of_words_tool_description}
+
+
+def score_tool(file_path: str, max_number_API_methods: int = 30) -> Optional[Tuple[str, float, int]]:
+    """(file path, popularity score, number of API methods) of a tool file that passes the selection criteria, else None."""
+    features = tool_features(file_path)
+    if features is None:
+        return None
+    if features["has_parameters"] and features["description_words"] >= 5 and features["api_list_length"] <= max_number_API_methods:
+        return (file_path, features["popularity_score"], features["api_list_length"])
+    return None
+
+
+class _RankedTool:
+    """Heap entry ordered from the worst to the best ranked tool (same key as the sort: -popularity, size, path),
+    so the root of a bounded heap is the next tool to drop."""
+    __slots__ = ("score", "key")
+
+    def __init__(self, score: Tuple[str, float, int]):
+        self.score = score
+        self.key = (-score[1], score[2], score[0])
+
+    def __lt__(self, other: "_RankedTool") -> bool:
+        return self.key > other.key
+
+
 def main():
+    from preprocessing.manifest import ToolManifest
+
     base_folder = '/home/vitor/Documents/phd/other works/ToolBench/data/data/toolenv/tools'         # path from the ToolBench dataset
     new_folder = './dataset/tools'
 
+    manifest_path = './dataset/toolbench_manifest.sqlite'  # selection features of every tool file, refreshed incrementally
+
     processor = ToolBenchPreProcessing(base_folder, new_folder)
-    processor.get_top_popularity_scores(number_of_APIs_per_category=5, max_number_API_methods=30)
+    processor.select_from_manifest(ToolManifest(manifest_path), number_of_APIs_per_category=5, max_number_API_methods=30)
     processor.print_top_scores()
     # processor.save_apis(number_of_apis_per_category=5)
 
@@ -0,0 +1,135 @@
+"""
+Columnar store (Parquet) of the generated utterances: one row per utterance, so consumers read only the
+columns and APIs they need instead of parsing every nested JSON document.
+
+Columns:
+* file, llm, prompt: source file name and generation metadata
+* category, api, api_description
+* method_index, method, method_description, method_parameters (JSON of the method parameters, with constraints)
+* utterance_index, utterance, parameters (JSON of the utterance parameters)
+* utterances_error: the stored value when the utterances of a method could not be generated (no utterance rows then)
+
+Methods without utterances are kept as a single row with null utterance, so the API documents can be rebuilt.
+The size and modification time of every exported file are kept in the schema metadata ("sources"), so consumers
+only read the files that did not change since the export (`fresh_files`).
+"""
+
+import os
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Dict, List, Optional, Set
+
+SCHEMA = pa.schema([
+    ("file", pa.string()),
+    ("llm", pa.string()),
+    ("prompt", pa.string()),
+    ("category", pa.string()),
+    ("api", pa.string()),
+    ("api_description", pa.string()),
+    ("method_index", pa.int32()),
+    ("method", pa.string()),
+    ("method_description", pa.string()),
+    ("method_parameters", pa.string()),
+    ("utterance_index", pa.int32()),
+    ("utterance", pa.string()),
+    ("parameters", pa.string()),
+    ("utterances_error", pa.string()),
+])
+
+
+def store_path(utterances_folder: str) -> str:
+    """Location of the store of an utterances folder (<llm>/<prompt>/utterances.parquet)."""
+    return os.path.join(os.path.dirname(os.path.normpath(utterances_folder)), "utterances.parquet")
+
+
+def source_manifest(utterances_folder: str) -> Dict[str, List[int]]:
+    """Size and modification time (ns) of the API documents of an utterances folder, keyed by file name."""
+    manifest = {}
+    for filename in os.listdir(utterances_folder):
+        if filename.endswith(".json"):
+            stat = os.stat(os.path.join(utterances_folder, filename))
+            manifest[filename] = [stat.st_size, stat.st_mtime_ns]
+    return manifest
+
+
+def fresh_files(path: str, utterances_folder: str) -> Set[str]:
+    """Files of the utterances folder whose rows in the store are up to date (same size and modification time
+    as when exported). Empty when the store does not exist or was exported without the sources metadata."""
+    if not os.path.exists(path):
+        return set()
+    sources = (pq.read_schema(path).metadata or {}).get(b"sources")
+    if sources is None:
+        return set()
+    exported = json.loads(sources)
+    return {filename for filename, stat in source_manifest(utterances_folder).items() if exported.get(filename) == stat}
+
+
+def export_utterances(utterances_folder: str, output_path: str, llm: str = "", prompt: str = "",
+                      row_group_size: int = 20000) -> int:
+    """Flatten all the API documents of an utterances folder into a Parquet file. Returns the number of rows."""
+    columns = {field.name: [] for field in SCHEMA}
+    manifest = source_manifest(utterances_folder)  # before reading: files changed during the export are stale
+
+    def add_row(**row):
+        for name in columns:
+            columns[name].append(row.get(name))
+
+    # files are sorted so row groups cover contiguous files (predicate pushdown on file/api)
+    for filename in sorted(manifest):
+        with open(os.path.join(utterances_folder, filename), "r") as f:
+            data = json.load(f)
+        api = data.get('name') or data.get('tool_name', '')
+        api_description = data.get('description') or data.get('tool_description', '')
+        api_methods = data.get('api_methods') or data.get('api_list', [])
+
+        for method_index, api_method in enumerate(api_methods):
+            method_row = {"file": filename, "llm": llm, "prompt": prompt, "category": data.get('category', ''),
+                          "api": api, "api_description": api_description, "method_index": method_index,
+                          "method": api_method.get('name', ''), "method_description": api_method.get('description', ''),
+                          "method_parameters": json.dumps(api_method.get('parameters', []), ensure_ascii=False)}
+            utterances = api_method.get('utterances', [])
+            if not isinstance(utterances, list):
+                add_row(**method_row, utterances_error=str(utterances))
+            elif not utterances:
+                add_row(**method_row)
+            for utterance_index, utterance in enumerate(utterances if isinstance(utterances, list) else []):
+                add_row(**method_row, utterance_index=utterance_index, utterance=utterance.get('utterance', ''),
+                        parameters=json.dumps(utterance.get('parameters', {}), ensure_ascii=False))
+
+    table = pa.table(columns, schema=SCHEMA.with_metadata({"sources": json.dumps(manifest)}))
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=row_group_size, compression="zstd")
+    os.replace(tmp_path, output_path)
+    return table.num_rows
+
+
+def read_utterances(path: str, columns: Optional[List[str]] = None, filters=None) -> pa.Table:
+    """Read the store with column projection and predicate pushdown (pyarrow `filters`, e.g. [("category", "=", "Data")])."""
+    return pq.read_table(path, columns=columns, filters=filters)
+
+
+def load_documents(path: str, files: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """Rebuild the API documents ({name, description, category, api_methods: [...]}) of the given files
+    (all of them if None), keyed by file name, in the format expected by the evaluation metrics."""
+    filters = [("file", "in", list(files))] if files is not None else None
+    rows = read_utterances(path, filters=filters).to_pylist()
+
+    documents = {}
+    for row in rows:
+        document = documents.setdefault(row["file"], {"name": row["api"], "description": row["api_description"],
+                                                      "category": row["category"], "api_methods": []})
+        api_methods = document["api_methods"]
+        if not api_methods or api_methods[-1]["index"] != row["method_index"]:
+            api_methods.append({"index": row["method_index"], "name": row["method"],
+                                "description": row["method_description"],
+                                "parameters": json.loads(row["method_parameters"]),
+                                "utterances": row["utterances_error"] if row["utterances_error"] is not None else []})
+        if row["utterance"] is not None:
+            api_methods[-1]["utterances"].append({"utterance": row["utterance"], "parameters": json.loads(row["parameters"])})
+
+    for document in documents.values():
+        for api_method in document["api_methods"]:
+            del api_method["index"]
+    return documents
@@ -0,0 +1,144 @@
+"""
+Memory-budgeted tuning of the encoding batch and of the scoring chunk of APIEvaluator.
+
+A short calibration run encodes batches of the longest texts (padded to their longest, as in evaluation) with
+a doubling number of texts, measuring the peak memory above the baseline (CUDA allocator on GPU, resident
+set size on CPU) and the throughput, until the budget is exceeded. The largest batch that fits gives the
+padded-token budget per batch; the score-matrix chunk is the largest number of documents whose scores for
+all the queries fit in the same budget. Results are cached per (model, max_seq_length, host, budget), so
+later runs skip the calibration.
+"""
+
+import os
+import json
+import time
+import socket
+import threading
+import resource
+import numpy as np
+import torch
+from typing import Dict
+from .encoding import TokenizedTexts, encode_tokenized
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "constraintapibench", "autotune.json")
+
+# bytes per query-document pair while scoring a chunk: float32 scores and int64 corpus indexes, concatenated
+# with the running top-k (see APIEvaluator.compute_metrices)
+SCORE_BYTES = 24
+
+
+class PeakMemory:
+    """Peak memory (bytes) above the memory in use when entering the context."""
+
+    def __init__(self, device, interval: float = 0.001):
+        self.device = torch.device(device)
+        self.interval = interval
+        self.peak = 0
+
+    def __enter__(self) -> "PeakMemory":
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            self._baseline = torch.cuda.memory_allocated(self.device)
+        else:
+            # resident set size sampled by a thread (the forward pass releases the GIL)
+            self._baseline = _rss_bytes()
+            self._max_rss = self._baseline
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+            self.peak = torch.cuda.max_memory_allocated(self.device) - self._baseline
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self._max_rss, _rss_bytes()) - self._baseline
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._max_rss = max(self._max_rss, _rss_bytes())
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak since start (Linux: KiB)
+
+
+def host_key(device) -> str:
+    """Host name and device (GPU name or CPU threads) on which a calibration is valid."""
+    device = torch.device(device)
+    if device.type == "cuda":
+        return f"{socket.gethostname()}/{torch.cuda.get_device_name(device)}"
+    return f"{socket.gethostname()}/cpu-{torch.get_num_threads()}"
+
+
+def model_key(model) -> str:
+    """Name (or path) and size of a SentenceTransformer model."""
+    transformer = model[0]
+    config = getattr(getattr(transformer, "auto_model", None), "config", None)
+    name = getattr(config, "_name_or_path", None) or type(transformer).__name__
+    return f"{name}/{sum(p.numel() for p in model.parameters())}"
+
+
+def calibrate(model, tokenized: TokenizedTexts, memory_budget_mb: float, max_batch_size: int = 1024,
+              time_limit: float = 30.0) -> Dict:
+    """Largest batch of the longest texts whose encoding fits in the memory budget (with throughput)."""
+    budget = memory_budget_mb * 1024 * 1024
+    longest = int(np.argmax(tokenized.lengths))
+    length = int(tokenized.lengths[longest])
+    encode_tokenized(model, tokenized, [longest])  # warm-up (lazy allocations)
+
+    probes = []
+    batch_size = 1
+    start = time.perf_counter()
+    while batch_size <= max_batch_size:
+        indices = [longest] * batch_size
+        with PeakMemory(model.device) as peak:
+            probe_start = time.perf_counter()
+            encode_tokenized(model, tokenized, indices, batch_size=batch_size)
+            seconds = time.perf_counter() - probe_start
+        probes.append({"batch_size": batch_size, "peak_mb": round(peak.peak / (1024 * 1024), 1),
+                       "tokens_per_second": round(batch_size * length / seconds, 1)})
+        if peak.peak > budget or time.perf_counter() - start > time_limit:
+            break
+        batch_size *= 2
+
+    fitting = [probe for probe in probes if probe["peak_mb"] * 1024 * 1024 <= budget] or probes[:1]
+    best = fitting[-1]
+    return {"batch_size": best["batch_size"], "max_tokens_per_batch": best["batch_size"] * length,
+            "longest_text": length, "probes": probes}
+
+
+def autotune(model, tokenized: TokenizedTexts, num_queries: int, num_docs: int, memory_budget_mb: float,
+             cache_path: str = DEFAULT_CACHE_PATH, **calibrate_kwargs) -> Dict:
+    """Encoding batch (`batch_size`, `max_tokens_per_batch`) and scoring chunk (`corpus_chunk_size`) for a memory
+    budget, from the cache when this model was already calibrated on this host with the same budget."""
+    key = f"{model_key(model)}|{model.max_seq_length}|{host_key(model.device)}|{memory_budget_mb}"
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+
+    if key in cache and cache[key]["longest_text"] >= int(tokenized.lengths.max()):
+        settings = dict(cache[key])
+    else:
+        settings = calibrate(model, tokenized, memory_budget_mb, **calibrate_kwargs)
+        if cache_path:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            cache[key] = settings
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f, indent=4)
+            os.replace(tmp_path, cache_path)
+
+    # the score matrix of a chunk (all the queries x corpus_chunk_size documents) must fit in the budget
+    chunk = int(memory_budget_mb * 1024 * 1024 // (max(num_queries, 1) * SCORE_BYTES))
+    settings["corpus_chunk_size"] = int(min(max(chunk, 1), max(num_docs, 1)))
+    return settings
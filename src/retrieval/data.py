@@ -0,0 +1,35 @@
+"""
+Loading of the retrieval corpus and test set (corpus.tsv, test.query.txt and qrels.test.tsv).
+"""
+
+import json
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Set, Tuple
+
+
+def load_corpus(path: str) -> Dict[str, str]:
+    """Documents of a corpus.tsv file (docid => document)."""
+    corpus_df = pd.read_csv(path, sep='\t')
+    corpus = {}
+    for row in corpus_df.itertuples():
+        doc_text = json.dumps(row.document_context, ensure_ascii=False) if isinstance(row.document_context, dict) else str(row.document_context)
+        corpus[str(row.docid)] = doc_text
+    return corpus
+
+
+def load_test_set(testing_path: str, query_file: str = "test.query.txt",
+                  qrels_file: str = "qrels.test.tsv") -> Tuple[Dict[str, str], Dict[str, str], Dict[str, Set[str]]]:
+    """Queries (qid => query), corpus (docid => document) and relevant documents (qid => set of docid)."""
+    corpus = load_corpus(Path(testing_path, 'corpus.tsv'))
+    queries_df = pd.read_csv(Path(testing_path, query_file), sep='\t', names=['qid', 'query'])
+    labels_df = pd.read_csv(Path(testing_path, qrels_file), sep='\t', names=['qid', 'useless', 'docid', 'label'])
+
+    queries = {str(row.qid): row.query for row in queries_df.itertuples()}
+
+    relevant_docs = {}
+    for row in labels_df.itertuples():
+        qid, docid = str(row.qid), str(row.docid)
+        relevant_docs.setdefault(qid, set()).add(docid)
+
+    return queries, corpus, relevant_docs
@@ -0,0 +1,168 @@
+"""
+Tokenization reuse for SentenceTransformer encoding.
+
+Texts are tokenized once per tokenizer family (same tokenizer class, vocabulary and settings, and the same
+max_seq_length), so evaluating several models or checkpoints that share a tokenizer does not tokenize the
+test set again. Batches are cut from the tokenized texts and padded to their longest text, exactly as
+`SentenceTransformer.encode` pads them (same order by number of characters, so the same batches). Models with a
+default prompt are not covered (the prompt is added by `encode`, see `default_prompt`). With a token budget, texts are sorted by length and bucketed so
+every batch holds as many texts of similar length as fit in the budget (many short queries, a few long
+documents), which keeps padding minimal.
+"""
+
+import json
+import hashlib
+import weakref
+import numpy as np
+import torch
+from typing import Dict, Iterable, List
+
+
+class TokenizedTexts:
+    """Features of a list of texts padded to the longest one, from which batches are sliced."""
+
+    def __init__(self, features: Dict, padding_side: str = "right", text_lengths: List[int] = None):
+        self.features = features
+        self.lengths = features["attention_mask"].sum(dim=1).numpy()
+        # number of characters of the texts, by which SentenceTransformer.encode orders them
+        self.text_lengths = np.asarray(text_lengths, dtype=np.int64) if text_lengths is not None else self.lengths
+        self.padding_side = padding_side
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def batch(self, indices: List[int]) -> Dict:
+        """Features of the texts at `indices`, padded to the longest of them."""
+        width = int(self.lengths[indices].max())
+        index = torch.as_tensor(indices, dtype=torch.long)
+        columns = slice(None, width) if self.padding_side == "right" else slice(-width, None)
+        batch = {}
+        for name, value in self.features.items():
+            if isinstance(value, torch.Tensor) and value.dim() == 2 and value.shape[0] == len(self):
+                batch[name] = value[index][:, columns]
+            elif isinstance(value, torch.Tensor) and value.dim() == 1 and value.shape[0] == len(self):
+                batch[name] = value[index]
+            else:
+                batch[name] = value
+        return batch
+
+
+_tokenizer_keys = weakref.WeakKeyDictionary()
+
+
+def tokenizer_key(model) -> str:
+    """Hash of everything that determines the tokenization of a SentenceTransformer model."""
+    if model not in _tokenizer_keys:
+        tokenizer = model.tokenizer
+        vocabulary = hashlib.sha256(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode("utf-8")).hexdigest()
+        settings = [type(tokenizer).__name__, vocabulary, model.max_seq_length, tokenizer.padding_side,
+                    getattr(tokenizer, "truncation_side", "right"), getattr(model[0], "do_lower_case", False),
+                    str(tokenizer.special_tokens_map)]
+        _tokenizer_keys[model] = hashlib.sha256(json.dumps(settings, default=str).encode("utf-8")).hexdigest()
+    return _tokenizer_keys[model]
+
+
+class TokenizationCache:
+    """Tokenized texts per (tokenizer family, list of texts)."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def tokenize(self, model, texts: List[str]) -> TokenizedTexts:
+        texts_key = hashlib.sha256(json.dumps(texts, ensure_ascii=False).encode("utf-8")).hexdigest()
+        key = (tokenizer_key(model), texts_key)
+        if key in self._entries:
+            self.hits += 1
+        else:
+            self.misses += 1
+            preprocess = model.preprocess if hasattr(model, "preprocess") else model.tokenize
+            self._entries[key] = TokenizedTexts(preprocess(texts), padding_side=model.tokenizer.padding_side,
+                                                text_lengths=[len(text) for text in texts])
+        return self._entries[key]
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class PretokenizedTexts:
+    """Stand-in for `model.preprocess` (or `model.tokenize`) while training on a fixed set of texts: batches of
+    known texts are sliced from the texts tokenized once, which gives the same features as tokenizing the batch;
+    any other call is forwarded to the model. The `task` of a batch only matters to models with a Router."""
+
+    def __init__(self, tokenized: TokenizedTexts, texts: List[str], fallback, uses_task: bool = True):
+        self.tokenized = tokenized
+        self.positions = {text: position for position, text in enumerate(texts)}
+        self.fallback = fallback
+        self.uses_task = uses_task
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, texts, prompt: str = None, **kwargs) -> Dict:
+        if prompt is None and not any(value is not None for name, value in kwargs.items() if name != "task" or self.uses_task) \
+                and all(isinstance(text, str) and text in self.positions for text in texts):
+            self.hits += 1
+            return self.tokenized.batch(np.array([self.positions[text] for text in texts], dtype=np.int64))
+        self.misses += 1
+        if prompt is not None:
+            kwargs["prompt"] = prompt
+        return self.fallback(texts, **{name: value for name, value in kwargs.items() if value is not None})
+
+
+def use_pretokenized(model, texts: List[str], tokenization_cache: "TokenizationCache") -> PretokenizedTexts:
+    """Make the training batches of `model` (made of `texts`) use the tokenized texts of the cache."""
+    name = "preprocess" if hasattr(model, "preprocess") else "tokenize"
+    uses_task = any(type(module).__name__ == "Router" for module in model)
+    pretokenized = PretokenizedTexts(tokenization_cache.tokenize(model, texts), texts, getattr(model, name), uses_task)
+    setattr(model, name, pretokenized)
+    return pretokenized
+
+
+def default_prompt(model) -> str:
+    """Prompt that `SentenceTransformer.encode` prepends to the texts by default (empty when none is configured)."""
+    name = getattr(model, "default_prompt_name", None)
+    if name is None:
+        return ""
+    return (getattr(model, "prompts", None) or {}).get(name) or ""
+
+
+def length_batches(lengths: np.ndarray, batch_size: int = 32, max_tokens: int = None,
+                   text_lengths: np.ndarray = None) -> List[np.ndarray]:
+    """Positions of the texts grouped in batches, from the longest to the shortest text. Without a token budget
+    every batch has `batch_size` texts, ordered like `SentenceTransformer.encode` by `text_lengths` (characters)
+    when given; with `max_tokens`, texts are ordered by tokens and a batch holds as many texts as fit in the
+    budget once padded to its longest text (at least one)."""
+    if not max_tokens:
+        order = np.argsort(-(text_lengths if text_lengths is not None else lengths))
+        return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    order = np.argsort(-lengths, kind="stable")
+    batches, start = [], 0
+    while start < len(order):
+        size = max(1, max_tokens // max(int(lengths[order[start]]), 1))  # the first text of a batch is its longest
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def encode_tokenized(model, tokenized: TokenizedTexts, indices: Iterable[int] = None, batch_size: int = 32,
+                     max_tokens: int = None) -> torch.Tensor:
+    """Embeddings (on the model device) of the tokenized texts at `indices` (all by default), in that order.
+    Texts are batched from the longest to the shortest, like `SentenceTransformer.encode`, by `batch_size`
+    texts or by `max_tokens` padded tokens (`length_batches`); the embeddings are scattered back in order."""
+    indices = np.arange(len(tokenized)) if indices is None else np.asarray(list(indices), dtype=np.int64)
+    device = model.device
+    model.eval()
+
+    embeddings = None
+    for positions in length_batches(tokenized.lengths[indices], batch_size, max_tokens, tokenized.text_lengths[indices]):
+        features = {name: value.to(device) if isinstance(value, torch.Tensor) else value
+                    for name, value in tokenized.batch(indices[positions]).items()}
+        with torch.no_grad():
+            batch_embeddings = model(features)["sentence_embedding"]
+        if getattr(model, "truncate_dim", None):
+            batch_embeddings = batch_embeddings[:, :model.truncate_dim]
+        if embeddings is None:
+            embeddings = torch.empty((len(indices), batch_embeddings.shape[1]), dtype=batch_embeddings.dtype, device=device)
+        embeddings[torch.as_tensor(positions, device=device)] = batch_embeddings
+    return embeddings if embeddings is not None else torch.empty((0, 0), device=device)
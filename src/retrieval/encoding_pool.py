@@ -0,0 +1,164 @@
+"""
+Multi-process CPU encoding with SentenceTransformer models.
+
+Every worker process loads the model once, with its own torch intra-op thread count (and, on Linux, its own
+set of cores). The texts are cut into the same batches as `SentenceTransformer.encode` (sorted by decreasing
+length), whole batches are shared across the workers, and the embeddings are written by the workers into a
+shared memory buffer, so they are identical to single-process encoding and no tensor is pickled.
+
+The weights of a model being trained in the main process can be sent to the workers (`model=` of `encode`);
+they are shared through torch shared memory and only sent again after the parameters changed.
+"""
+
+import os
+import queue
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional
+
+
+def _worker(rank: int, model_name_or_path: str, max_seq_length: Optional[int], threads: int, cores: Optional[List[int]],
+            tasks, results) -> None:
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name_or_path, device="cpu", trust_remote_code=True)
+    if max_seq_length:
+        model.max_seq_length = max_seq_length
+    dimension = getattr(model, "get_embedding_dimension", None) or model.get_sentence_embedding_dimension
+    results.put(("ready", rank, dimension()))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        try:
+            if task[0] == "weights":
+                model.load_state_dict(task[1])
+                results.put(("weights", rank, None))
+            else:
+                _, shm_name, shape, batches = task
+                shm = SharedMemory(name=shm_name)
+                output = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+                for rows, texts in batches:
+                    output[rows] = model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+                del output
+                shm.close()
+                results.put(("done", rank, None))
+        except Exception as e:
+            results.put(("error", rank, repr(e)))
+
+
+class EncodingPool:
+    """Pool of worker processes encoding texts with the model `model_name_or_path` on CPU."""
+
+    def __init__(self, model_name_or_path: str, workers: int = None, threads_per_worker: int = None,
+                 max_seq_length: int = None, pin_cores: bool = True):
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        self.workers = workers or max(1, len(cpus) // (threads_per_worker or 4))
+        self.threads_per_worker = threads_per_worker or max(1, len(cpus) // self.workers)
+        self.model_name_or_path = model_name_or_path
+
+        context = mp.get_context("spawn")
+        self._results = context.Queue()
+        self._tasks = []
+        self._processes = []
+        for rank in range(self.workers):
+            cores = cpus[rank * self.threads_per_worker:(rank + 1) * self.threads_per_worker] if pin_cores else None
+            tasks = context.Queue()
+            process = context.Process(target=_worker, daemon=True,
+                                      args=(rank, model_name_or_path, max_seq_length, self.threads_per_worker, cores or None, tasks, self._results))
+            process.start()
+            self._tasks.append(tasks)
+            self._processes.append(process)
+        self.dimension = self._wait("ready")[0]
+        self._weights_version = None
+
+    @classmethod
+    def from_config(cls, cfg: Optional[Dict], model_name_or_path: str) -> Optional["EncodingPool"]:
+        """Build the pool from the `encoding_pool` section of a configuration file (None if disabled)."""
+        if not cfg or not cfg.get("enabled", False):
+            return None
+        return cls(model_name_or_path, workers=cfg.get("workers"), threads_per_worker=cfg.get("threads_per_worker"),
+                   pin_cores=cfg.get("pin_cores", True))
+
+    def encode(self, texts: List[str], batch_size: int = 32, model=None, **kwargs) -> np.ndarray:
+        """Embeddings (float32, one row per text) of the texts, batched like `SentenceTransformer.encode`.
+        With `model`, the workers first get its current weights (when they changed since the last call)."""
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size, model)[0]
+        if model is not None:
+            self._sync_weights(model)
+        output = np.empty((len(texts), self.dimension), dtype=np.float32)
+        if not texts:
+            return output
+
+        # same order and batches as SentenceTransformer.encode, then whole batches per worker (balanced by characters)
+        order = np.argsort([-len(text) for text in texts])
+        assignments = [[] for _ in range(self.workers)]
+        load = np.zeros(self.workers)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            worker = int(np.argmin(load))
+            assignments[worker].append((rows, [texts[row] for row in rows]))
+            load[worker] += len(rows) * len(texts[rows[0]])
+
+        shm = SharedMemory(create=True, size=output.nbytes)
+        try:
+            busy = [worker for worker in range(self.workers) if assignments[worker]]
+            for worker in busy:
+                self._tasks[worker].put(("encode", shm.name, output.shape, assignments[worker]))
+            self._wait("done", len(busy))
+            output[:] = np.ndarray(output.shape, dtype=np.float32, buffer=shm.buf)
+        finally:
+            shm.close()
+            shm.unlink()
+        return output
+
+    def close(self) -> None:
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+    def __enter__(self) -> "EncodingPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _sync_weights(self, model) -> None:
+        # the version counters of the parameters change with every in-place update (e.g., an optimizer step)
+        version = tuple((id(p), p._version) for p in model.parameters())
+        if version == self._weights_version:
+            return
+        state = {name: tensor.detach().to("cpu", copy=True).share_memory_() for name, tensor in model.state_dict().items()}
+        for tasks in self._tasks:
+            tasks.put(("weights", state))
+        self._wait("weights")
+        self._weights_version = version
+
+    def _wait(self, kind: str, count: int = None) -> List:
+        """Answers of `count` workers (all by default) to the last task of `kind`."""
+        values, errors = [], []
+        while len(values) + len(errors) < (self.workers if count is None else count):
+            try:
+                message, rank, value = self._results.get(timeout=1)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self._processes):
+                    self.close()
+                    raise RuntimeError("An encoding worker exited before answering.")
+                continue
+            if message == "error":
+                errors.append(f"worker {rank}: {value}")
+            else:
+                values.append(value)
+        if errors:
+            raise RuntimeError(f"Encoding failed ({'; '.join(errors)}).")
+        return values
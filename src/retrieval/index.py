@@ -0,0 +1,195 @@
+"""
+Nearest-neighbor indexes over document embeddings (cosine similarity, numpy on CPU).
+
+* FlatIndex: exact search, the reference for the approximate backends.
+* IVFIndex: inverted file index; documents are clustered with spherical k-means and a query only scores
+  the documents of its `nprobe` closest clusters.
+
+Indexes are built from any SentenceTransformer checkpoint with `build_index`, saved/loaded as .npz files,
+and searched with embeddings (`search`) or texts (`search_texts`).
+"""
+
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+
+
+def _normalize(embeddings) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def _merge_top_k(scores: np.ndarray, indexes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k (sorted by decreasing score) of every row of candidate scores and indexes."""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores, indexes = np.take_along_axis(scores, part, axis=1), np.take_along_axis(indexes, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indexes, order, axis=1)
+
+
+class FlatIndex:
+    """Exact search by brute force, blocked over the queries."""
+    backend = "flat"
+    exact = True
+
+    def __init__(self, query_block_size: int = 1024):
+        self.query_block_size = query_block_size
+        self.embeddings = np.empty((0, 0), dtype=np.float32)
+
+    def add(self, embeddings) -> None:
+        embeddings = _normalize(embeddings)
+        self.embeddings = embeddings if len(self.embeddings) == 0 else np.vstack([self.embeddings, embeddings])
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    def search(self, queries, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores and document indexes of the top-k documents of every query, sorted by decreasing score."""
+        queries = _normalize(queries)
+        all_scores, all_indexes = [], []
+        for start in range(0, len(queries), self.query_block_size):
+            scores = queries[start:start + self.query_block_size] @ self.embeddings.T
+            indexes = np.broadcast_to(np.arange(len(self.embeddings)), scores.shape)
+            scores, indexes = _merge_top_k(scores, indexes, k)
+            all_scores.append(scores)
+            all_indexes.append(indexes)
+        return np.vstack(all_scores), np.vstack(all_indexes)
+
+    def state(self) -> Dict:
+        return {"embeddings": self.embeddings}
+
+    def load_state(self, state: Dict) -> None:
+        self.embeddings = state["embeddings"]
+
+
+class IVFIndex:
+    """Inverted file index: spherical k-means clusters, each query scores the documents of `nprobe` clusters."""
+    backend = "ivf"
+    exact = False
+
+    def __init__(self, nlist: int = None, nprobe: int = 8, iterations: int = 20, seed: int = 0):
+        self.nlist = nlist  # default: about 4 * sqrt(number of documents)
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.embeddings = None
+        self.list_offsets = None  # documents sorted by cluster: cluster c holds rows list_offsets[c]:list_offsets[c + 1]
+        self.doc_indexes = None  # original index of every sorted document
+
+    def add(self, embeddings) -> None:
+        """Cluster the documents (the index is rebuilt with all the documents added so far)."""
+        embeddings = _normalize(embeddings)
+        if self.embeddings is not None:
+            embeddings = np.vstack([self.embeddings[np.argsort(self.doc_indexes)], embeddings])
+        nlist = min(self.nlist or max(1, int(4 * np.sqrt(len(embeddings)))), len(embeddings))
+
+        # spherical k-means (centroids are normalized means, assignment by cosine similarity)
+        rng = np.random.default_rng(self.seed)
+        centroids = embeddings[rng.choice(len(embeddings), size=nlist, replace=False)]
+        for _ in range(self.iterations):
+            assignments = self._assign(embeddings, centroids)
+            counts = np.bincount(assignments, minlength=nlist)
+            offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            empty = counts == 0
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(embeddings[np.argsort(assignments, kind="stable")], offsets[~empty], axis=0)
+            sums[empty] = embeddings[rng.choice(len(embeddings), size=int(empty.sum()))]  # re-seed empty clusters
+            centroids = _normalize(sums)
+        assignments = self._assign(embeddings, centroids)
+
+        order = np.argsort(assignments, kind="stable")
+        self.centroids = centroids
+        self.embeddings = embeddings[order]
+        self.doc_indexes = order
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+
+    def __len__(self) -> int:
+        return 0 if self.embeddings is None else len(self.embeddings)
+
+    def search(self, queries, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores and document indexes of the (approximate) top-k documents of every query."""
+        queries = _normalize(queries)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe] if nprobe < len(self.centroids) \
+            else np.tile(np.arange(len(self.centroids)), (len(queries), 1))
+
+        # every cluster scores the queries probing it; the results are merged into a running top-k
+        top_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        top_indexes = np.full((len(queries), k), -1, dtype=np.int64)
+        query_rows, clusters = np.repeat(np.arange(len(queries)), probes.shape[1]), probes.ravel()
+        order = np.argsort(clusters, kind="stable")
+        query_rows, clusters = query_rows[order], clusters[order]
+        boundaries = np.flatnonzero(np.diff(clusters)) + 1
+        for rows, cluster in zip(np.split(query_rows, boundaries), clusters[np.concatenate([[0], boundaries])]):
+            start, end = self.list_offsets[cluster], self.list_offsets[cluster + 1]
+            if start == end:
+                continue
+            scores = queries[rows] @ self.embeddings[start:end].T
+            indexes = np.broadcast_to(self.doc_indexes[start:end], scores.shape)
+            scores, indexes = _merge_top_k(np.hstack([top_scores[rows], scores]), np.hstack([top_indexes[rows], indexes]), k)
+            top_scores[rows], top_indexes[rows] = scores, indexes
+        return top_scores, top_indexes
+
+    def state(self) -> Dict:
+        return {"centroids": self.centroids, "embeddings": self.embeddings, "list_offsets": self.list_offsets,
+                "doc_indexes": self.doc_indexes, "nprobe": np.array(self.nprobe)}
+
+    def load_state(self, state: Dict) -> None:
+        self.centroids = state["centroids"]
+        self.embeddings = state["embeddings"]
+        self.list_offsets = state["list_offsets"]
+        self.doc_indexes = state["doc_indexes"]
+        self.nlist = len(self.centroids)
+        self.nprobe = int(state["nprobe"])
+
+    @staticmethod
+    def _assign(embeddings: np.ndarray, centroids: np.ndarray, block_size: int = 8192) -> np.ndarray:
+        return np.concatenate([np.argmax(embeddings[start:start + block_size] @ centroids.T, axis=1)
+                               for start in range(0, len(embeddings), block_size)])
+
+
+BACKENDS = {"flat": FlatIndex, "ivf": IVFIndex}
+
+
+def create_index(backend: str = "flat", **params):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown index backend '{backend}' (available: {', '.join(BACKENDS)}).")
+    return BACKENDS[backend](**params)
+
+
+def build_index(model, texts: List[str], backend: str = "flat", batch_size: int = 32, **params):
+    """Encode the documents with a SentenceTransformer model and index them."""
+    index = create_index(backend, **params)
+    index.add(model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False))
+    return index
+
+
+def search_texts(model, index, queries: List[str], k: int = 10, batch_size: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k documents of ad-hoc text queries."""
+    return index.search(model.encode(queries, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False), k)
+
+
+def save_index(index, path: str) -> None:
+    np.savez(path, backend=np.array(index.backend), **index.state())
+
+
+def load_index(path: str):
+    with np.load(path, allow_pickle=False) as data:
+        state = {name: data[name] for name in data.files}
+    index = create_index(str(state.pop("backend")))
+    index.load_state(state)
+    return index
+
+
+def benchmark(index, exact: FlatIndex, queries: np.ndarray, k: int = 10) -> Dict:
+    """Recall@k of the index against exact search and queries per second."""
+    start = time.perf_counter()
+    _, indexes = index.search(queries, k)
+    seconds = time.perf_counter() - start
+    _, exact_indexes = exact.search(queries, k)
+    hits = sum(len(np.intersect1d(found[found >= 0], expected)) for found, expected in zip(indexes, exact_indexes))
+    return {"recall@k": round(hits / exact_indexes.size, 4), "qps": round(len(queries) / seconds, 1)}
@@ -0,0 +1,179 @@
+"""
+Local retrieval service (asyncio + aiohttp) for trained retrievers.
+
+The corpus embeddings are precomputed when the service starts. Concurrent requests are coalesced into
+micro-batches: a request waits at most `batch_window_ms` for others before its batch is encoded and
+searched in one call (in a worker thread, so the event loop keeps accepting requests). Query embeddings
+are kept in an LRU cache.
+
+Endpoints: POST /search {"query": "...", "k": 10} (or {"queries": [...]}), GET /stats, GET /health.
+"""
+
+import time
+import asyncio
+import numpy as np
+from aiohttp import web
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from .data import load_corpus
+from .index import create_index
+
+
+class RetrievalService:
+    def __init__(self, model, corpus: Dict[str, str], batch_window_ms: float = 5, max_batch_size: int = 64,
+                 cache_size: int = 10000, index_backend: str = "flat", index_params: Dict = None,
+                 encode_batch_size: int = 32, stats_window: int = 10000):
+        self.model = model
+        self.doc_ids = list(corpus.keys())
+        self.documents = [corpus[doc_id] for doc_id in self.doc_ids]
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.cache_size = cache_size
+        self.encode_batch_size = encode_batch_size
+
+        # corpus embeddings (computed once)
+        start = time.perf_counter()
+        self.index = create_index(index_backend, **(index_params or {}))
+        self.index.add(model.encode(self.documents, batch_size=encode_batch_size, convert_to_numpy=True, show_progress_bar=False))
+        self.index_seconds = time.perf_counter() - start
+
+        # query embeddings LRU cache (only used from the worker thread)
+        self._cache = OrderedDict()
+
+        # micro-batching state (only used from the event loop)
+        self._pending = []
+        self._timer = None
+        self._executor = ThreadPoolExecutor(max_workers=1)  # the model encodes one batch at a time
+
+        # counters
+        self.requests = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._latencies = deque(maxlen=stats_window)
+        self._batch_sizes = deque(maxlen=stats_window)
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint: str, corpus_path: str, **kwargs) -> "RetrievalService":
+        """Load a SentenceTransformer checkpoint and a corpus.tsv file."""
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(checkpoint, trust_remote_code=True)
+        return cls(model, load_corpus(corpus_path), **kwargs)
+
+    async def search(self, query: str, k: int = 10) -> List[Dict]:
+        """Top-k documents of a query ([{docid, score, document}, ...]); k is capped at the corpus size."""
+        k = min(k, len(self.doc_ids))
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((query, k, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        results = await future
+        self.requests += 1
+        self._latencies.append(time.perf_counter() - start)
+        return results
+
+    def stats(self) -> Dict:
+        latencies = np.array(self._latencies) * 1000
+        batch_sizes = np.array(self._batch_sizes)
+        lookups = self.cache_hits + self.cache_misses
+        return {"requests": self.requests,
+                "documents": len(self.doc_ids),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None,
+                "latency_ms_p99": round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None,
+                "batches": len(batch_sizes),
+                "batch_size_mean": round(float(batch_sizes.mean()), 2) if len(batch_sizes) else None,
+                "batch_size_max": int(batch_sizes.max()) if len(batch_sizes) else None,
+                "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+                "cache_entries": len(self._cache)}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _flush(self) -> None:
+        """Send the pending requests (up to max_batch_size) to the worker thread."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        if batch:
+            asyncio.ensure_future(self._run_batch(batch))
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+
+    async def _run_batch(self, batch: List) -> None:
+        self._batch_sizes.append(len(batch))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._search_batch, [query for query, _, _ in batch], max(k for _, k, _ in batch))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, k, future), query_results in zip(batch, results):
+            if not future.done():
+                future.set_result(query_results[:k])
+
+    def _search_batch(self, queries: List[str], k: int) -> List[List[Dict]]:
+        """Encode the queries that are not cached and search the whole batch (worker thread)."""
+        missing = list(dict.fromkeys(query for query in queries if query not in self._cache))
+        self.cache_misses += len(missing)
+        self.cache_hits += len(queries) - len(missing)
+        if missing:
+            embeddings = self.model.encode(missing, batch_size=self.encode_batch_size, convert_to_numpy=True, show_progress_bar=False)
+            for query, embedding in zip(missing, embeddings):
+                self._cache[query] = embedding
+        query_embeddings = np.stack([self._cache[query] for query in queries])
+        for query in queries:
+            self._cache.move_to_end(query)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        scores, indexes = self.index.search(query_embeddings, k)
+        return [[{"docid": self.doc_ids[index], "score": round(float(score), 6), "document": self.documents[index]}
+                 for score, index in zip(query_scores, query_indexes) if index >= 0]
+                for query_scores, query_indexes in zip(scores, indexes)]
+
+
+def create_app(service: RetrievalService) -> web.Application:
+    """aiohttp application exposing the service."""
+
+    async def search(request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({"error": "the body must be JSON"}, status=400)
+        if not isinstance(body, dict):
+            return web.json_response({"error": "the body must be a JSON object"}, status=400)
+        try:
+            k = int(body.get("k", 10))
+        except (TypeError, ValueError):
+            return web.json_response({"error": "'k' must be an integer"}, status=400)
+        if k < 1:
+            return web.json_response({"error": "'k' must be at least 1"}, status=400)
+        if "queries" in body:
+            if not isinstance(body["queries"], list):
+                return web.json_response({"error": "'queries' must be a list"}, status=400)
+            results = await asyncio.gather(*(service.search(str(query), k) for query in body["queries"]))
+            return web.json_response({"results": results})
+        if "query" not in body:
+            return web.json_response({"error": "missing 'query' or 'queries'"}, status=400)
+        return web.json_response({"results": await service.search(str(body["query"]), k)})
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(service.stats())
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "documents": len(service.doc_ids)})
+
+    async def on_cleanup(app: web.Application) -> None:
+        service.close()
+
+    app = web.Application()
+    app.add_routes([web.post("/search", search), web.get("/stats", stats), web.get("/health", health)])
+    app.on_cleanup.append(on_cleanup)
+    return app
@@ -0,0 +1,52 @@
+"""
+The workers of the encoding pool are spawned, so they import the main script (and api_evaluator) again:
+the log file of the main process must survive a pooled encode.
+"""
+
+import os
+import sys
+import subprocess
+import textwrap
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def tiny_model(tmp_path: Path) -> str:
+    from transformers import BertConfig, BertModel, BertTokenizer
+    from sentence_transformers import SentenceTransformer, models
+
+    bert_path, model_path = tmp_path / "bert", tmp_path / "model"
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "find", "the", "weather", "api"]))
+    BertTokenizer(str(vocab_file)).save_pretrained(bert_path)
+    BertModel(BertConfig(vocab_size=9, hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                         intermediate_size=32)).save_pretrained(bert_path)
+    transformer = models.Transformer(str(bert_path), max_seq_length=16)
+    SentenceTransformer(modules=[transformer, models.Pooling(16)]).save(str(model_path))
+    return str(model_path)
+
+
+def test_log_file_survives_pooled_encode(tmp_path: Path, tiny_model: str):
+    script = tmp_path / "pooled_encode.py"
+    script.write_text(textwrap.dedent(f"""
+        from api_evaluator import logger
+        from retrieval.encoding_pool import EncodingPool
+
+        if __name__ == '__main__':
+            logger.info("before the pool")
+            with EncodingPool({tiny_model!r}, workers=2, threads_per_worker=1, pin_cores=False) as pool:
+                pool.encode(["find the weather", "api", "the api"], batch_size=2)
+            logger.info("after the pool")
+    """))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(ROOT / "src"), str(ROOT / "scripts" / "evaluation")])}
+    subprocess.run([sys.executable, str(script)], cwd=tmp_path, env=env, check=True, timeout=300)
+
+    log = (tmp_path / "log_file.txt").read_text()
+    assert "before the pool" in log
+    assert "after the pool" in log